@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Dict
 
 # 配置中心：集中读取环境变量并设定默认值，便于生产环境注入和本地开发调试
 PROJECT_ROOT = Path(r"D:\Story2Video-main")
@@ -22,6 +23,105 @@ OSS_URL_EXPIRES: int = int(os.getenv("OSS_URL_EXPIRES", "86400"))
 # DashScope API 配置
 DASHSCOPE_API_KEY: str =  ""
 DASHSCOPE_IMAGE_MODEL: str = os.getenv("DASHSCOPE_IMAGE_MODEL", "qwen-image-plus")
+DASHSCOPE_LLM_MODEL: str = os.getenv("DASHSCOPE_LLM_MODEL", "qwen-flash")
 DEFAULT_IMAGE_SIZE: str = os.getenv("DEFAULT_IMAGE_SIZE", "928*1664")
 API_RETRY_ATTEMPTS: int = int(os.getenv("API_RETRY_ATTEMPTS", "3"))
 API_RETRY_BASE_DELAY: int = int(os.getenv("API_RETRY_BASE_DELAY", "2"))
+
+# 渲染任务：后台执行的渲染作业并发上限（独立于 uvicorn 线程）
+RENDER_JOB_WORKERS: int = int(os.getenv("RENDER_JOB_WORKERS", "4"))
+
+# 进程级阶段调度：每个阶段、每个服务商的全局并发上限（所有请求共享）
+STAGE_CONCURRENCY: Dict[str, int] = {
+    "t2i": int(os.getenv("STAGE_T2I_CONCURRENCY", "4")),
+    "optimize": int(os.getenv("STAGE_OPTIMIZE_CONCURRENCY", "10")),
+    "tts": int(os.getenv("STAGE_TTS_CONCURRENCY", "4")),
+    "i2v": int(os.getenv("STAGE_I2V_CONCURRENCY", "10")),
+}
+PROVIDER_CONCURRENCY: Dict[str, int] = {
+    "dashscope-llm": int(os.getenv("PROVIDER_DASHSCOPE_LLM_CONCURRENCY", "16")),
+    "qwen-image": int(os.getenv("PROVIDER_QWEN_IMAGE_CONCURRENCY", "4")),
+    "cosyvoice": int(os.getenv("PROVIDER_COSYVOICE_CONCURRENCY", "4")),
+    "wan2.5": int(os.getenv("PROVIDER_WAN25_CONCURRENCY", "10")),
+}
+# 优先级通道：交互请求（单个分镜重新生成）先于排队中的批量请求出队；
+# 交互任务连续出队该次数且有批量任务在排队时，让批量任务先出队一个，避免批量通道饿死
+PRIORITY_INTERACTIVE_BURST: int = int(os.getenv("PRIORITY_INTERACTIVE_BURST", "3"))
+
+# 渲染作业日志：SQLite（WAL）记录各分镜阶段状态与远端任务 ID，进程重启后据此恢复未完成的渲染
+JOURNAL_PATH: Path = Path(os.getenv("JOURNAL_PATH", str(OUTPUT_DIR / "journal.db")))
+JOURNAL_RESUME_ON_STARTUP: bool = os.getenv("JOURNAL_RESUME_ON_STARTUP", "true").lower() in {"1", "true", "yes"}
+
+# 远端异步任务集中轮询：轮询间隔、单任务超时与并发查询线程数
+TASK_POLL_INTERVAL: float = float(os.getenv("TASK_POLL_INTERVAL", "2"))
+TASK_POLL_TIMEOUT: int = int(os.getenv("TASK_POLL_TIMEOUT", "1200"))
+TASK_POLL_WORKERS: int = int(os.getenv("TASK_POLL_WORKERS", "8"))
+# 自适应轮询：按历史完成耗时分布调整间隔的上限秒数，以及启用自适应所需的最少样本数
+TASK_POLL_MAX_INTERVAL: float = float(os.getenv("TASK_POLL_MAX_INTERVAL", "15"))
+TASK_POLL_MIN_SAMPLES: int = int(os.getenv("TASK_POLL_MIN_SAMPLES", "5"))
+
+# 远端任务追踪日志：每个故事一个 JSONL 文件，只记录状态变化；可选 gzip 压缩，原始响应环形缓冲的字节上限
+TRACE_COMPRESS: bool = os.getenv("TRACE_COMPRESS", "false").lower() in {"1", "true", "yes"}
+TRACE_RING_BYTES: int = int(os.getenv("TRACE_RING_BYTES", str(64 * 1024)))
+
+# 流式下载：分块大小（字节）与断点续传的最大尝试次数
+DOWNLOAD_CHUNK_SIZE: int = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(256 * 1024)))
+DOWNLOAD_MAX_RETRIES: int = int(os.getenv("DOWNLOAD_MAX_RETRIES", "3"))
+
+# 关键帧预处理：I2V 提交前缩放到目标分辨率并重新编码（需要 Pillow，未安装时使用原图）
+KEYFRAME_PREP_ENABLED: bool = os.getenv("KEYFRAME_PREP_ENABLED", "true").lower() in {"1", "true", "yes"}
+KEYFRAME_PREP_FORMAT: str = os.getenv("KEYFRAME_PREP_FORMAT", "jpeg")
+KEYFRAME_PREP_QUALITY: int = int(os.getenv("KEYFRAME_PREP_QUALITY", "90"))
+KEYFRAME_PREP_WORKERS: int = int(os.getenv("KEYFRAME_PREP_WORKERS", "2"))
+
+# wan2.5 图生视频输出分辨率档位
+I2V_RESOLUTION: str = os.getenv("I2V_RESOLUTION", "480P")
+
+# I2V 长尾对冲：分镜耗时超过本批已完成分镜耗时的 I2V_HEDGE_PERCENTILE 分位数 × I2V_HEDGE_FACTOR 时
+# 再提交一个相同任务，先成功者胜出、另一个取消；本批完成数不足 I2V_HEDGE_MIN_COMPLETED 时参考历史耗时分布。
+# 每批最多对冲 I2V_HEDGE_MAX_RATIO 比例的分镜（至少 1 个），控制额外花费
+I2V_HEDGE_ENABLED: bool = os.getenv("I2V_HEDGE_ENABLED", "false").lower() in {"1", "true", "yes"}
+I2V_HEDGE_PERCENTILE: float = float(os.getenv("I2V_HEDGE_PERCENTILE", "0.75"))
+I2V_HEDGE_FACTOR: float = float(os.getenv("I2V_HEDGE_FACTOR", "1.5"))
+I2V_HEDGE_MIN_COMPLETED: int = int(os.getenv("I2V_HEDGE_MIN_COMPLETED", "3"))
+I2V_HEDGE_MAX_RATIO: float = float(os.getenv("I2V_HEDGE_MAX_RATIO", "0.2"))
+I2V_HEDGE_CHECK_INTERVAL: float = float(os.getenv("I2V_HEDGE_CHECK_INTERVAL", "5"))
+
+# 流式分镜：边解析 LLM 流式输出边启动关键帧 T2I
+STORYBOARD_STREAMING: bool = os.getenv("STORYBOARD_STREAMING", "false").lower() in {"1", "true", "yes"}
+
+# 对冲分镜生成：首个请求在 STORYBOARD_HEDGE_DELAY 秒内未返回有效结果时再发起一个并行请求，先通过校验者胜出
+STORYBOARD_HEDGE_ENABLED: bool = os.getenv("STORYBOARD_HEDGE_ENABLED", "false").lower() in {"1", "true", "yes"}
+STORYBOARD_HEDGE_DELAY: float = float(os.getenv("STORYBOARD_HEDGE_DELAY", "8"))
+
+# 批量 prompt 优化：整部故事的 I2V prompt 一次 LLM 请求完成，仅格式不合格的分镜逐个重试
+I2V_PROMPT_BATCH: bool = os.getenv("I2V_PROMPT_BATCH", "false").lower() in {"1", "true", "yes"}
+
+# LLM 输出缓存：相同模型 + 提示词 + 输入直接命中磁盘缓存，不再消耗配额
+LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+LLM_CACHE_DIR: Path = Path(os.getenv("LLM_CACHE_DIR", str(OUTPUT_DIR / "cache" / "llm")))
+LLM_CACHE_MAX_MB: int = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+LLM_CACHE_TTL: int = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+# 跨部署共享的缓存根目录（app_api 与 app_local 默认指向同一位置），分镜 I2V prompt 缓存位于其下
+SHARED_CACHE_DIR: Path = Path(os.getenv("SHARED_CACHE_DIR", os.path.expanduser("~/.cache/story2video")))
+PROMPT_CACHE_DIR: Path = Path(os.getenv("PROMPT_CACHE_DIR", str(SHARED_CACHE_DIR / "i2v_prompt")))
+
+# 分镜视频缓存：内容哈希（关键帧、prompt、旁白、服务商参数）相同的分镜直接复用已生成的片段，跨故事共享
+CLIP_CACHE_ENABLED: bool = os.getenv("CLIP_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+CLIP_CACHE_DIR: Path = Path(os.getenv("CLIP_CACHE_DIR", str(SHARED_CACHE_DIR / "clips")))
+CLIP_CACHE_MAX_MB: int = int(os.getenv("CLIP_CACHE_MAX_MB", "4096"))
+
+# TTS 音频缓存：旁白文本、模型、音色与最短时长策略相同时复用补齐后的 MP3 及其 OSS 对象，跳过合成与上传
+TTS_CACHE_ENABLED: bool = os.getenv("TTS_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+TTS_CACHE_DIR: Path = Path(os.getenv("TTS_CACHE_DIR", str(SHARED_CACHE_DIR / "tts")))
+TTS_CACHE_MAX_MB: int = int(os.getenv("TTS_CACHE_MAX_MB", "512"))
+TTS_CACHE_TTL: int = int(os.getenv("TTS_CACHE_TTL", str(30 * 24 * 3600)))
+
+# CosyVoice 会话池：预先建立的连接数（同时也是每个模型/音色的并发会话上限）与单次合成超时秒数
+TTS_POOL_SIZE: int = int(os.getenv("TTS_POOL_SIZE", os.getenv("PROVIDER_COSYVOICE_CONCURRENCY", "4")))
+TTS_TIMEOUT: float = float(os.getenv("TTS_TIMEOUT", "60"))
+
+# 批量 TTS：整部故事的旁白合并为一次请求（超过字数上限时分组），按字级时间戳切分为分镜音频，失败的分镜逐个合成
+TTS_BATCH_ENABLED: bool = os.getenv("TTS_BATCH_ENABLED", "false").lower() in {"1", "true", "yes"}
+TTS_BATCH_MAX_CHARS: int = int(os.getenv("TTS_BATCH_MAX_CHARS", "2000"))
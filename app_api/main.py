@@ -6,12 +6,21 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.exceptions import RequestValidationError
 
 from app_api.core.logging import logger
-from app_api.api.routes import router as api_router
+from app_api.api.routes import router as api_router, resume_interrupted_renders
 
 
 app = FastAPI(title="Story2Video Model Service", version="1.0.0")
 
 
+@app.on_event("startup")
+async def resume_jobs():
+    from app_api.core.config import JOURNAL_RESUME_ON_STARTUP
+    if JOURNAL_RESUME_ON_STARTUP:
+        count = resume_interrupted_renders()
+        if count:
+            logger.info(f"已恢复 {count} 个中断的渲染作业")
+
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     logger.info(f"HTTP {request.method} {request.url}")
@@ -22,7 +22,10 @@ class Shot(BaseModel):
     narration: Optional[str] = None
     tone: Optional[str] = None
     image_url: Optional[str] = None
+    image_object_key: Optional[str] = Field(None, description="关键帧在 OSS 中的对象 key，渲染时据此重新签名而不必重新上传")
     video_url: Optional[str] = None
+    content_hash: Optional[str] = Field(None, description="上次生成视频时的分镜内容哈希，渲染时据此判断视频能否复用")
+    i2v_prompt: Optional[str] = Field(None, description="优化后的图生视频 prompt，渲染时重新生成")
 
 class CreateStoryboardRequest(BaseModel):
     operation_id: str
@@ -31,6 +34,7 @@ class CreateStoryboardRequest(BaseModel):
     display_name: str
     script_content: str
     style: str
+    use_cache: bool = Field(True, description="是否读取分镜缓存；重试时如需重新生成可置为 false")
 
 class CreateStoryboardResponse(BaseModel):
     operation: OperationStatus
@@ -112,4 +116,19 @@ class RenderVideoRequest(BaseModel):
 
 class RenderVideoResponse(BaseModel):
     operation: OperationStatus
-    video_url: str
\ No newline at end of file
+    video_url: str
+
+
+class ShotProgress(BaseModel):
+    shot_id: str
+    stage: Optional[str] = Field(None, description="当前阶段，如 tts/i2v")
+    status: str = Field(..., description="阶段状态，如 Running/Success/Failed")
+    detail: Optional[str] = None
+
+
+class GetOperationResponse(BaseModel):
+    operation: OperationStatus
+    story_id: Optional[str] = None
+    video_url: Optional[str] = None
+    shots: List[ShotProgress] = []
+
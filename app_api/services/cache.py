@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+磁盘缓存 - 以内容哈希为 key 的 JSON 缓存，支持 TTL 过期与按总大小的 LRU 淘汰
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from app_api.core.logging import logger
+
+
+class DiskCache:
+    def __init__(self, directory: Path, max_bytes: int, ttl_seconds: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """对任意可 JSON 序列化的组成部分取 sha256，作为内容寻址的 key"""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"缓存条目损坏，已删除: {path.name}, err={e}")
+            self._remove(path)
+            return None
+        if self.ttl_seconds > 0 and time.time() - entry.get("created_at", 0) > self.ttl_seconds:
+            self._remove(path)
+            return None
+        try:
+            # 以 mtime 记录最近访问时间，作为 LRU 淘汰依据
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry.get("value")
+
+    def set(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        data = json.dumps({"created_at": time.time(), "value": value}, ensure_ascii=False)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            old_size = path.stat().st_size if path.exists() else 0
+            tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+            tmp.write_text(data, encoding="utf-8")
+            tmp.replace(path)
+        except Exception as e:
+            logger.warning(f"写入缓存失败: {path.name}, err={e}")
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += path.stat().st_size - old_size
+        self._evict_if_needed()
+
+    def delete(self, key: str) -> None:
+        self._remove(self._path(key))
+
+    def _remove(self, path: Path) -> None:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def _evict_if_needed(self) -> None:
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(p.stat().st_size for p in self.directory.glob("*/*.json"))
+            if self._total_bytes <= self.max_bytes:
+                return
+            entries = []
+            for p in self.directory.glob("*/*.json"):
+                try:
+                    st = p.stat()
+                    entries.append((st.st_mtime, st.st_size, p))
+                except OSError:
+                    continue
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            # 淘汰到上限的 90%，避免每次写入都触发全量扫描
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            for _, size, p in entries:
+                if total <= target:
+                    break
+                try:
+                    p.unlink()
+                    total -= size
+                    removed += 1
+                except OSError:
+                    continue
+            self._total_bytes = total
+        if removed:
+            logger.info(f"缓存淘汰 {removed} 个条目: {self.directory}")
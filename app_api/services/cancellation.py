@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Operation 取消令牌 - 每个渲染作业登记一个令牌，取消接口置位后各阶段与重试循环检查并尽快退出
+
+令牌上可以注册回调（如取消在途的远端任务 Future），置位时立即执行；已取消后再注册的回调同步执行。
+"""
+import threading
+from typing import Callable, Dict, List, Optional
+
+from app_api.core.logging import logger
+
+
+class OperationCancelled(Exception):
+    """Operation 已被用户取消"""
+
+
+class CancelToken:
+    def __init__(self, operation_id: str):
+        self.operation_id = operation_id
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run(callback)
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run(callback)
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise OperationCancelled(f"Operation {self.operation_id} 已取消")
+
+    def _run(self, callback: Callable[[], None]) -> None:
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"Operation {self.operation_id} 取消回调执行失败: {e}")
+
+
+_tokens: Dict[str, CancelToken] = {}
+_tokens_lock = threading.Lock()
+
+
+def register_token(operation_id: str) -> CancelToken:
+    """登记（或取回已有的）取消令牌"""
+    with _tokens_lock:
+        token = _tokens.get(operation_id)
+        if token is None:
+            token = _tokens[operation_id] = CancelToken(operation_id)
+        return token
+
+
+def get_token(operation_id: str) -> Optional[CancelToken]:
+    with _tokens_lock:
+        return _tokens.get(operation_id)
+
+
+def release_token(operation_id: str) -> None:
+    """作业结束后移除令牌"""
+    with _tokens_lock:
+        _tokens.pop(operation_id, None)
+
+
+def cancel_operation(operation_id: str) -> bool:
+    """置位取消令牌；Operation 未在执行时返回 False"""
+    token = get_token(operation_id)
+    if token is None:
+        return False
+    logger.info(f"Operation {operation_id} 收到取消请求")
+    token.cancel()
+    return True
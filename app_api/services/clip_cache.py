@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+分镜视频缓存 - 以分镜内容哈希为 key 保存生成好的视频片段，跨故事共享
+
+内容哈希覆盖关键帧字节、优化后的 prompt、旁白与服务商参数；任一项变化即视为新分镜。
+缓存文件优先用硬链接放入/取出，不额外占用磁盘；按总大小做 LRU 淘汰。TTS 音频缓存复用同一实现（suffix=".mp3"）。
+"""
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Dict
+
+from app_api.core.config import CLIP_CACHE_DIR, CLIP_CACHE_MAX_MB
+from app_api.core.logging import logger
+from app_api.services.cache import DiskCache
+from app_api.services.image_prep import file_digest
+
+
+def shot_content_hash(keyframe: Path, prompt: str, narration: str, params: Dict[str, Any]) -> str:
+    """分镜内容哈希：关键帧 sha256 + prompt + 旁白 + 服务商参数"""
+    return DiskCache.make_key(file_digest(keyframe, 64), prompt, narration, params)
+
+
+def _place(src: Path, dst: Path) -> None:
+    """把 src 原子地放到 dst：同一文件系统用硬链接，否则复制"""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists() and os.path.samefile(src, dst):
+        # 已是同一文件的硬链接；此时 rename 不做任何事，临时链接会残留
+        return
+    tmp = dst.with_name(f".{dst.name}.{threading.get_ident()}.tmp")
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ClipCache:
+    def __init__(self, directory: Path, max_bytes: int, suffix: str = ".mp4"):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}{self.suffix}"
+
+    def has(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def restore(self, key: str, target: Path) -> bool:
+        """缓存命中时把片段放到 target 并返回 True"""
+        path = self._path(key)
+        if not path.exists():
+            return False
+        try:
+            _place(path, target)
+            # 以 mtime 记录最近访问时间，作为 LRU 淘汰依据
+            os.utime(path, None)
+            return True
+        except OSError as e:
+            logger.warning(f"读取分镜视频缓存失败: {path.name}, err={e}")
+            return False
+
+    def store(self, key: str, clip: Path) -> None:
+        try:
+            _place(clip, self._path(key))
+        except OSError as e:
+            logger.warning(f"写入分镜视频缓存失败: {clip}, err={e}")
+            return
+        self._evict_if_needed()
+
+    @staticmethod
+    def detach(path: Path) -> None:
+        """path 与缓存条目共享硬链接时换成独立副本，避免后续原地写入（如跨文件系统的 move）污染缓存"""
+        try:
+            if path.stat().st_nlink <= 1:
+                return
+            tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+            shutil.copy2(path, tmp)
+            os.replace(tmp, path)
+        except OSError:
+            return
+
+    def _evict_if_needed(self) -> None:
+        with self._lock:
+            entries = []
+            for p in self.directory.glob(f"*/*{self.suffix}"):
+                try:
+                    st = p.stat()
+                    entries.append((st.st_mtime, st.st_size, p))
+                except OSError:
+                    continue
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            # 淘汰到上限的 90%，硬链接的文件在故事目录中仍然保留
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            for _, size, p in entries:
+                if total <= target:
+                    break
+                try:
+                    p.unlink()
+                    total -= size
+                    removed += 1
+                except OSError:
+                    continue
+        if removed:
+            logger.info(f"分镜视频缓存淘汰 {removed} 个片段: {self.directory}")
+
+
+clip_cache = ClipCache(CLIP_CACHE_DIR, CLIP_CACHE_MAX_MB * 1024 * 1024)
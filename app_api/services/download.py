@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+流式下载 - 分块写入临时文件，中断后用 HTTP Range 续传，校验长度后原子替换到目标路径
+
+内存占用只与分块大小有关，与文件大小无关。
+"""
+import os
+import re
+import time
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+from app_api.core.config import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_MAX_RETRIES
+from app_api.core.logging import logger
+
+_CONTENT_RANGE_TOTAL = re.compile(r"/(\d+)\s*$")
+
+
+def _expected_size(resp: requests.Response, offset: int) -> Optional[int]:
+    if resp.status_code == 206:
+        match = _CONTENT_RANGE_TOTAL.search(resp.headers.get("Content-Range", ""))
+        if match:
+            return int(match.group(1))
+        length = resp.headers.get("Content-Length")
+        return offset + int(length) if length and length.isdigit() else None
+    length = resp.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def download_file(url: str, target_path: Path, max_retries: int = DOWNLOAD_MAX_RETRIES,
+                  timeout: tuple = (10, 60)) -> bool:
+    """
+    下载 url 到 target_path
+
+    Args:
+        url: 资源地址（需支持 GET；支持 Range 时中断后从断点续传，否则从头重新下载）
+        target_path: 目标文件路径，下载完成并校验通过后才会出现
+        max_retries: 最大尝试次数
+        timeout: (连接超时, 两次读取之间的超时) 秒
+
+    Returns:
+        bool: 成功返回 True，失败返回 False
+    """
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    part = target_path.with_name(target_path.name + ".part")
+    # 不同请求可能复用同一目标路径，残留的临时文件内容不可信，只在本次调用内续传
+    part.unlink(missing_ok=True)
+    expected: Optional[int] = None
+
+    for attempt in range(1, max_retries + 1):
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+                if offset and resp.status_code == 416 and expected == offset:
+                    pass  # 上次已完整写入，只是连接在结束前断开
+                else:
+                    resp.raise_for_status()
+                    if offset and resp.status_code != 206:
+                        # 服务端不支持 Range，只能从头下载
+                        logger.info(f"服务端不支持断点续传，重新下载: {url}")
+                        offset = 0
+                    expected = _expected_size(resp, offset) or expected
+                    with open(part, "ab" if offset else "wb") as f:
+                        for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if chunk:
+                                f.write(chunk)
+
+            size = part.stat().st_size
+            if expected is not None and size != expected:
+                if size > expected:
+                    part.unlink(missing_ok=True)
+                raise IOError(f"下载长度不一致: 已写入 {size} bytes，期望 {expected} bytes")
+            os.replace(part, target_path)
+            if attempt > 1:
+                logger.info(f"下载在第 {attempt} 次尝试完成: {target_path}")
+            return True
+        except Exception as e:
+            written = part.stat().st_size if part.exists() else 0
+            logger.warning(f"下载中断 (尝试 {attempt}/{max_retries}, 已写入 {written} bytes): {url}, err={e}")
+            if attempt < max_retries:
+                time.sleep(min(2 ** attempt, 10))
+
+    part.unlink(missing_ok=True)
+    logger.error(f"下载失败，已达到最大重试次数 {max_retries}: {url}")
+    return False
@@ -2,31 +2,81 @@
 图生视频服务 - 使用 DashScope wan2.5-preview API
 """
 # -*- coding: utf-8 -*-
+import itertools
 import random
-import time
 import uuid
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
 from pathlib import Path
 from http import HTTPStatus
-import requests
-import json
+from typing import Any, Callable, Tuple
 import dashscope
 from dashscope import VideoSynthesis
 
-from app_api.core.config import DASHSCOPE_API_KEY, OUTPUT_DIR
+from app_api.core.config import DASHSCOPE_API_KEY, OUTPUT_DIR, I2V_RESOLUTION
+from app_api.services.download import download_file
+from app_api.services.metrics import incr
 from app_api.services.oss import upload_to_oss
+from app_api.services.task_poller import task_poller, RemoteTaskError, SUCCEEDED, FAILED
+from app_api.services.trace import TaskTrace
 from app_api.core.logging import logger
 
 
+# 模型与时长参与分镜内容哈希，改动后已缓存的分镜视频自动失效
+I2V_MODEL = 'wan2.5-i2v-preview'
+I2V_DURATION = 5
+
+# 任务成功后的视频下载放在独立线程池，避免占用轮询线程
+_download_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="i2v-download")
+
+
+def _completed(value: Any) -> Future:
+    future: Future = Future()
+    future.set_result(value)
+    return future
+
+
+def _resolve(future: Future, value: Any) -> None:
+    """设置结果；调用方已取消 Future 时忽略"""
+    try:
+        future.set_result(value)
+    except InvalidStateError:
+        pass
+
+
+def _cancel_remote(task_id: str) -> None:
+    """取消远端任务；wan2.5 只允许取消仍在排队（PENDING）的任务，运行中的任务会被忽略并照常计费"""
+    try:
+        rsp = VideoSynthesis.cancel(task_id, api_key=DASHSCOPE_API_KEY)
+        if rsp.status_code == HTTPStatus.OK:
+            incr("i2v.cancel.remote")
+            logger.info(f"wan2.5-preview 任务已取消: {task_id}")
+        else:
+            incr("i2v.cancel.rejected")
+            logger.info(f"wan2.5-preview 任务无法取消（可能已开始运行）: {task_id}, code: {rsp.code}")
+    except Exception as e:
+        logger.warning(f"取消 wan2.5-preview 任务失败: {task_id}, err={e}")
+
+
+def _download_video(video_url: str, target_path: Path) -> bool:
+    logger.info(f"wan2.5-preview 视频生成成功，正在下载 {video_url}")
+    if download_file(video_url, target_path):
+        logger.info(f"wan2.5-preview 视频下载成功: {video_url} -> {target_path}")
+        return True
+    logger.error(f"wan2.5-preview 视频下载失败: {video_url}")
+    return False
+
+
 def run_i2v(
     start_image: Path, 
     text_prompt: str, 
     target_path: Path, 
     user_id: str | None = None, 
     story_id: str | None = None, 
-    audio_url: str | None = None
+    audio_url: str | None = None,
+    image_url: str | None = None
 ) -> bool:
     """
-    使用 DashScope wan2.5-preview API 生成图生视频
+    使用 DashScope wan2.5-preview API 生成图生视频（同步等待 run_i2v_async 的结果）
     
     Args:
         start_image: 起始图片路径
@@ -35,41 +85,62 @@ def run_i2v(
         user_id: 用户ID
         story_id: 故事ID
         audio_url: 音频URL（可选）
+        image_url: 起始图已有的可访问 URL（可选），提供时不再上传起始图
     
     Returns:
         bool: 成功返回 True，失败返回 False
     """
+    return run_i2v_async(start_image, text_prompt, target_path, user_id, story_id, audio_url, image_url).result()
+
+
+def _trace_dir(user_id: str | None, story_id: str | None) -> Path:
+    return OUTPUT_DIR / (user_id or 'unknown') / (story_id or 'unknown') / 'api_callback'
+
+
+def _submit_task(
+    start_image: Path,
+    text_prompt: str,
+    target_path: Path,
+    user_id: str | None,
+    story_id: str | None,
+    audio_url: str | None,
+    image_url: str | None
+) -> Tuple[str, TaskTrace] | None:
+    """上传起始图（未提供 image_url 时）并创建 wan2.5-preview 任务，返回 (task_id, trace)，失败返回 None"""
+    trace = None
     try:
         if not DASHSCOPE_API_KEY:
             logger.error("DashScope API Key 未配置")
-            return False
+            return None
         
         # 检查起始图文件是否存在
         if not start_image.exists():
             logger.error(f"起始图文件不存在: {start_image}")
-            return False
-        
-        logger.info(
-            f"准备上传起始图到 OSS: {start_image}, "
-            f"文件大小: {start_image.stat().st_size} bytes"
-        )
+            return None
         
-        # 上传起始图到 OSS，得到可访问的 image_url
-        image_url = upload_to_oss(f"users/temp/i2v_inputs/{target_path.stem}.png", start_image)
-        if not image_url:
-            logger.error(
-                f"上传起始图到 OSS 失败，无法提供 image_url 给 wan2.5-preview。文件: {start_image}"
+        if image_url:
+            logger.info(f"复用起始图已有的 OSS URL，跳过上传: {image_url}")
+        else:
+            logger.info(
+                f"准备上传起始图到 OSS: {start_image}, "
+                f"文件大小: {start_image.stat().st_size} bytes"
             )
-            return False
-        
-        logger.info(f"起始图上传成功，image_url: {image_url}")
+            
+            # 上传起始图到 OSS，得到可访问的 image_url
+            image_url = upload_to_oss(f"users/temp/i2v_inputs/{target_path.stem}.png", start_image)
+            if not image_url:
+                logger.error(
+                    f"上传起始图到 OSS 失败，无法提供 image_url 给 wan2.5-preview。文件: {start_image}"
+                )
+                return None
+            
+            logger.info(f"起始图上传成功，image_url: {image_url}")
         
         # 生成 trace id 用于追踪
         trace_id = str(uuid.uuid4())
         
-        # 创建回调记录目录
-        cb_dir = OUTPUT_DIR / (user_id or 'unknown') / (story_id or 'unknown') / 'api_callback'
-        cb_dir.mkdir(parents=True, exist_ok=True)
+        # 回调记录：每个故事一个追踪日志，只记录状态变化
+        trace = TaskTrace(_trace_dir(user_id, story_id), "wan2.5", trace_id)
         
         # 设置 DashScope API Key
         dashscope.api_key = DASHSCOPE_API_KEY
@@ -81,17 +152,18 @@ def run_i2v(
         )
         
         # 构建 API 调用参数
+        resolution = I2V_RESOLUTION
         api_params = {
             'api_key': dashscope.api_key,
-            'model': 'wan2.5-i2v-preview',
+            'model': I2V_MODEL,
             'prompt': text_prompt,
             'img_url': image_url,
-            'resolution': "480P",
+            'resolution': resolution,
             'prompt_extend': False,
             'watermark': False,
             'negative_prompt': "",
             'seed': random.randint(1, 99999),
-            'duration': 5
+            'duration': I2V_DURATION
         }
         
         # 如果提供了 audio_url，添加到参数中
@@ -110,10 +182,7 @@ def run_i2v(
                 'code': rsp.code if hasattr(rsp, 'code') else None,
                 'message': rsp.message if hasattr(rsp, 'message') else None,
             }
-            (cb_dir / f'wan25_async_{trace_id}.json').write_text(
-                json.dumps(async_response, ensure_ascii=False, indent=2), 
-                encoding='utf-8'
-            )
+            trace.record("submit", async_response, state=str(rsp.status_code))
         except Exception as e:
             logger.warning(f"记录异步调用响应失败: {e}")
         
@@ -122,93 +191,138 @@ def run_i2v(
                 f'wan2.5-preview 任务创建失败, status_code: {rsp.status_code}, '
                 f'code: {rsp.code}, message: {rsp.message}'
             )
-            return False
+            trace.close("CREATE_FAILED", detail=str(rsp.message))
+            return None
         
         task_id = rsp.output.task_id
+        trace.task_id = task_id
         logger.info(f"wan2.5-preview 任务创建成功，task_id: {task_id}, trace_id: {trace_id}")
+        return task_id, trace
         
-        # 手动轮询任务状态，留足超时时间
-        max_tries = 600  # 最多轮询 600 次
-        poll_interval = 2  # 每次间隔 2 秒，最长约 20 分钟
-        tries = 0
-        
-        while tries < max_tries:
+    except Exception as e:
+        logger.error(f"wan2.5-preview I2V 调用失败: {e}")
+        if trace is not None:
+            # 压缩模式下记录缓存在内存中，不关闭则该任务的追踪会丢失
+            trace.close("CREATE_FAILED", detail=str(e))
+        return None
+
+
+def run_i2v_async(
+    start_image: Path,
+    text_prompt: str,
+    target_path: Path,
+    user_id: str | None = None,
+    story_id: str | None = None,
+    audio_url: str | None = None,
+    image_url: str | None = None,
+    task_id: str | None = None,
+    on_submitted: Callable[[str], None] | None = None
+) -> Future:
+    """
+    提交 wan2.5-preview 任务后立即返回 Future[bool]，调用线程不等待生成完成；
+    任务状态由 task_poller 统一轮询，成功后在下载线程池中保存视频。
+    调用方取消返回的 Future 时停止轮询并尝试取消远端任务
+
+    task_id 为进程重启前已提交的任务时不再重新提交，直接恢复轮询；
+    新任务创建成功后以 task_id 调用 on_submitted，便于调用方持久化
+    """
+    resumed = bool(task_id)
+    if resumed:
+        logger.info(f"恢复 wan2.5-preview 任务，不再重新提交: {task_id}")
+        trace = TaskTrace(_trace_dir(user_id, story_id), "wan2.5", str(uuid.uuid4()))
+        trace.task_id = task_id
+        trace.record("resume", {"task_id": task_id})
+    else:
+        submitted = _submit_task(start_image, text_prompt, target_path, user_id, story_id, audio_url, image_url)
+        if submitted is None:
+            return _completed(False)
+        task_id, trace = submitted
+        if on_submitted is not None:
             try:
-                # 使用 fetch 方法查询任务状态
-                status_rsp = VideoSynthesis.fetch(task_id)
-                
-                # 记录轮询响应
-                try:
-                    poll_response = {
-                        'status_code': status_rsp.status_code,
-                        'request_id': status_rsp.request_id if hasattr(status_rsp, 'request_id') else None,
-                        'output': status_rsp.output.__dict__ if hasattr(status_rsp, 'output') else None,
-                        'code': status_rsp.code if hasattr(status_rsp, 'code') else None,
-                        'message': status_rsp.message if hasattr(status_rsp, 'message') else None,
-                    }
-                    (cb_dir / f'wan25_poll_{trace_id}_{tries}.json').write_text(
-                        json.dumps(poll_response, ensure_ascii=False, indent=2), 
-                        encoding='utf-8'
-                    )
-                except Exception as e:
-                    logger.warning(f"记录轮询响应失败: {e}")
-                
-                if status_rsp.status_code != HTTPStatus.OK:
-                    logger.warning(
-                        f"轮询状态异常 (try {tries}/{max_tries}): "
-                        f"status_code={status_rsp.status_code}"
-                    )
-                    time.sleep(poll_interval)
-                    tries += 1
-                    continue
-                
-                # 检查任务状态
-                task_status = status_rsp.output.task_status if hasattr(status_rsp.output, 'task_status') else None
-                logger.info(f"任务状态 (try {tries}/{max_tries}): {task_status}")
-                
-                # SUCCEEDED 表示任务完成
-                if task_status == 'SUCCEEDED':
-                    video_url = status_rsp.output.video_url if hasattr(status_rsp.output, 'video_url') else None
-                    if not video_url:
-                        logger.warning(
-                            f"任务成功但未返回 video_url (try {tries}/{max_tries})"
-                        )
-                        time.sleep(poll_interval)
-                        tries += 1
-                        continue
-                    
-                    # 下载视频
-                    logger.info(f"wan2.5-preview 视频生成成功，正在下载 {video_url}")
-                    v = requests.get(video_url, timeout=300)
-                    v.raise_for_status()
-                    with open(target_path, 'wb') as f:
-                        f.write(v.content)
-                    
-                    logger.info(
-                        f"wan2.5-preview 视频下载成功: {video_url} -> {target_path}"
-                    )
-                    return True
-                
-                # FAILED 表示任务失败
-                elif task_status == 'FAILED':
-                    error_msg = status_rsp.message if hasattr(status_rsp, 'message') else 'Unknown error'
-                    logger.error(f"wan2.5-preview 任务失败: {error_msg}")
-                    return False
-                
-                # 其他状态继续等待
-                time.sleep(poll_interval)
-                tries += 1
-                
+                on_submitted(task_id)
             except Exception as e:
-                logger.warning(
-                    f"轮询过程中出现异常 (try {tries}/{max_tries}): {e}"
-                )
-                time.sleep(poll_interval)
-                tries += 1
+                logger.warning(f"记录 wan2.5-preview 任务 ID 失败: {task_id}, err={e}")
+    resolution = I2V_RESOLUTION
+
+    poll_counter = itertools.count()
+
+    def fetch_status() -> Tuple[str, Any]:
+        # 使用 fetch 方法查询任务状态
+        status_rsp = VideoSynthesis.fetch(task_id)
+        tries = next(poll_counter)
         
-        logger.error(f"wan2.5-preview 任务超时未完成，已轮询 {tries} 次")
-        return False
+        # 检查任务状态
+        ok = status_rsp.status_code == HTTPStatus.OK
+        task_status = getattr(status_rsp.output, 'task_status', None) if ok else None
         
-    except Exception as e:
-        logger.error(f"wan2.5-preview I2V 调用失败: {e}")
-        return False
\ No newline at end of file
+        # 记录轮询响应（状态未变化时只进入内存环形缓冲）
+        try:
+            poll_response = {
+                'status_code': status_rsp.status_code,
+                'request_id': status_rsp.request_id if hasattr(status_rsp, 'request_id') else None,
+                'output': status_rsp.output.__dict__ if hasattr(status_rsp, 'output') else None,
+                'code': status_rsp.code if hasattr(status_rsp, 'code') else None,
+                'message': status_rsp.message if hasattr(status_rsp, 'message') else None,
+            }
+            trace.record("poll", poll_response, state=task_status or f"HTTP_{status_rsp.status_code}")
+        except Exception as e:
+            logger.warning(f"记录轮询响应失败: {e}")
+        
+        if not ok:
+            logger.warning(f"轮询状态异常 (try {tries}): status_code={status_rsp.status_code}")
+            return "UNKNOWN", None
+        
+        logger.info(f"任务 {task_id} 状态 (try {tries}): {task_status}")
+        
+        # SUCCEEDED 表示任务完成
+        if task_status == 'SUCCEEDED':
+            video_url = status_rsp.output.video_url if hasattr(status_rsp.output, 'video_url') else None
+            if not video_url:
+                logger.warning(f"任务成功但未返回 video_url (try {tries})")
+                return "UNKNOWN", None
+            return SUCCEEDED, video_url
+        
+        # FAILED 表示任务失败
+        if task_status == 'FAILED':
+            return FAILED, status_rsp.message if hasattr(status_rsp, 'message') else 'Unknown error'
+        
+        # 其他状态继续等待
+        return task_status or "UNKNOWN", None
+
+    result: Future = Future()
+
+    def on_polled(polled: Future) -> None:
+        if polled.cancelled():
+            trace.close("CANCELLED")
+            return
+        exc = polled.exception()
+        if isinstance(exc, RemoteTaskError):
+            logger.error(f"wan2.5-preview 任务失败: {exc}")
+        elif exc is not None:
+            logger.error(f"wan2.5-preview 任务未完成: {exc}")
+        if exc is not None:
+            trace.close("TIMEOUT" if isinstance(exc, TimeoutError) else FAILED, detail=str(exc))
+            _resolve(result, False)
+            return
+        if result.cancelled():
+            # 任务已成功但调用方不再需要结果，跳过下载
+            trace.close(SUCCEEDED, detail="cancelled before download")
+            return
+
+        def on_downloaded(d: Future) -> None:
+            ok = d.exception() is None and d.result()
+            trace.close(SUCCEEDED if ok else "DOWNLOAD_FAILED")
+            _resolve(result, ok)
+
+        _download_executor.submit(_download_video, polled.result(), target_path).add_done_callback(on_downloaded)
+
+    # 按模型 + 分辨率区分耗时分布，轮询间隔随之自适应
+    polling = task_poller.track(task_id, fetch_status, profile=f"wan2.5:{resolution}", resumed=resumed)
+
+    def on_result(f: Future) -> None:
+        if f.cancelled() and polling.cancel():
+            _download_executor.submit(_cancel_remote, task_id)
+
+    result.add_done_callback(on_result)
+    polling.add_done_callback(on_polled)
+    return result
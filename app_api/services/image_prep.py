@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+关键帧预处理 - I2V 提交前把关键帧缩放到目标分辨率并重新编码为 JPEG / WebP
+
+原图保持不变，派生文件写在原图旁边（如 shot_01_keyframe_480p.jpg），原图未更新时直接复用；
+缩放与编码在进程池中执行，避免占用 GIL；子进程以 spawn 方式启动，不继承服务进程中其他线程持有的锁。
+Pillow 未安装或处理失败时返回原图。
+"""
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from app_api.core.config import KEYFRAME_PREP_FORMAT, KEYFRAME_PREP_QUALITY, KEYFRAME_PREP_WORKERS
+from app_api.core.logging import logger
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# 各分辨率档位对应的短边像素
+_SHORT_SIDE = {"480p": 480, "540p": 540, "720p": 720, "1080p": 1080}
+_EXTENSIONS = {"jpeg": "jpg", "webp": "webp"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 服务进程已有调度器、轮询器等线程，fork 出的子进程可能卡在继承来的锁上
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, KEYFRAME_PREP_WORKERS), mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _resize_and_encode(src: str, dst: str, short_side: int, fmt: str, quality: int) -> int:
+    """在子进程中执行：等比缩放到短边 short_side（不放大）并编码，返回输出字节数"""
+    with Image.open(src) as im:
+        im = im.convert("RGB")
+        w, h = im.size
+        scale = short_side / min(w, h)
+        if scale < 1:
+            im = im.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.LANCZOS)
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        save_kwargs = {"quality": quality}
+        if fmt == "jpeg":
+            save_kwargs.update(optimize=True, progressive=True)
+        else:
+            save_kwargs.update(method=4)
+        im.save(tmp, format=fmt.upper(), **save_kwargs)
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
+
+
+def file_digest(path: Path, length: int = 8) -> str:
+    """文件内容的短 sha256，用于生成随内容变化的派生对象 key"""
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()[:length]
+
+
+def prepare_keyframe(keyframe: Path, resolution: str) -> Path:
+    """
+    返回适合提交给 I2V 的关键帧文件
+
+    Args:
+        keyframe: 原始关键帧（PNG）
+        resolution: 目标 I2V 分辨率档位，如 480P / 540p
+
+    Returns:
+        Path: 派生文件路径；不支持的分辨率、Pillow 不可用或处理失败时返回原图路径
+    """
+    short_side = _SHORT_SIDE.get(resolution.lower())
+    fmt = KEYFRAME_PREP_FORMAT.lower()
+    if short_side is None or fmt not in _EXTENSIONS:
+        return keyframe
+    if Image is None:
+        logger.warning("未安装 Pillow，跳过关键帧预处理，直接使用原图")
+        return keyframe
+
+    derived = keyframe.with_name(f"{keyframe.stem}_{resolution.lower()}.{_EXTENSIONS[fmt]}")
+    try:
+        if derived.exists() and derived.stat().st_mtime >= keyframe.stat().st_mtime:
+            return derived
+        size = _get_pool().submit(
+            _resize_and_encode, str(keyframe), str(derived), short_side, fmt, KEYFRAME_PREP_QUALITY
+        ).result()
+        logger.info(
+            f"关键帧预处理完成: {keyframe.name} ({keyframe.stat().st_size} bytes) -> "
+            f"{derived.name} ({size} bytes)"
+        )
+        return derived
+    except Exception as e:
+        logger.warning(f"关键帧预处理失败，使用原图: {keyframe}, err={e}")
+        return keyframe
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+后台作业 - 渲染等长耗时任务在独立线程池中执行，HTTP 请求只负责入队并立即返回
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from app_api.core.config import RENDER_JOB_WORKERS
+from app_api.core.logging import logger
+
+
+_job_executor = ThreadPoolExecutor(max_workers=RENDER_JOB_WORKERS, thread_name_prefix="render-job")
+_jobs: Dict[str, Future] = {}
+_jobs_lock = threading.Lock()
+
+
+def submit_job(operation_id: str, fn: Callable, *args, **kwargs) -> Future:
+    """提交后台作业；同一 operation_id 的作业未结束时直接返回已有 Future，避免重复渲染"""
+    with _jobs_lock:
+        existing = _jobs.get(operation_id)
+        if existing is not None and not existing.done():
+            logger.warning(f"Operation {operation_id} 已在执行中，忽略重复提交")
+            return existing
+        future = _job_executor.submit(fn, *args, **kwargs)
+        _jobs[operation_id] = future
+
+    def _cleanup(f: Future) -> None:
+        with _jobs_lock:
+            if _jobs.get(operation_id) is f:
+                del _jobs[operation_id]
+        exc = f.exception()
+        if exc is not None:
+            logger.error(f"后台作业异常 op={operation_id}: {exc}")
+
+    future.add_done_callback(_cleanup)
+    logger.info(f"后台作业已入队 op={operation_id}")
+    return future
+
+
+def get_job(operation_id: str) -> Optional[Future]:
+    with _jobs_lock:
+        return _jobs.get(operation_id)
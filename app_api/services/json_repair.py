@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+容错 JSON 解析 - 修复 LLM 输出中的常见缺陷，尽量避免因格式问题重新生成
+
+支持的修复：代码块围栏、前后多余文本、结构位置的中文引号/全角标点、字符串内未转义的引号与换行、
+尾随逗号、输出被截断（丢弃最后一个不完整的元素并补齐括号）。
+"""
+import json
+from typing import Any, List, Tuple
+
+_CURLY_QUOTES = "“”"
+_FULLWIDTH_PUNCT = {"：": ":", "，": ","}
+_CLOSE_AFTER_STRING = ("", ":", ",", "}", "]")
+
+
+def _next_significant(text: str, i: int) -> str:
+    while i < len(text) and text[i].isspace():
+        i += 1
+    return text[i] if i < len(text) else ""
+
+
+def _strip_trailing_comma(out: List[str]) -> bool:
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ",":
+        del out[j]
+        return True
+    return False
+
+
+def _close_truncated(out: List[str], cuts: List[Tuple[int, Tuple[str, ...]]]) -> str:
+    """截断修复：回退到最后一个完整闭合的对象/数组之后，再补齐仍未闭合的括号"""
+    for pos, stack in reversed(cuts):
+        if stack:
+            head = out[:pos]
+            _strip_trailing_comma(head)
+            closers = "".join("}" if c == "{" else "]" for c in reversed(stack))
+            return "".join(head) + closers
+    raise ValueError("输出被截断且没有任何完整的元素")
+
+
+def _normalize(text: str, fixes: List[str]) -> str:
+    start = min((i for i in (text.find("{"), text.find("[")) if i != -1), default=-1)
+    if start == -1:
+        raise ValueError("未找到 JSON 起始括号")
+    if "```" in text[:start]:
+        fixes.append("code_fence")
+    elif text[:start].strip():
+        fixes.append("leading_text")
+
+    out: List[str] = []
+    stack: List[str] = []
+    # (输出位置, 该位置之后仍未闭合的括号)；只记录对象/数组闭合处，作为截断时的安全回退点
+    cuts: List[Tuple[int, Tuple[str, ...]]] = []
+    in_string = False
+    curly_open = False
+    escape = False
+    i = start
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+                out.append(c)
+            elif c == "\\":
+                escape = True
+                out.append(c)
+            elif c == '"' or (curly_open and c in _CURLY_QUOTES):
+                # 中文引号包裹的键/值后面常跟全角冒号、逗号
+                closers = _CLOSE_AFTER_STRING + tuple(_FULLWIDTH_PUNCT) if curly_open else _CLOSE_AFTER_STRING
+                if _next_significant(text, i + 1) in closers:
+                    in_string = False
+                    out.append('"')
+                    if c != '"':
+                        fixes.append("curly_quote")
+                elif c == '"':
+                    out.append('\\"')
+                    fixes.append("inner_quote")
+                else:
+                    out.append(c)
+            elif c == "\n":
+                out.append("\\n")
+                fixes.append("raw_newline")
+            else:
+                out.append(c)
+        elif c == '"' or c in _CURLY_QUOTES:
+            in_string = True
+            curly_open = c != '"'
+            if curly_open:
+                fixes.append("curly_quote")
+            out.append('"')
+        elif c in _FULLWIDTH_PUNCT:
+            out.append(_FULLWIDTH_PUNCT[c])
+            fixes.append("fullwidth_punct")
+        elif c in "{[":
+            stack.append(c)
+            out.append(c)
+        elif c in "}]":
+            if _strip_trailing_comma(out):
+                fixes.append("trailing_comma")
+            if stack:
+                stack.pop()
+            out.append(c)
+            cuts.append((len(out), tuple(stack)))
+            if not stack:
+                if text[i + 1:].strip():
+                    fixes.append("code_fence" if "```" in text[i + 1:] else "trailing_text")
+                return "".join(out)
+        else:
+            out.append(c)
+        i += 1
+
+    fixes.append("truncated")
+    return _close_truncated(out, cuts)
+
+
+def repair_json(text: str) -> Tuple[Any, List[str]]:
+    """
+    解析可能有缺陷的 JSON 文本
+
+    Returns:
+        (解析结果, 实际应用的修复类型列表)；无需修复时列表为空
+
+    Raises:
+        ValueError: 修复后仍无法解析
+    """
+    try:
+        return json.loads(text), []
+    except (json.JSONDecodeError, TypeError):
+        pass
+    if not isinstance(text, str):
+        raise ValueError("输入不是字符串")
+
+    fixes: List[str] = []
+    fixed = _normalize(text, fixes)
+    try:
+        obj = json.loads(fixed)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON 修复后仍解析失败: {e}")
+    # 去重并保持首次出现的顺序
+    return obj, list(dict.fromkeys(fixes))
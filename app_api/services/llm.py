@@ -1,16 +1,22 @@
 # -*- coding: utf-8 -*-
 import json
 import time
-import requests
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 
 from app_api.core.config import (
     OUTPUT_DIR, DASHSCOPE_API_KEY, DASHSCOPE_IMAGE_MODEL, DEFAULT_IMAGE_SIZE,
-    API_RETRY_ATTEMPTS, API_RETRY_BASE_DELAY
+    API_RETRY_ATTEMPTS, API_RETRY_BASE_DELAY, DASHSCOPE_LLM_MODEL,
+    STORYBOARD_HEDGE_ENABLED, STORYBOARD_HEDGE_DELAY,
+    LLM_CACHE_ENABLED, LLM_CACHE_DIR, LLM_CACHE_MAX_MB, LLM_CACHE_TTL, PROMPT_CACHE_DIR
 )
 from app_api.core.logging import logger
+from app_api.services.cache import DiskCache
+from app_api.services.download import download_file
+from app_api.services.json_repair import repair_json
+from app_api.services.metrics import incr
+from app_api.services.scheduler import scheduler
 
 # 提前导入dashscope相关模块，避免循环内导入
 try:
@@ -21,66 +27,253 @@ except ImportError as e:
     raise
 
 
-def generate_storyboard_shots(story: str) -> List[Dict]:
-    """调用 DashScope qwen-plus API 生成分镜结构，返回 shots 列表"""
-    system_prompt = (
-        "角色设定：你是一位拥有无限想象力的AI视频导演和金牌编剧。你的首要任务是在任何情况下，都必须根据用户给出的任意概念或一句话，独立脑补并生成一个完整、结构化、严格格式化的 JSON 分镜脚本。\n\n"
-
-        "### 必须完全遵守以下规则：\n"
-        "1. 无论用户输入什么内容，**绝不**提出问题、索要更多信息、要求补充、拒绝生成，或返回与分镜无关的话。\n"
-        "2. 如果用户提供的信息不足，你必须自行想象并补全所有细节，包括人物外貌、场景、画面节奏、光线、情绪、动作等。\n"
-        "3. 在任何情况下都必须输出一个有效的 JSON，且分镜数量必须在 6~10 条之间。\n"
-        "4. 如果某项要求缺失，你必须自动脑补，而不是停下来询问。\n"
-
-        "===============================\n"
-        "【JSON 输出强制格式】\n"
-        "只返回一个包含'shots' 根节点的 JSON 对象，不允许出现对话、不允许出现说明文本、不允许出现 Markdown。\n"
-        "结构如下：\n"
-        "{\n"
-        "  \"shots\": [\n"
-        "    {\n"
-        "      \"sequence\": 1, (整数，从1开始)\n"
-        "      \"subject\": \"(字符串) 画面主体角色\",\n"
-        "      \"detail\": \"(字符串) 包含风格、光线、时序动态、方位的完整中文画面描述\",\n"
-        "      \"narration\": \"(字符串) 不超过30字的中文旁白\",\n"
-        "      \"camera\": \"(字符串) 运镜关键词\",\n"
-        "      \"tone\": \"(字符串) 语音的情感基调(如：平静、紧张、兴奋)\",\n"
-        "      \"sound\": \"(字符串) 中文背景音效描述\"\n"
-        "    }\n"
-        "  ]\n"
-        "}\n"
-
-        "===============================\n"
-        "【风格继承（强制执行）】\n"
-        "- 如果用户输入中包含 style 或任何风格描述，你必须无条件使用用户指定的风格，禁止替换成示例中的写实风格或其他风格。\n"
-        "- detail 字段中的视觉风格必须与用户指定风格完全一致。\n"
-        "- 如果用户未提供风格，你才可自行选择视觉风格。\n"
-
-        "===============================\n"
-        "【字段填充规则】\n"
-        "1. detail（必须包含以下内容）：\n"
-        "   - 视觉风格（写实风格/水墨/电影感/科幻…任选）\n"
-        "   - 光线（必须有：照明风格、方向、阴影、色温）\n"
-        "   - 时序：必须使用“先……然后……最后……”句式\n"
-        "   - 空间方位：如前景/画面左侧/背景等\n"
-        "   - 背景音效：如风声/呼啸声/雨声/机械声等\n"
-
-        "2. camera（必须从以下列表选择且只选一个）：\n"
-        "   - 垂直升降拍摄、水平横移拍摄、镜头推进、镜头后退、\n"
-        "   - 仰视或俯视调整、绕轴横向左旋转、绕轴横向右旋转、\n"
-        "   - 围绕主体拍摄、全方位环绕、锁定主体移动、固定机位\n"
-
-        "3. narration：必须是中文，≤30 字\n"
-
-        "4. 语言要求：所有值都必须是中文\n"
-
-        "===============================\n"
-        "【分镜数量规则】\n"
-        "任意输入都必须自动生成6~10 条分镜，并以你的最佳理解编排情节节奏。\n"
-    )
+# 分镜生成的系统提示词（流式与非流式共用）
+STORYBOARD_SYSTEM_PROMPT = (
+    "角色设定：你是一位拥有无限想象力的AI视频导演和金牌编剧。你的首要任务是在任何情况下，都必须根据用户给出的任意概念或一句话，独立脑补并生成一个完整、结构化、严格格式化的 JSON 分镜脚本。\n\n"
+
+    "### 必须完全遵守以下规则：\n"
+    "1. 无论用户输入什么内容，**绝不**提出问题、索要更多信息、要求补充、拒绝生成，或返回与分镜无关的话。\n"
+    "2. 如果用户提供的信息不足，你必须自行想象并补全所有细节，包括人物外貌、场景、画面节奏、光线、情绪、动作等。\n"
+    "3. 在任何情况下都必须输出一个有效的 JSON，且分镜数量必须在 6~10 条之间。\n"
+    "4. 如果某项要求缺失，你必须自动脑补，而不是停下来询问。\n"
+
+    "===============================\n"
+    "【JSON 输出强制格式】\n"
+    "只返回一个包含'shots' 根节点的 JSON 对象，不允许出现对话、不允许出现说明文本、不允许出现 Markdown。\n"
+    "结构如下：\n"
+    "{\n"
+    "  \"shots\": [\n"
+    "    {\n"
+    "      \"sequence\": 1, (整数，从1开始)\n"
+    "      \"subject\": \"(字符串) 画面主体角色\",\n"
+    "      \"detail\": \"(字符串) 包含风格、光线、时序动态、方位的完整中文画面描述\",\n"
+    "      \"narration\": \"(字符串) 不超过30字的中文旁白\",\n"
+    "      \"camera\": \"(字符串) 运镜关键词\",\n"
+    "      \"tone\": \"(字符串) 语音的情感基调(如：平静、紧张、兴奋)\",\n"
+    "      \"sound\": \"(字符串) 中文背景音效描述\"\n"
+    "    }\n"
+    "  ]\n"
+    "}\n"
+
+    "===============================\n"
+    "【风格继承（强制执行）】\n"
+    "- 如果用户输入中包含 style 或任何风格描述，你必须无条件使用用户指定的风格，禁止替换成示例中的写实风格或其他风格。\n"
+    "- detail 字段中的视觉风格必须与用户指定风格完全一致。\n"
+    "- 如果用户未提供风格，你才可自行选择视觉风格。\n"
+
+    "===============================\n"
+    "【字段填充规则】\n"
+    "1. detail（必须包含以下内容）：\n"
+    "   - 视觉风格（写实风格/水墨/电影感/科幻…任选）\n"
+    "   - 光线（必须有：照明风格、方向、阴影、色温）\n"
+    "   - 时序：必须使用“先……然后……最后……”句式\n"
+    "   - 空间方位：如前景/画面左侧/背景等\n"
+    "   - 背景音效：如风声/呼啸声/雨声/机械声等\n"
+
+    "2. camera（必须从以下列表选择且只选一个）：\n"
+    "   - 垂直升降拍摄、水平横移拍摄、镜头推进、镜头后退、\n"
+    "   - 仰视或俯视调整、绕轴横向左旋转、绕轴横向右旋转、\n"
+    "   - 围绕主体拍摄、全方位环绕、锁定主体移动、固定机位\n"
+
+    "3. narration：必须是中文，≤30 字\n"
+
+    "4. 语言要求：所有值都必须是中文\n"
+
+    "===============================\n"
+    "【分镜数量规则】\n"
+    "任意输入都必须自动生成6~10 条分镜，并以你的最佳理解编排情节节奏。\n"
+)
+
 
+
+def _storyboard_messages(story: str) -> List[Dict[str, str]]:
     # 修复字符串闭合和中文字符问题
     user_message = f"请将以下创意概念扩写并制作成视频分镜脚本：\n【{story}】"
+    return [
+        {"role": "system", "content": STORYBOARD_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message}
+    ]
+
+
+# 对冲分镜请求使用的独立线程池（每次对冲最多占用 2 个线程）
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="storyboard-hedge")
+
+# 分镜结果缓存：key 为 模型 + 系统提示词 + 用户消息 的哈希
+_storyboard_cache = DiskCache(LLM_CACHE_DIR / "storyboard", LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL)
+
+
+def _storyboard_cache_key(story: str) -> str:
+    messages = _storyboard_messages(story)
+    return DiskCache.make_key(DASHSCOPE_LLM_MODEL, messages[0]["content"], messages[1]["content"])
+
+
+def _get_cached_storyboard(story: str, use_cache: bool) -> Optional[List[Dict]]:
+    if not (use_cache and LLM_CACHE_ENABLED):
+        return None
+    cached = _storyboard_cache.get(_storyboard_cache_key(story))
+    if cached:
+        logger.info(f"分镜缓存命中，共 {len(cached)} 个分镜，故事片段: {story[:30]}...")
+    return cached or None
+
+
+def _save_cached_storyboard(story: str, shots: List[Dict]) -> None:
+    # 即使本次请求绕过了缓存读取，也用最新结果刷新缓存
+    if LLM_CACHE_ENABLED:
+        _storyboard_cache.set(_storyboard_cache_key(story), shots)
+
+
+def _normalize_shot(shot: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """将 LLM 返回的单个分镜规整为内部结构，index 为 0 起始的位置"""
+    seq = int(shot.get('sequence', index + 1))
+    narr = (shot.get('narration') or '').strip()
+
+    # 旁白长度限制（≤30字，超长截断并加省略号）
+    if len(narr) > 30:
+        narr = narr[:29] + "…"
+
+    return {
+        'id': f"shot_{seq:02d}",
+        'sequence': seq,
+        'subject': shot.get('subject', ''),
+        'detail': shot.get('detail', ''),
+        'camera': shot.get('camera', ''),
+        'narration': narr,
+        'tone': shot.get('tone', ''),
+    }
+
+
+def _parse_storyboard(data: str) -> List[Dict[str, Any]]:
+    """容错解析 LLM 返回的分镜 JSON，返回原始 shots 列表（未规整）；无法修复时抛出 ValueError"""
+    try:
+        obj, fixes = repair_json(data)
+    except ValueError:
+        incr("storyboard.parse.failed")
+        raise
+    if fixes:
+        incr("storyboard.parse.repaired")
+        for fix in fixes:
+            incr(f"storyboard.repair.{fix}")
+        logger.info(f"分镜 JSON 已修复: {', '.join(fixes)}")
+    else:
+        incr("storyboard.parse.clean")
+
+    shots = obj.get('shots') if isinstance(obj, dict) else obj
+    if not isinstance(shots, list):
+        incr("storyboard.parse.failed")
+        raise ValueError("分镜 JSON 中缺少 shots 数组")
+    return [shot for shot in shots if isinstance(shot, dict)]
+
+
+def _continue_storyboard(messages: List[Dict[str, str]], data: str, shots: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """分镜数量不足时只请求模型续写缺少的分镜，返回合并后的原始 shots 列表"""
+    have = len(shots)
+    incr("storyboard.continue.requested")
+    logger.info(f"分镜数量不足 ({have})，请求模型从第 {have + 1} 条开始续写")
+    follow_up = messages + [
+        {"role": "assistant", "content": data},
+        {"role": "user", "content": (
+            f"以上分镜只有 {have} 条，少于要求的 6 条。请紧接已有情节，从 sequence {have + 1} 开始继续补充 "
+            f"{6 - have}~{10 - have} 条分镜，字段与格式保持一致，只输出新增的分镜，"
+            "形如 {\"shots\": [...]}，不要重复已有分镜。"
+        )},
+    ]
+    try:
+        extra = _parse_storyboard(call_dashscope_llm(follow_up))
+    except Exception as e:
+        incr("storyboard.continue.failed")
+        logger.warning(f"分镜续写失败: {e}")
+        return shots
+
+    merged = list(shots)
+    for shot in extra[:10 - have]:
+        # 续写结果的 sequence 不可信，按合并后的位置重新编号
+        merged.append({**shot, 'sequence': len(merged) + 1})
+    incr("storyboard.continue.succeeded" if len(merged) >= 6 else "storyboard.continue.failed")
+    return merged
+
+
+def _generate_storyboard_once(story: str) -> List[Dict]:
+    """单次分镜生成：调用 LLM、容错解析、数量修正并规整；结果无效时抛出异常"""
+    messages = _storyboard_messages(story)
+
+    # 调用LLM接口
+    data = call_dashscope_llm(messages)
+
+    # 保存原始响应（确保目录存在）
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    (OUTPUT_DIR / "dashscope_raw.txt").write_text(data, encoding="utf-8")
+
+    # 解析JSON（容错修复）
+    shots = _parse_storyboard(data)
+    if len(shots) > 10:
+        logger.info(f"分镜数量超出上限 ({len(shots)})，截取前 10 条")
+        incr("storyboard.shots.trimmed")
+        shots = shots[:10]
+    elif 0 < len(shots) < 6:
+        shots = _continue_storyboard(messages, data, shots)
+
+    # 验证并处理分镜数据
+    valid_shots = [_normalize_shot(shot, i) for i, shot in enumerate(shots)]
+    count = len(valid_shots)
+    if not 6 <= count <= 10:
+        raise ValueError(f"分镜数量不在 6-10 范围内 ({count})")
+    return valid_shots
+
+
+def _discard_late(future: Future) -> None:
+    """对冲落败的请求：结果直接丢弃，只做计数"""
+    if future.cancelled():
+        incr("storyboard.hedge.cancelled")
+    elif future.exception() is None:
+        incr("storyboard.hedge.discarded")
+        logger.info("对冲分镜请求的迟到结果已丢弃")
+    else:
+        incr("storyboard.hedge.discarded_failed")
+
+
+def _generate_storyboard_hedged(story: str) -> List[Dict]:
+    """
+    对冲生成：先发起主请求，等待 STORYBOARD_HEDGE_DELAY 秒（或主请求提前失败）后再发起一个对冲请求，
+    返回先通过校验的结果；另一个请求未开始则取消，已在执行则结果到达后丢弃
+    """
+    primary = _hedge_executor.submit(_generate_storyboard_once, story)
+    wait([primary], timeout=max(0.0, STORYBOARD_HEDGE_DELAY))
+    if primary.done() and primary.exception() is None:
+        incr("storyboard.hedge.not_needed")
+        return primary.result()
+
+    logger.info(f"分镜主请求 {STORYBOARD_HEDGE_DELAY} 秒内未返回有效结果，发起对冲请求")
+    incr("storyboard.hedge.issued")
+    hedge = _hedge_executor.submit(_generate_storyboard_once, story)
+    pending = {primary, hedge}
+    last_err: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            exc = future.exception()
+            if exc is not None:
+                last_err = exc
+                logger.warning(f"{'对冲' if future is hedge else '主'}分镜请求失败: {exc}")
+                continue
+            incr("storyboard.hedge.won" if future is hedge else "storyboard.hedge.primary_won")
+            for other in pending:
+                other.cancel()
+                other.add_done_callback(_discard_late)
+            return future.result()
+    raise last_err or RuntimeError("对冲分镜请求均失败")
+
+
+def generate_storyboard_shots(story: str, use_cache: bool = True) -> List[Dict]:
+    """
+    调用 DashScope qwen-plus API 生成分镜结构，返回 shots 列表；use_cache=False 时跳过缓存读取
+
+    JSON 有缺陷时先就地修复；分镜过多直接截取前 10 条，过少只请求续写缺少的部分，
+    仍无法得到有效结果时才整体重新生成。开启 STORYBOARD_HEDGE_ENABLED 时每轮生成都以对冲方式发起。
+    """
+    cached = _get_cached_storyboard(story, use_cache)
+    if cached:
+        return cached
+
 
     try:
         logger.info(f"发起 DashScope qwen-plus 请求 (全中文模式), 故事片段: {story[:30]}...")
@@ -89,69 +282,15 @@ def generate_storyboard_shots(story: str) -> List[Dict]:
         
         while attempts < API_RETRY_ATTEMPTS:
             try:
-                # 构造请求消息
-                messages = [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ]
-                
-                # 调用LLM接口
-                data = call_dashscope_llm(messages)
-                
-                # 保存原始响应（确保目录存在）
-                OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-                (OUTPUT_DIR / "dashscope_raw.txt").write_text(data, encoding="utf-8")
-                
-                # 解析JSON（容错处理）
-                json_obj = None
-                try:
-                    json_obj = json.loads(data)
-                except json.JSONDecodeError:
-                    # 尝试提取JSON片段
-                    start = data.find('{')
-                    end = data.rfind('}') + 1
-                    if start != -1 and end != 0:
-                        try:
-                            json_obj = json.loads(data[start:end])
-                        except json.JSONDecodeError as e:
-                            last_err = Exception(f"JSON提取后仍解析失败: {e}")
-                    else:
-                        last_err = Exception("未找到有效JSON片段")
-                
-                if not json_obj:
-                    raise last_err or Exception("JSON解析失败")
-                
-                # 验证并处理分镜数据
-                shots = json_obj.get('shots', [])
-                valid_shots = []
-                for i, shot in enumerate(shots):
-                    seq = int(shot.get('sequence', i + 1))
-                    narr = shot.get('narration', '').strip()
-                    
-                    # 旁白长度限制（≤30字，超长截断并加省略号）
-                    if len(narr) > 30:
-                        narr = narr[:29] + "…"
-                    
-                    valid_shots.append({
-                        'id': f"shot_{seq:02d}",
-                        'sequence': seq,
-                        'subject': shot.get('subject', ''),
-                        'detail': shot.get('detail', ''),
-                        'camera': shot.get('camera', ''),
-                        'narration': narr,
-                        'tone': shot.get('tone', ''),
-                    })
-                
-                # 修复分镜数量判断逻辑（原4-8错误，应为6-10）
-                count = len(valid_shots)
-                if 6 <= count <= 10:
-                    logger.info(f"成功生成 {count} 个中文分镜")
-                    return valid_shots
+                if attempts:
+                    incr("storyboard.regenerate")
+                if STORYBOARD_HEDGE_ENABLED:
+                    valid_shots = _generate_storyboard_hedged(story)
                 else:
-                    logger.warning(f"分镜数量不在 6-10 范围内 ({count})，重新生成 (attempt={attempts+1})")
-                    attempts += 1
-                    time.sleep(API_RETRY_BASE_DELAY ** attempts)
-                    continue
+                    valid_shots = _generate_storyboard_once(story)
+                logger.info(f"成功生成 {len(valid_shots)} 个中文分镜")
+                _save_cached_storyboard(story, valid_shots)
+                return valid_shots
 
             except Exception as e:
                 last_err = e
@@ -171,6 +310,168 @@ def generate_storyboard_shots(story: str) -> List[Dict]:
         raise
 
 
+class ShotStreamParser:
+    """
+    增量解析 {"shots": [...]} 形式的流式输出：每当 shots 数组中的一个分镜对象闭合即返回，
+    不必等待完整 JSON。只跟踪字符串/转义/括号深度，不做完整语法校验。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.done = False
+        self._pos = 0
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """追加一段文本，返回本次新闭合的分镜对象列表"""
+        self.buffer += chunk
+        shots: List[Dict[str, Any]] = []
+        if self.done:
+            return shots
+        if not self._in_array:
+            key = self.buffer.find('"shots"')
+            bracket = self.buffer.find('[', key) if key != -1 else -1
+            if bracket == -1:
+                return shots
+            self._in_array = True
+            self._pos = bracket + 1
+
+        buf = self.buffer
+        i = self._pos
+        while i < len(buf):
+            c = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in '{[':
+                if self._depth == 0 and c == '{':
+                    self._obj_start = i
+                self._depth += 1
+            elif c in '}]':
+                if self._depth == 0:
+                    if c == ']':
+                        self.done = True
+                        i += 1
+                        break
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and self._obj_start is not None:
+                        try:
+                            obj = json.loads(buf[self._obj_start:i + 1])
+                            if isinstance(obj, dict):
+                                shots.append(obj)
+                        except json.JSONDecodeError as e:
+                            logger.warning(f"流式分镜对象解析失败，已跳过: {e}")
+                        self._obj_start = None
+            i += 1
+        self._pos = i
+        return shots
+
+
+def stream_storyboard_shots(story: str, max_shots: int = 10, use_cache: bool = True) -> Iterator[Dict]:
+    """
+    流式调用 DashScope 生成分镜：每解析出一个完整分镜立即 yield（已规整为内部结构），
+    调用方可边生成边启动关键帧 T2I。最多返回 max_shots 个分镜；缓存命中时直接依次返回缓存结果。
+
+    流中途出错或结束时不足 6 个分镜，已返回的分镜保留：先容错解析完整输出找回被跳过的分镜，
+    仍不足时只请求模型续写缺少的部分并继续 yield。一个分镜都没有解析出来时抛出异常。
+    """
+    cached = _get_cached_storyboard(story, use_cache)
+    if cached:
+        yield from cached[:max_shots]
+        return
+
+    if not DASHSCOPE_API_KEY:
+        raise ValueError("DASHSCOPE_API_KEY 未配置")
+
+    logger.info(f"发起 DashScope 流式分镜请求, 故事片段: {story[:30]}...")
+    messages = _storyboard_messages(story)
+    parser = ShotStreamParser()
+    # raw_shots 为模型原始输出，用于续写；shots 为已 yield 的规整结果
+    raw_shots: List[Dict] = []
+    shots: List[Dict] = []
+    started = time.time()
+
+    def emit(shot: Dict[str, Any]) -> Optional[Dict]:
+        if shot in raw_shots:
+            return None
+        normalized = _normalize_shot(shot, len(shots))
+        if any(s['id'] == normalized['id'] for s in shots):
+            return None
+        raw_shots.append(shot)
+        shots.append(normalized)
+        logger.info(f"流式分镜 #{len(shots)} 解析完成 (耗时 {time.time() - started:.1f} 秒): {normalized['id']}")
+        return normalized
+
+    try:
+        responses = Generation.call(
+            api_key=DASHSCOPE_API_KEY,
+            model=DASHSCOPE_LLM_MODEL,
+            messages=messages,
+            result_format="message",
+            enable_thinking=False,
+            stream=True,
+            incremental_output=True
+        )
+        for response in responses:
+            if response.status_code != 200:
+                raise ValueError(
+                    f"DashScope 流式调用返回错误: status_code={response.status_code}, "
+                    f"code={getattr(response, 'code', '未知')}, "
+                    f"message={getattr(response, 'message', '未知')}"
+                )
+            chunk = response.output.choices[0].message.content or ""
+            for shot in parser.feed(chunk):
+                if len(shots) >= max_shots:
+                    break
+                normalized = emit(shot)
+                if normalized is not None:
+                    yield normalized
+            if parser.done or len(shots) >= max_shots:
+                break
+    except Exception as e:
+        if not shots:
+            raise
+        incr("storyboard.stream.interrupted")
+        logger.warning(f"流式分镜中途失败，保留已解析的 {len(shots)} 个分镜: {e}")
+    finally:
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        (OUTPUT_DIR / "dashscope_raw.txt").write_text(parser.buffer, encoding="utf-8")
+
+    if len(shots) < 6:
+        try:
+            # 流式解析会跳过无法单独解析的对象，完整输出经容错修复后可能找回
+            for shot in _parse_storyboard(parser.buffer)[:max_shots]:
+                if len(shots) >= max_shots:
+                    break
+                normalized = emit(shot)
+                if normalized is not None:
+                    yield normalized
+        except ValueError:
+            pass
+    if len(shots) < 6:
+        data = json.dumps({"shots": raw_shots}, ensure_ascii=False)
+        have = len(raw_shots)
+        for shot in _continue_storyboard(messages, data, raw_shots)[have:max_shots]:
+            normalized = emit(shot)
+            if normalized is not None:
+                yield normalized
+
+    logger.info(f"流式分镜生成结束，共 {len(shots)} 个分镜，总耗时 {time.time() - started:.1f} 秒")
+    if 6 <= len(shots) <= max_shots:
+        _save_cached_storyboard(story, shots)
+
+
 def call_dashscope_image_api(prompt: str, target_path: Path, size: str = None, n: int = 1) -> bool:
     """调用 DashScope qwen-image-plus API 生成图片
     
@@ -230,13 +531,9 @@ def call_dashscope_image_api(prompt: str, target_path: Path, size: str = None, n
                                 image_url = item['image']
                                 logger.info(f"图像生成成功，正在下载: {image_url}")
                                 
-                                # 下载并保存图片
-                                img_response = requests.get(image_url, timeout=60)
-                                img_response.raise_for_status()
-                                
-                                target_path.parent.mkdir(parents=True, exist_ok=True)
-                                with open(target_path, 'wb') as f:
-                                    f.write(img_response.content)
+                                # 流式下载并保存图片（支持断点续传）
+                                if not download_file(image_url, target_path):
+                                    raise IOError(f"图片下载失败: {image_url}")
                                 
                                 logger.info(f"图片下载成功: {target_path}")
                                 return True
@@ -299,8 +596,8 @@ def run_t2i_api(prompt: str, target_path: Path) -> bool:
     return success
 
 
-def call_dashscope_llm(messages: List[Dict[str, str]]) -> str:
-    """调用阿里云DashScope API，返回生成的文本内容"""
+def call_dashscope_llm(messages: List[Dict[str, str]], **params: Any) -> str:
+    """调用阿里云DashScope API，返回生成的文本内容；params 透传给 Generation.call（如 response_format）"""
     if not DASHSCOPE_API_KEY:
         raise ValueError("DASHSCOPE_API_KEY 未配置")
     
@@ -314,10 +611,11 @@ def call_dashscope_llm(messages: List[Dict[str, str]]) -> str:
             # 调用生成式API
             response = Generation.call(
                 api_key=DASHSCOPE_API_KEY,
-                model="qwen-flash",
+                model=DASHSCOPE_LLM_MODEL,
                 messages=messages,
                 result_format="message",
-                enable_thinking=False
+                enable_thinking=False,
+                **params
             )
             
             if response.status_code == 200:
@@ -343,35 +641,10 @@ def call_dashscope_llm(messages: List[Dict[str, str]]) -> str:
     raise RuntimeError(f"DashScope API 调用失败: {last_error}")
 
 
-def optimize_i2v_response(i2v_json: Dict[str, Any]) -> Dict[str, Any]:
-    """优化图生视频的 JSON 响应，为 wan2.5-preview 生成优化的画面prompt（并发处理）"""
-    # 深拷贝避免修改原数据
-    optimized_json = json.loads(json.dumps(i2v_json))
-    shots_list = optimized_json.get("shots", [])
-    
-    if not shots_list:
-        logger.warning("分镜列表为空，无需优化")
-        return optimized_json
-    
-    logger.info(f"开始并发优化 {len(shots_list)} 个分镜的 prompt (并发数: 10)")
-    
-    def optimize_single_shot(shot):
-        """优化单个分镜的prompt"""
-        detail = shot.get("detail", "").strip()
-        tone = shot.get("tone", "").strip()
-        camera = shot.get("camera", "").strip()
-        narration = shot.get("narration", "").strip()
-        shot_id = shot.get('id', 'unknown')
-        
-        if not detail:
-            logger.warning(f"Shot {shot_id} 缺少 detail 字段，跳过优化")
-            return shot
-        
-        logger.info(f"优化 shot {shot_id}: detail={detail[:50]}..., tone={tone}, camera={camera}")
-        
-        try:
-            # 构造优化prompt
-            system_prompt = """你是一个专业的AI视频生成提示词专家。你的任务是将分镜信息优化为适合wan2.5-preview模型的画面描述prompt。
+# I2V prompt 模板版本：修改下方提示词时必须同步修改，使旧的缓存结果失效
+I2V_PROMPT_VERSION = "wan25-subtitle-v1"
+
+I2V_PROMPT_SYSTEM = """你是一个专业的AI视频生成提示词专家。你的任务是将分镜信息优化为适合wan2.5-preview模型的画面描述prompt。
 
 **注意：音频已经通过 audio_url 单独提供给模型，所以提示词中不需要描述旁白、配音、音效等音频内容。**
 
@@ -401,7 +674,12 @@ narration: 地球要完了
 
 请只输出最终的描述文本，不要添加任何解释。"""
 
-            user_prompt = f"""请将以下分镜信息优化为画面描述prompt：
+# 分镜 I2V prompt 缓存：结果只取决于 detail/tone/camera/narration 与模板版本，与 app_local 共用缓存目录
+_i2v_prompt_cache = DiskCache(PROMPT_CACHE_DIR, LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL)
+
+
+def _i2v_user_prompt(detail: str, tone: str, camera: str, narration: str) -> str:
+    return f"""请将以下分镜信息优化为画面描述prompt：
 
 detail: {detail}
 tone: {tone}
@@ -416,31 +694,183 @@ narration: {narration}
 5. 结合 camera 描述镜头运动
 6. 使用生动、具体的中文描述"""
 
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-            
-            # 调用LLM优化prompt
-            optimized_prompt = call_dashscope_llm(messages)
-            shot["detail"] = optimized_prompt
-            logger.info(f"Shot {shot_id} 优化完成: {optimized_prompt[:100]}...")
-            
-        except Exception as e:
-            logger.error(f"优化 shot {shot_id} 失败: {e}")
-            logger.warning(f"Shot {shot_id} 使用原始 detail 作为降级方案")
-        
-        return shot
+
+def _shot_prompt_fields(shot: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        "detail": (shot.get("detail") or "").strip(),
+        "tone": (shot.get("tone") or "").strip(),
+        "camera": (shot.get("camera") or "").strip(),
+        "narration": (shot.get("narration") or "").strip(),
+    }
+
+
+def _i2v_prompt_cache_key(fields: Dict[str, str]) -> str:
+    return DiskCache.make_key(
+        "i2v_prompt", I2V_PROMPT_VERSION,
+        fields["detail"], fields["tone"], fields["camera"], fields["narration"]
+    )
+
+
+def build_i2v_prompt(shot: Dict[str, Any]) -> str:
+    """
+    生成单个分镜的 wan2.5 画面 prompt；相同 detail/tone/camera/narration 命中缓存时不调用 LLM
+
+    Returns:
+        str: 优化后的 prompt；缺少 detail 时返回空字符串，LLM 失败时返回原始 detail
+    """
+    fields = _shot_prompt_fields(shot)
+    detail = fields["detail"]
+    shot_id = shot.get('id', 'unknown')
     
-    # 并发处理分镜优化
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(optimize_single_shot, shot): shot for shot in shots_list}
+    if not detail:
+        logger.warning(f"Shot {shot_id} 缺少 detail 字段，跳过优化")
+        return ""
+    
+    cache_key = _i2v_prompt_cache_key(fields)
+    if LLM_CACHE_ENABLED:
+        cached = _i2v_prompt_cache.get(cache_key)
+        if cached and cached.get("prompt"):
+            logger.info(f"Shot {shot_id} prompt 缓存命中，跳过 LLM 优化")
+            return cached["prompt"]
+    
+    logger.info(f"优化 shot {shot_id}: detail={detail[:50]}..., tone={fields['tone']}, camera={fields['camera']}")
+    
+    try:
+        messages = [
+            {"role": "system", "content": I2V_PROMPT_SYSTEM},
+            {"role": "user", "content": _i2v_user_prompt(**fields)}
+        ]
         
-        for future in as_completed(futures):
+        # 调用LLM优化prompt
+        optimized_prompt = call_dashscope_llm(messages)
+        logger.info(f"Shot {shot_id} 优化完成: {optimized_prompt[:100]}...")
+        if LLM_CACHE_ENABLED:
+            _i2v_prompt_cache.set(cache_key, {"prompt": optimized_prompt})
+        return optimized_prompt
+        
+    except Exception as e:
+        logger.error(f"优化 shot {shot_id} 失败: {e}")
+        logger.warning(f"Shot {shot_id} 使用原始 detail 作为降级方案")
+        return detail
+
+
+def optimize_shot_prompt(shot: Dict[str, Any]) -> Dict[str, Any]:
+    """优化单个分镜的 prompt（原地更新 shot["detail"]），失败时保留原始 detail"""
+    prompt = build_i2v_prompt(shot)
+    if prompt:
+        shot["detail"] = prompt
+    return shot
+
+
+I2V_BATCH_INSTRUCTION = """
+
+**批量模式：**
+输入是一个 JSON 数组，每个元素是一个分镜（id、detail、tone、camera、narration）。请对每个分镜分别按上述要求生成画面描述prompt，
+只返回一个 JSON 对象，格式为 {"shots": [{"id": "分镜id", "prompt": "该分镜的最终描述文本"}]}，
+id 必须与输入一一对应，不要遗漏、合并或新增分镜，不要输出任何解释或 Markdown。"""
+
+
+def _valid_batch_prompt(prompt: Any, fields: Dict[str, str]) -> bool:
+    """批量结果的单条校验：非空字符串、长度合理，且包含完整的字幕文本"""
+    if not isinstance(prompt, str) or not prompt.strip():
+        return False
+    if len(prompt) > 2000:
+        return False
+    return not fields["narration"] or fields["narration"] in prompt
+
+
+def optimize_i2v_batch(shots: List[Dict[str, Any]], tenant: str = "default") -> Dict[str, str]:
+    """
+    用一次结构化输出的 LLM 请求优化整部故事所有分镜的 I2V prompt，只对格式不合格的分镜回退到逐个优化
+
+    已命中 prompt 缓存的分镜不进入批量请求；校验通过的结果写入缓存，与 build_i2v_prompt 共用。
+
+    Returns:
+        Dict[str, str]: 分镜 id -> prompt（缺少 detail 的分镜不返回）
+    """
+    results: Dict[str, str] = {}
+    pending: Dict[str, Dict[str, str]] = {}
+    for i, shot in enumerate(shots):
+        shot_id = shot.get('id') or f"shot_{i + 1:02d}"
+        fields = _shot_prompt_fields(shot)
+        if not fields["detail"]:
+            continue
+        cached = _i2v_prompt_cache.get(_i2v_prompt_cache_key(fields)) if LLM_CACHE_ENABLED else None
+        if cached and cached.get("prompt"):
+            results[shot_id] = cached["prompt"]
+        else:
+            pending[shot_id] = fields
+
+    logger.info(f"批量优化 I2V prompt: 共 {len(shots)} 个分镜，缓存命中 {len(results)} 个，待优化 {len(pending)} 个")
+    if not pending:
+        return results
+
+    malformed = set(pending)
+    try:
+        messages = [
+            {"role": "system", "content": I2V_PROMPT_SYSTEM + I2V_BATCH_INSTRUCTION},
+            {"role": "user", "content": json.dumps([{"id": k, **v} for k, v in pending.items()], ensure_ascii=False)}
+        ]
+        data = scheduler.submit(
+            "optimize", call_dashscope_llm, messages,
+            tenant=tenant, provider="dashscope-llm", response_format={"type": "json_object"}
+        ).result()
+        try:
+            json_obj = json.loads(data)
+        except json.JSONDecodeError:
+            start, end = data.find('{'), data.rfind('}') + 1
+            json_obj = json.loads(data[start:end]) if start != -1 and end > start else {}
+        items = json_obj.get("shots", []) if isinstance(json_obj, dict) else []
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            shot_id = str(item.get("id", ""))
+            fields = pending.get(shot_id)
+            if fields is None or not _valid_batch_prompt(item.get("prompt"), fields):
+                continue
+            prompt = item["prompt"].strip()
+            results[shot_id] = prompt
+            malformed.discard(shot_id)
+            if LLM_CACHE_ENABLED:
+                _i2v_prompt_cache.set(_i2v_prompt_cache_key(fields), {"prompt": prompt})
+    except Exception as e:
+        logger.error(f"批量优化 I2V prompt 失败，全部回退到逐个优化: {e}")
+
+    if malformed:
+        logger.warning(f"{len(malformed)} 个分镜的批量结果缺失或不合格，逐个重新优化: {sorted(malformed)}")
+        futures = {
+            shot_id: scheduler.submit("optimize", build_i2v_prompt, {"id": shot_id, **pending[shot_id]},
+                                      tenant=tenant, provider="dashscope-llm")
+            for shot_id in malformed
+        }
+        for shot_id, future in futures.items():
             try:
-                future.result()
+                results[shot_id] = future.result() or pending[shot_id]["detail"]
             except Exception as e:
-                logger.error(f"并发优化过程中出现异常: {e}")
+                logger.error(f"优化 shot {shot_id} 失败: {e}")
+                results[shot_id] = pending[shot_id]["detail"]
+    return results
+
+
+def optimize_i2v_response(i2v_json: Dict[str, Any]) -> Dict[str, Any]:
+    """优化图生视频的 JSON 响应，为 wan2.5-preview 生成优化的画面prompt（并发处理）"""
+    # 深拷贝避免修改原数据
+    optimized_json = json.loads(json.dumps(i2v_json))
+    shots_list = optimized_json.get("shots", [])
+    
+    if not shots_list:
+        logger.warning("分镜列表为空，无需优化")
+        return optimized_json
+    
+    logger.info(f"开始并发优化 {len(shots_list)} 个分镜的 prompt (由调度器 optimize 阶段限流)")
+    
+    # 并发处理分镜优化
+    futures = [scheduler.submit("optimize", optimize_shot_prompt, shot, provider="dashscope-llm") for shot in shots_list]
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as e:
+            logger.error(f"并发优化过程中出现异常: {e}")
     
     logger.info(f"所有分镜prompt 优化完成")
     return optimized_json
\ No newline at end of file
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+MP3 帧级工具 - 只解析帧头计算时长、在末尾追加静音帧补齐时长，不解码、不启动子进程
+
+仅支持 MPEG Layer III、采样率与声道模式一致的常规流；遇到自由格式码率、VBRI 头等不常见情况返回 None，
+由调用方退回 pydub 解码 + 重新编码。
+"""
+import math
+import struct
+from typing import List, Optional, Tuple
+
+# 码率表（kbps），按 MPEG-1 / MPEG-2(2.5) Layer III 区分；下标 0 为自由格式，15 非法
+_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],   # MPEG-1
+    2: [22050, 24000, 16000],   # MPEG-2
+    0: [11025, 12000, 8000],    # MPEG-2.5
+}
+
+
+class _Frame:
+    __slots__ = ("offset", "length", "header", "version", "sample_rate", "mono")
+
+    def __init__(self, offset: int, length: int, header: int, version: int, sample_rate: int, mono: bool):
+        self.offset = offset
+        self.length = length
+        self.header = header
+        self.version = version
+        self.sample_rate = sample_rate
+        self.mono = mono
+
+    @property
+    def samples(self) -> int:
+        return 1152 if self.version == 3 else 576
+
+    @property
+    def side_info_len(self) -> int:
+        if self.version == 3:
+            return 17 if self.mono else 32
+        return 9 if self.mono else 17
+
+
+def _parse_header(header: int) -> Optional[Tuple[int, int, int, bool]]:
+    """解析 4 字节帧头，返回 (版本, 采样率, 帧长, 单声道)；非 Layer III 或非法帧返回 None"""
+    if header >> 21 != 0x7FF:
+        return None
+    version = (header >> 19) & 0x3
+    layer = (header >> 17) & 0x3
+    bitrate_idx = (header >> 12) & 0xF
+    rate_idx = (header >> 10) & 0x3
+    if version == 1 or layer != 1 or bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+    bitrate = _BITRATES[1 if version == 3 else 2][bitrate_idx] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_idx]
+    padding = (header >> 9) & 0x1
+    coef = 144 if version == 3 else 72
+    length = coef * bitrate // sample_rate + padding
+    mono = ((header >> 6) & 0x3) == 3
+    return version, sample_rate, length, mono
+
+
+def _skip_id3v2(data: bytes) -> int:
+    if len(data) >= 10 and data[:3] == b"ID3":
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def _scan(data: bytes) -> Optional[List[_Frame]]:
+    """顺序扫描所有帧；帧之间出现无法识别的数据或参数不一致时返回 None"""
+    pos = _skip_id3v2(data)
+    end = len(data) - 128 if data[-128:-125] == b"TAG" else len(data)
+    frames: List[_Frame] = []
+    while pos + 4 <= end:
+        header = struct.unpack(">I", data[pos:pos + 4])[0]
+        parsed = _parse_header(header)
+        if parsed is None:
+            break
+        version, sample_rate, length, mono = parsed
+        if pos + length > end:
+            # 最后一帧被截断
+            return None
+        if frames and (version, sample_rate, mono) != (frames[0].version, frames[0].sample_rate, frames[0].mono):
+            return None
+        frames.append(_Frame(pos, length, header, version, sample_rate, mono))
+        pos += length
+    # 帧序列之后只允许出现 APE / Lyrics 标签，其余情况视为损坏或不认识的流
+    if pos < end and not data[pos:pos + 8].startswith((b"APETAGEX", b"LYRICS")):
+        return None
+    return frames or None
+
+
+def _xing_offset(data: bytes, frame: _Frame) -> Optional[int]:
+    """首帧中 Xing/Info 头的位置；没有时返回 None"""
+    offset = frame.offset + 4 + frame.side_info_len
+    if data[offset:offset + 4] in (b"Xing", b"Info"):
+        return offset
+    return None
+
+
+def _probe(data: bytes) -> Optional[Tuple[List[_Frame], Optional[int]]]:
+    """扫描帧并定位 Xing/Info 头；VBRI 头（Fraunhofer 编码器）不支持"""
+    frames = _scan(data)
+    if frames is None or data[frames[0].offset + 36:frames[0].offset + 40] == b"VBRI":
+        return None
+    return frames, _xing_offset(data, frames[0])
+
+
+def mp3_duration(data: bytes) -> Optional[float]:
+    """按帧头计算时长（秒）；不支持的流返回 None"""
+    probed = _probe(data)
+    if probed is None:
+        return None
+    frames, xing = probed
+    audio_frames = len(frames) - (1 if xing is not None else 0)
+    return audio_frames * frames[0].samples / frames[0].sample_rate
+
+
+def silent_frame(template: int) -> bytes:
+    """
+    按模板帧头构造一个静音帧：沿用版本、码率、采样率与声道模式，去掉填充位与 CRC；
+    side info 全零（main_data_begin=0、part2_3_length=0）时解码器输出静音
+    """
+    header = (template & ~(1 << 9)) | (1 << 16)
+    parsed = _parse_header(header)
+    if parsed is None:
+        raise ValueError(f"非法的 MP3 帧头: {template:#010x}")
+    length = parsed[2]
+    return struct.pack(">I", header) + bytes(length - 4)
+
+
+def pad_to_duration(data: bytes, min_duration: float) -> Optional[Tuple[bytes, float, float]]:
+    """
+    时长不足 min_duration 时在最后一个音频帧之后追加静音帧
+
+    Returns:
+        (补齐后的数据, 原始时长, 补齐后时长)；不支持的流返回 None
+    """
+    probed = _probe(data)
+    if probed is None:
+        return None
+    frames, xing = probed
+    first, last = frames[0], frames[-1]
+    audio_frames = len(frames) - (1 if xing is not None else 0)
+    frame_duration = first.samples / first.sample_rate
+    duration = audio_frames * frame_duration
+    missing = min_duration - duration
+    if missing <= 0:
+        return data, duration, duration
+    count = math.ceil(missing / frame_duration - 1e-9)
+    # 码率取最后一个音频帧，Xing 帧本身不一定使用流的码率
+    silence = silent_frame(last.header) * count
+    insert_at = last.offset + last.length
+    padded = bytearray(data[:insert_at] + silence + data[insert_at:])
+    if xing is not None:
+        # 同步更新 Xing/Info 头中的帧数与字节数，播放器据此显示时长；TOC 仅影响拖动定位，保持不变
+        flags = struct.unpack(">I", padded[xing + 4:xing + 8])[0]
+        field = xing + 8
+        if flags & 0x1:
+            frames_total = struct.unpack(">I", padded[field:field + 4])[0]
+            padded[field:field + 4] = struct.pack(">I", frames_total + count)
+            field += 4
+        if flags & 0x2:
+            bytes_total = struct.unpack(">I", padded[field:field + 4])[0]
+            padded[field:field + 4] = struct.pack(">I", bytes_total + len(silence))
+    return bytes(padded), duration, (audio_frames + count) * frame_duration
+
+
+def split_at(data: bytes, boundaries: List[float]) -> Optional[List[bytes]]:
+    """
+    在给定时间点（秒，升序）处按帧切分，返回 len(boundaries) + 1 段，不重新编码
+
+    切点取最近的帧边界；各段不带 ID3 / Xing 头。段首帧可能引用上一段的比特池，
+    解码器会将其静音处理，切点应选在停顿处。不支持的流返回 None。
+    """
+    probed = _probe(data)
+    if probed is None:
+        return None
+    frames, xing = probed
+    audio = frames[1:] if xing is not None else frames
+    frame_duration = audio[0].samples / audio[0].sample_rate if audio else 0
+    if not frame_duration:
+        return None
+    segments: List[bytes] = []
+    start = 0
+    for cut in [round(b / frame_duration) for b in boundaries] + [len(audio)]:
+        cut = min(max(cut, start), len(audio))
+        segments.append(b"".join(data[f.offset:f.offset + f.length] for f in audio[start:cut]))
+        start = cut
+    return segments
@@ -1,6 +1,9 @@
 from pathlib import Path
 # -*- coding: utf-8 -*-
-from urllib.parse import urlparse, urlsplit, urlunsplit, quote, parse_qs, urlencode
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import urlparse, urlsplit, urlunsplit, quote, parse_qs, urlencode, unquote
 
 from app_api.core.config import (
     OSS_ENDPOINT,
@@ -19,6 +22,34 @@ def _public_base_url() -> str:
     host = urlparse(OSS_ENDPOINT).netloc
     return f"https://{OSS_BUCKET}.{host}"
 
+
+def _endpoint_host() -> str:
+    # OSS_ENDPOINT 可能带或不带协议前缀
+    return urlparse(OSS_ENDPOINT).netloc or OSS_ENDPOINT.split("/")[0]
+
+
+def _presign(bucket, object_key: str, expires: int = OSS_URL_EXPIRES) -> str:
+    from app_api.core.logging import logger
+    try:
+        presigned = bucket.sign_url('GET', object_key, expires)
+        # 对签�?URL 的查询参数进行安全编码，确保 + 等特殊字符被正确处理
+        # 这对�?Android 真机等严格环境很重要
+        parts = urlsplit(presigned)
+        query_params = parse_qs(parts.query, keep_blank_values=True)
+        # 重新编码查询参数，确保特殊字符如 + 被编码为 %2B
+        encoded_params = urlencode(
+            {k: v[0] if len(v) == 1 else v for k, v in query_params.items()},
+            safe=''
+        )
+        presigned = urlunsplit((parts.scheme, parts.netloc, parts.path, encoded_params, parts.fragment))
+        logger.info(f"生成预签名 URL 成功，有效期 {expires} 秒")
+        return presigned
+    except Exception as e:
+        logger.warning(f"OSS生成预签名URL失败: {e}，尝试使用公共URL")
+        base = _public_base_url()
+        return f"{base}/{object_key}" if base else ""
+
+
 def upload_to_oss(object_key: str, local_path: Path, max_retries: int = 3) -> str:
     from app_api.core.logging import logger
     import time
@@ -61,24 +92,7 @@ def upload_to_oss(object_key: str, local_path: Path, max_retries: int = 3) -> st
             logger.info(f"OSS上传成功 (尝试 {attempt}/{max_retries}): {object_key}")
             
             # 返回预签名 URL（私有桶也可用），按配置的过期秒数
-            try:
-                presigned = bucket.sign_url('GET', object_key, OSS_URL_EXPIRES)
-                # 对签�?URL 的查询参数进行安全编码，确保 + 等特殊字符被正确处理
-                # 这对�?Android 真机等严格环境很重要
-                parts = urlsplit(presigned)
-                query_params = parse_qs(parts.query, keep_blank_values=True)
-                # 重新编码查询参数，确保特殊字符如 + 被编码为 %2B
-                encoded_params = urlencode(
-                    {k: v[0] if len(v) == 1 else v for k, v in query_params.items()},
-                    safe=''
-                )
-                presigned = urlunsplit((parts.scheme, parts.netloc, parts.path, encoded_params, parts.fragment))
-                logger.info(f"生成预签名 URL 成功，有效期 {OSS_URL_EXPIRES} 秒")
-                return presigned
-            except Exception as e:
-                logger.warning(f"OSS生成预签名URL失败: {e}，尝试使用公共URL")
-                base = _public_base_url()
-                return f"{base}/{object_key}" if base else ""
+            return _presign(bucket, object_key)
                 
         except Exception as e:
             error_msg = str(e)
@@ -93,3 +107,64 @@ def upload_to_oss(object_key: str, local_path: Path, max_retries: int = 3) -> st
                 logger.error(f"OSS上传失败，已达到最大重试次数 {max_retries}")
     
     return ""
+
+
+def sign_oss_url(object_key: str, expires: int = OSS_URL_EXPIRES) -> str:
+    """为已存在的对象重新生成预签名 URL（只做本地签名计算，不上传）"""
+    from app_api.core.logging import logger
+    if not OSS_ENDPOINT or not OSS_BUCKET or not OSS_ACCESS_KEY_ID or not OSS_ACCESS_KEY_SECRET:
+        logger.error("OSS签名失败: OSS 配置不完整(缺少 ENDPOINT/BUCKET/ACCESS_KEY_ID/ACCESS_KEY_SECRET)")
+        return ""
+    try:
+        import oss2
+    except Exception as e:
+        logger.error(f"OSS签名失败: oss2 模块导入失败 - {e}")
+        return ""
+    bucket = oss2.Bucket(oss2.Auth(OSS_ACCESS_KEY_ID, OSS_ACCESS_KEY_SECRET), OSS_ENDPOINT, OSS_BUCKET)
+    return _presign(bucket, object_key, expires)
+
+
+def object_key_from_url(url: Optional[str]) -> Optional[str]:
+    """从本桶的预签名 URL 或公共 URL 中解析出对象 key；非本桶 URL 返回 None"""
+    if not url or not url.startswith(("http://", "https://")):
+        return None
+    parts = urlsplit(url)
+    hosts = {f"{OSS_BUCKET}.{_endpoint_host()}"}
+    if OSS_BASE_URL:
+        hosts.add(urlparse(OSS_BASE_URL).netloc)
+    if parts.netloc not in hosts:
+        return None
+    return unquote(parts.path.lstrip("/")) or None
+
+
+def presigned_url_valid(url: Optional[str], margin: int = 600) -> bool:
+    """
+    判断 URL 在 margin 秒后是否仍可访问：V1 签名看 Expires，V4 签名看 x-oss-date + x-oss-expires，
+    不带签名参数的公共 URL 视为长期有效
+    """
+    if not url or not url.startswith(("http://", "https://")):
+        return False
+    query = {k.lower(): v[0] for k, v in parse_qs(urlsplit(url).query).items()}
+    deadline: Optional[float] = None
+    try:
+        if "expires" in query:
+            deadline = float(query["expires"])
+        elif "x-oss-date" in query and "x-oss-expires" in query:
+            signed_at = datetime.strptime(query["x-oss-date"], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+            deadline = signed_at.timestamp() + float(query["x-oss-expires"])
+    except ValueError:
+        return False
+    if deadline is None:
+        return "signature" not in query and "x-oss-signature" not in query
+    return deadline - time.time() > margin
+
+
+def reuse_oss_url(url: Optional[str], object_key: Optional[str] = None, margin: int = 600) -> str:
+    """
+    复用已上传对象的访问地址：URL 仍在有效期内直接返回，否则按对象 key 重新签名；
+    两者都不可用时返回空字符串，由调用方决定是否重新上传
+    """
+    if presigned_url_valid(url, margin):
+        return url
+    key = object_key or object_key_from_url(url)
+    return sign_oss_url(key) if key else ""
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+分镜级流水线 - 每个分镜完成当前阶段后立即进入下一阶段，不等待同批其他分镜
+"""
+from concurrent.futures import CancelledError, Executor, Future
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+Stage = Tuple[str, Executor, Callable[[Any], Any]]
+
+
+class GatedExecutor:
+    """
+    按 item 等待其依赖的 Future 结束后再提交到下游执行器的视图，可用于 run_pipeline；
+    等待期间不占用下游槽位，依赖失败或被取消时照常提交，由处理函数自行决定退回方案
+    """
+
+    def __init__(self, executor: Executor, depends_on: Callable[[Any], Optional[Future]]):
+        self._executor = executor
+        self._depends_on = depends_on
+
+    def submit(self, fn: Callable, item: Any) -> Future:
+        dependency = self._depends_on(item)
+        if dependency is None:
+            return self._executor.submit(fn, item)
+        result: Future = Future()
+
+        def _forward(f: Future) -> None:
+            if f.cancelled():
+                result.cancel()
+                return
+            exc = f.exception()
+            if exc is not None:
+                result.set_exception(exc)
+            else:
+                result.set_result(f.result())
+
+        def _on_ready(_: Future) -> None:
+            try:
+                self._executor.submit(fn, item).add_done_callback(_forward)
+            except Exception as e:
+                result.set_exception(e)
+
+        dependency.add_done_callback(_on_ready)
+        return result
+
+
+def run_pipeline(items: Sequence[Any], stages: Sequence[Stage]) -> List[Future]:
+    """
+    将每个 item 依次提交到各阶段的执行器，阶段之间没有屏障，阶段并发由各自的执行器限制
+
+    Args:
+        items: 待处理对象（如分镜字典）
+        stages: [(阶段名, 执行器, 处理函数)]，处理函数接收上一阶段的返回值
+
+    Returns:
+        List[Future]: 与 items 一一对应，结果为最后一个阶段的返回值；任一阶段异常或被取消则后续阶段不再执行
+    """
+    results = []
+    for item in items:
+        done: Future = Future()
+        _advance(stages, 0, item, done)
+        results.append(done)
+    return results
+
+
+def _advance(stages: Sequence[Stage], index: int, value: Any, done: Future) -> None:
+    if index >= len(stages):
+        done.set_result(value)
+        return
+    _, executor, fn = stages[index]
+    try:
+        future = executor.submit(fn, value)
+    except Exception as e:
+        done.set_exception(e)
+        return
+
+    def _on_done(f: Future) -> None:
+        if f.cancelled():
+            done.set_exception(CancelledError())
+            return
+        exc = f.exception()
+        if exc is not None:
+            done.set_exception(exc)
+        else:
+            _advance(stages, index + 1, f.result(), done)
+
+    future.add_done_callback(_on_done)
@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+"""
+视频渲染流程 - 分镜级流水线（prompt 优化 -> TTS -> I2V），全部分镜完成后合并成片并上传
+"""
+import os
+import threading
+from concurrent.futures import CancelledError, Future, InvalidStateError, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+from app_api.core.config import (
+    OUTPUT_DIR, I2V_PROMPT_BATCH, I2V_RESOLUTION, KEYFRAME_PREP_ENABLED, I2V_HEDGE_ENABLED, CLIP_CACHE_ENABLED,
+    TTS_BATCH_ENABLED
+)
+from app_api.core.logging import logger
+from app_api.services.cancellation import OperationCancelled, register_token
+from app_api.services.clip_cache import clip_cache, shot_content_hash
+from app_api.services.download import download_file
+from app_api.services.ffmpeg_merge import concat_clips
+from app_api.services.i2v import run_i2v_async, I2V_MODEL, I2V_DURATION
+from app_api.services.llm import build_i2v_prompt, optimize_i2v_batch
+from app_api.services.image_prep import prepare_keyframe, file_digest
+from app_api.services.metrics import incr
+from app_api.services.oss import upload_to_oss, reuse_oss_url, sign_oss_url
+from app_api.services.pipeline import GatedExecutor, run_pipeline
+from app_api.services.scheduler import scheduler
+from app_api.services.straggler import StragglerMonitor
+from app_api.services.tts_v2 import generate_tts_audio, generate_tts_audio_batch, plan_tts_batch, TTS_MODEL, TTS_VOICE
+from app_api.storage.journal import journal, SUBMITTED, SUCCESS
+from app_api.storage.repository import (
+    update_operation, save_story_shots, upsert_shot,
+    update_story_video_url, get_story_shots, update_shot_progress
+)
+
+
+def _shot_id(s: Dict[str, Any]) -> str:
+    return s.get('id') or f"shot_{int(s.get('sequence', 0)):02d}"
+
+
+def _content_hash(s: Dict[str, Any], keyframe: Path) -> str:
+    """分镜内容哈希：关键帧、优化后的 prompt、旁白以及影响产物的服务商参数"""
+    params = {
+        "i2v_model": I2V_MODEL, "resolution": I2V_RESOLUTION, "duration": I2V_DURATION,
+        "keyframe_prep": KEYFRAME_PREP_ENABLED, "tts_model": TTS_MODEL, "voice": TTS_VOICE,
+    }
+    return shot_content_hash(keyframe, s.get('i2v_prompt') or s.get('detail') or "", s.get('narration') or "", params)
+
+
+def run_i2v_with_retry(keyframe: Path, text_prompt: str, video_raw: Path, user_id: str, story_id: str,
+                       shot_seq: int, audio_url: Optional[str], max_retries: int = 5,
+                       image_url: Optional[str] = None) -> bool:
+    """带重试机制的视频生成函数"""
+    return run_i2v_with_retry_async(keyframe, text_prompt, video_raw, user_id, story_id,
+                                    shot_seq, audio_url, max_retries, image_url).result()
+
+
+def run_i2v_with_retry_async(keyframe: Path, text_prompt: str, video_raw: Path, user_id: str, story_id: str,
+                             shot_seq: int, audio_url: Optional[str], max_retries: int = 5,
+                             image_url: Optional[str] = None, task_id: Optional[str] = None,
+                             on_submitted: Optional[Callable[[str], None]] = None) -> Future:
+    """
+    带重试的异步视频生成，返回 Future[bool]：每次尝试提交任务后立即释放线程，
+    等待由集中轮询器完成，重试前的指数退避用定时器实现；image_url 为起始图已有的 OSS 地址，所有尝试共用。
+    取消返回的 Future 时同时取消当前尝试，并不再重试。
+    task_id 为重启前已提交的远端任务，第一次尝试直接恢复轮询；每次新提交的任务 ID 传给 on_submitted
+    """
+    result: Future = Future()
+    current: Dict[str, Future] = {}
+
+    def attempt(n: int) -> None:
+        if result.done():
+            return
+        logger.info(f"Shot {shot_seq}: 开始生成视频(尝试 {n}/{max_retries})")
+        try:
+            future = run_i2v_async(keyframe, text_prompt, video_raw, user_id, story_id, audio_url, image_url,
+                                   task_id=task_id if n == 1 else None, on_submitted=on_submitted)
+        except Exception as e:
+            on_attempt_done(n, None, e)
+            return
+        current['future'] = future
+        if result.cancelled():
+            future.cancel()
+            return
+        future.add_done_callback(lambda f: on_attempt_done(n, f, None))
+
+    def on_cancelled(f: Future) -> None:
+        if f.cancelled() and 'future' in current:
+            current['future'].cancel()
+
+    result.add_done_callback(on_cancelled)
+
+    def on_attempt_done(n: int, future: Optional[Future], error: Optional[BaseException]) -> None:
+        if result.done() or (future is not None and future.cancelled()):
+            return
+        if error is None:
+            error = future.exception()
+        if error is None and future.result():
+            logger.info(f"Shot {shot_seq}: 视频生成成功 (尝试 {n}/{max_retries})")
+            result.set_result(True)
+            return
+        if error is not None:
+            logger.error(f"Shot {shot_seq}: 视频生成异常 (尝试 {n}/{max_retries}): {error}")
+        else:
+            logger.warning(f"Shot {shot_seq}: 视频生成失败 (尝试 {n}/{max_retries})")
+        if n < max_retries:
+            wait_time = min(2 ** n, 30)  # 指数退避，最多等待30秒
+            logger.info(f"Shot {shot_seq}: 等待 {wait_time} 秒后重试...")
+            timer = threading.Timer(wait_time, attempt, args=(n + 1,))
+            timer.daemon = True
+            timer.start()
+            return
+        logger.error(f"Shot {shot_seq}: 视频生成失败，已达到最大重试次数 {max_retries}")
+        result.set_result(False)
+
+    attempt(1)
+    return result
+
+
+def keyframe_oss_url(s: Dict[str, Any], keyframe: Path, video_file: Path,
+                     user_id: str, story_id: str) -> Optional[str]:
+    """
+    起始图的可访问 URL，供该分镜的所有 I2V 尝试共用：
+    开启预处理时使用缩放到 I2V 分辨率的派生图，按内容哈希放在关键帧对象旁边，已上传过则只重新签名；
+    否则复用分镜记录的原图 OSS 对象（URL 未过期直接用，过期则重新签名），都不可用时上传一次
+    """
+    seq = int(s.get('sequence', 0))
+    if KEYFRAME_PREP_ENABLED:
+        derived = prepare_keyframe(keyframe, I2V_RESOLUTION)
+        if derived != keyframe:
+            object_key = (f"users/{user_id}/stories/{story_id}/t2i/shot_{seq:02d}/"
+                          f"keyframe_{I2V_RESOLUTION.lower()}_{file_digest(keyframe)}{derived.suffix}")
+            url = sign_oss_url(object_key) if s.get('i2v_image_object_key') == object_key else ""
+            if not url:
+                url = upload_to_oss(object_key, derived)
+            if url:
+                s['i2v_image_object_key'] = object_key
+                return url
+
+    url = reuse_oss_url(s.get('image_url'), s.get('image_object_key'))
+    if url:
+        logger.info(f"Shot {seq}: 复用关键帧 OSS 对象，不再重新上传")
+        return url
+    url = upload_to_oss(f"users/temp/i2v_inputs/{video_file.stem}.png", keyframe)
+    return url or None
+
+
+def ensure_keyframe(s: Dict[str, Any], keyframe: Path, max_retries: int = 3) -> bool:
+    """keyframe 不存在但 shot 中有 image_url 时先下载图片"""
+    if keyframe.exists():
+        return True
+    image_url = s.get('image_url')
+    if not image_url:
+        return False
+    seq = int(s.get('sequence', 0))
+    logger.info(f"Shot {seq}: keyframe 不存在，尝试从image_url下载: {image_url}")
+    # 流式下载，失败时自动断点续传与退避重试
+    if download_file(image_url, keyframe, max_retries=max_retries):
+        logger.info(f"Shot {seq}: 图片下载成功: {keyframe}")
+        return True
+    logger.error(f"Shot {seq}: 图片下载失败，已达到最大重试次数 {max_retries}，跳过该分镜")
+    return False
+
+
+def render_story(user_id: str, story_id: str, operation_id: str) -> str:
+    """
+    渲染整部故事：每个分镜独立地走完 prompt 优化 -> TTS -> I2V，最后合并所有分镜视频
+
+    Returns:
+        str: 最终视频 URL（OSS 或本地 /static 路径）
+    """
+    base_dir = OUTPUT_DIR / user_id / story_id
+    t2i_dir = base_dir / "T2I"
+    i2v_dir = base_dir / "I2V"
+    for d in (base_dir / "json", t2i_dir, i2v_dir):
+        d.mkdir(parents=True, exist_ok=True)
+    final_out = i2v_dir / "final.mp4"
+    # 取消令牌由接口在入队时登记；取消后各阶段入口抛出 OperationCancelled，在途的 I2V 任务被取消
+    token = register_token(operation_id)
+    # 作业日志：上次执行被中断时保留分镜记录，已完成的阶段跳过、已提交的远端任务恢复轮询
+    if journal.start_operation(operation_id, user_id, story_id):
+        logger.info(f"RenderVideo 从中断处恢复 op={operation_id}")
+
+    shots_list = get_story_shots(user_id, story_id)
+    if shots_list:
+        logger.info(f"开始分镜级流水线渲染，共 {len(shots_list)} 个分镜，调度器状态: {scheduler.stats()['stages']}")
+        # 长尾分镜对冲：按本批已完成分镜的耗时分布识别明显落后的任务
+        monitor = StragglerMonitor(len(shots_list), profile=f"wan2.5:{I2V_RESOLUTION}") if I2V_HEDGE_ENABLED else None
+        # 增量渲染：内容哈希未变化的分镜跳过 TTS 与 I2V；其余分镜生成成功后写入分镜视频缓存
+        reused_shots = set()
+        pending_hashes: Dict[str, str] = {}
+
+        def reuse_clip(s: Dict[str, Any]) -> bool:
+            """复用本故事上次生成的视频，或从分镜视频缓存取回内容相同的片段"""
+            seq = int(s.get('sequence', 0))
+            shot_id = _shot_id(s)
+            keyframe = t2i_dir / f"shot_{seq:02d}_keyframe.png"
+            video_file = i2v_dir / f"shot_{seq:02d}.mp4"
+            if not CLIP_CACHE_ENABLED or not ensure_keyframe(s, keyframe):
+                return False
+            content_hash = _content_hash(s, keyframe)
+            if s.get('content_hash') == content_hash and video_file.exists():
+                logger.info(f"Shot {shot_id}: 内容未变化，复用上次生成的视频")
+            elif clip_cache.restore(content_hash, video_file):
+                logger.info(f"Shot {shot_id}: 命中分镜视频缓存")
+                incr("clip_cache.hit")
+            else:
+                # 内容已变化：旧哈希作废，重新生成成功后再写入
+                s.pop('content_hash', None)
+                pending_hashes[shot_id] = content_hash
+                incr("clip_cache.miss")
+                return False
+            s['content_hash'] = content_hash
+            reused_shots.add(shot_id)
+            return True
+
+        def mark_generated(s: Dict[str, Any], video_file: Path) -> None:
+            content_hash = pending_hashes.pop(_shot_id(s), None)
+            if content_hash and video_file.exists():
+                s['content_hash'] = content_hash
+                clip_cache.store(content_hash, video_file)
+
+        def optimize_stage(s: Dict[str, Any]) -> Dict[str, Any]:
+            token.raise_if_cancelled()
+            # 优化结果单独存放在 i2v_prompt，保留原始 detail，重复渲染时可命中 prompt 缓存；失败时退回原始 detail
+            s['i2v_prompt'] = build_i2v_prompt(s) or s.get('detail') or ""
+            return s
+
+        def tts_stage(s: Dict[str, Any]) -> Dict[str, Any]:
+            token.raise_if_cancelled()
+            narration = s.get('narration') or ''
+            shot_id = _shot_id(s)
+            if reuse_clip(s):
+                # 视频已包含音轨，无需重新合成旁白
+                update_shot_progress(user_id, operation_id, shot_id, "tts", "Success")
+                return s
+            entry = journal.get_stage(operation_id, shot_id, "tts")
+            reused = reuse_oss_url(entry['artifact']) if entry and entry['status'] == SUCCESS else ""
+            if narration.strip() and reused:
+                s['audio_url'] = reused
+                logger.info(f"Shot {shot_id}: 复用中断前已生成的 TTS 音频")
+                update_shot_progress(user_id, operation_id, shot_id, "tts", "Success")
+            elif narration.strip():
+                update_shot_progress(user_id, operation_id, shot_id, "tts", "Running")
+                audio_url = batch_audio.get(shot_id) or generate_tts_audio(narration, user_id, story_id, shot_id)
+                s['audio_url'] = audio_url
+                if audio_url:
+                    logger.info(f"Shot {shot_id}: TTS 音频已生成 {audio_url}")
+                    journal.record_stage(operation_id, shot_id, "tts", SUCCESS, provider="cosyvoice", artifact=audio_url)
+                    update_shot_progress(user_id, operation_id, shot_id, "tts", "Success")
+                else:
+                    logger.warning(f"Shot {shot_id}: TTS 音频生成失败")
+                    update_shot_progress(user_id, operation_id, shot_id, "tts", "Failed", detail="TTS 音频生成失败")
+            else:
+                s['audio_url'] = None
+                logger.info(f"Shot {shot_id}: 无旁白内容，跳过 TTS 生成")
+            return s
+
+        def i2v_stage(s: Dict[str, Any]) -> Any:
+            token.raise_if_cancelled()
+            seq = int(s.get('sequence', 0))
+            shot_id = _shot_id(s)
+            keyframe = t2i_dir / f"shot_{seq:02d}_keyframe.png"
+            video_file = i2v_dir / f"shot_{seq:02d}.mp4"
+            hedge_file = i2v_dir / f"hedge_shot_{seq:02d}.mp4"
+            text_prompt = s.get('i2v_prompt') or s.get('detail') or ""
+            # 中断前提交的对冲副本：仍需对冲时恢复轮询，否则取消，避免远端任务无人认领
+            hedge_entry = journal.get_stage(operation_id, shot_id, "i2v_hedge")
+            resume_hedge_id = hedge_entry['task_id'] if hedge_entry and hedge_entry['status'] == SUBMITTED else None
+
+            def launch_hedge(task_id: Optional[str] = None) -> Future:
+                """对冲副本与主任务一样进入调度器的 i2v 阶段排队，受阶段与服务商并发上限约束；任务 ID 写入作业日志"""
+                hedge: Future = Future()
+                running: Dict[str, Future] = {}
+
+                def settle(ok: bool) -> None:
+                    try:
+                        hedge.set_result(ok)
+                    except InvalidStateError:
+                        pass
+
+                def on_finished(f: Future) -> None:
+                    ok = not f.cancelled() and f.exception() is None and bool(f.result())
+                    status = "Success" if ok else ("Cancelled" if f.cancelled() or hedge.cancelled() else "Failed")
+                    journal.record_stage(operation_id, shot_id, "i2v_hedge", status)
+                    settle(ok)
+
+                def submit() -> Future:
+                    future = run_i2v_async(
+                        keyframe, text_prompt, hedge_file, user_id, story_id, s.get('audio_url'), image_url,
+                        task_id=task_id,
+                        on_submitted=lambda hedge_id: journal.record_stage(
+                            operation_id, shot_id, "i2v_hedge", SUBMITTED, provider="wan2.5", task_id=hedge_id,
+                            artifact=str(hedge_file)
+                        ),
+                    )
+                    running['future'] = future
+                    if hedge.cancelled():
+                        future.cancel()
+                    future.add_done_callback(on_finished)
+                    return future
+
+                queued = scheduler.submit("i2v", submit, tenant=operation_id, provider="wan2.5")
+                # 排队期间被取消或提交异常时结束副本
+                queued.add_done_callback(lambda q: 'future' not in running and settle(False))
+
+                def on_cancelled(f: Future) -> None:
+                    if f.cancelled():
+                        queued.cancel()
+                        if 'future' in running:
+                            running['future'].cancel()
+
+                hedge.add_done_callback(on_cancelled)
+                return hedge
+
+            def drop_hedge() -> None:
+                if resume_hedge_id:
+                    # 恢复后立即取消：停止轮询并尝试取消远端任务，取消不占用调度器槽位
+                    run_i2v_async(keyframe, text_prompt, hedge_file, user_id, story_id,
+                                  task_id=resume_hedge_id).cancel()
+                    journal.record_stage(operation_id, shot_id, "i2v_hedge", "Cancelled")
+
+            if shot_id in reused_shots:
+                drop_hedge()
+                update_shot_progress(user_id, operation_id, shot_id, "i2v", "Success")
+                return True
+            entry = journal.get_stage(operation_id, shot_id, "i2v")
+            if entry and entry['status'] == SUCCESS and video_file.exists():
+                logger.info(f"Shot {shot_id}: 中断前视频已生成，跳过 I2V")
+                drop_hedge()
+                mark_generated(s, video_file)
+                update_shot_progress(user_id, operation_id, shot_id, "i2v", "Success")
+                return True
+            # 中断前已提交的远端任务直接恢复轮询，不再重新提交
+            resume_task_id = entry['task_id'] if entry and entry['status'] == SUBMITTED else None
+            if not ensure_keyframe(s, keyframe):
+                drop_hedge()
+                update_shot_progress(user_id, operation_id, shot_id, "i2v", "Failed", detail="关键帧不存在")
+                return False
+            update_shot_progress(user_id, operation_id, shot_id, "i2v", "Running")
+            image_url = keyframe_oss_url(s, keyframe, video_file, user_id, story_id)
+            # 返回 Future：调度器槽位保持到视频生成结束，但执行线程立即释放
+            done: Future = Future()
+
+            def record(f: Future) -> None:
+                ok = False
+                try:
+                    # 任务抛出异常时按失败处理，且无论如何都要完成 done，否则渲染会一直等待
+                    ok = not f.cancelled() and f.exception() is None and bool(f.result())
+                    status = "Cancelled" if not ok and token.cancelled else ("Success" if ok else "Failed")
+                    if ok:
+                        mark_generated(s, video_file)
+                    journal.record_stage(operation_id, shot_id, "i2v", status)
+                    update_shot_progress(user_id, operation_id, shot_id, "i2v", status)
+                finally:
+                    done.set_result(ok)
+
+            future = run_i2v_with_retry_async(
+                keyframe, text_prompt, video_file, user_id, story_id, seq, s.get('audio_url'), image_url=image_url,
+                task_id=resume_task_id,
+                on_submitted=lambda task_id: journal.record_stage(
+                    operation_id, shot_id, "i2v", SUBMITTED, provider="wan2.5", task_id=task_id, artifact=str(video_file)
+                ),
+            )
+            # 取消时停止重试与轮询，并尝试取消远端任务
+            token.add_callback(future.cancel)
+            if monitor is not None:
+                # 对冲副本写入单独文件（不匹配 shot_*.mp4），胜出后再替换正式文件
+                future = monitor.watch(
+                    shot_id, future, launch=launch_hedge,
+                    on_hedge_win=lambda: os.replace(hedge_file, video_file),
+                    hedge=launch_hedge(resume_hedge_id) if resume_hedge_id else None,
+                )
+            else:
+                drop_hedge()
+            future.add_done_callback(record)
+            return done
+
+        batch_audio: Dict[str, str] = {}
+        batch_groups: Dict[str, Future] = {}
+        if TTS_BATCH_ENABLED:
+            # 批量 TTS：每组旁白作为一个 TTS 阶段任务排队，合并合成后切分；分镜只等待所在分组，
+            # 不在批量中或未取得音频的分镜在 TTS 阶段逐个合成
+            def tts_batch(group: List[Tuple[str, str]]) -> None:
+                token.raise_if_cancelled()
+                batch_audio.update(generate_tts_audio_batch(group, user_id, story_id,
+                                                            should_stop=lambda: token.cancelled))
+
+            def needs_tts(shot_id: str) -> bool:
+                entry = journal.get_stage(operation_id, shot_id, "tts")
+                return not (entry and entry['status'] == SUCCESS)
+
+            items = [(_shot_id(s), s.get('narration') or '') for s in shots_list if needs_tts(_shot_id(s))]
+            for group in plan_tts_batch(items):
+                group_future = scheduler.submit("tts", tts_batch, group, tenant=operation_id, provider="cosyvoice")
+                for shot_id, _ in group:
+                    batch_groups[shot_id] = group_future
+
+        # 各阶段进入进程级调度器排队，并发受全局的阶段/服务商上限约束
+        tts_executor = scheduler.executor("tts", tenant=operation_id, provider="cosyvoice")
+        stages = [
+            ("optimize", scheduler.executor("optimize", tenant=operation_id, provider="dashscope-llm"), optimize_stage),
+            ("tts", GatedExecutor(tts_executor, lambda s: batch_groups.get(_shot_id(s))), tts_stage),
+            ("i2v", scheduler.executor("i2v", tenant=operation_id, provider="wan2.5"), i2v_stage),
+        ]
+        if I2V_PROMPT_BATCH:
+            # 批量模式：一次请求优化全部分镜 prompt，流水线只保留 TTS -> I2V
+            prompts = optimize_i2v_batch(shots_list, tenant=operation_id)
+            for s in shots_list:
+                s['i2v_prompt'] = prompts.get(_shot_id(s)) or s.get('detail') or ""
+            stages = stages[1:]
+        if monitor is not None:
+            token.add_callback(monitor.cancel)
+        # 取消时丢弃本作业在调度器中排队的任务
+        token.add_callback(lambda: scheduler.cancel_tenant(operation_id))
+        futures = run_pipeline(shots_list, stages)
+        wait(futures)
+        if monitor is not None:
+            monitor.close()
+            for leftover in i2v_dir.glob("hedge_shot_*.mp4"):
+                leftover.unlink(missing_ok=True)
+
+        success_count = 0
+        for s, future in zip(shots_list, futures):
+            exc = future.exception()
+            if isinstance(exc, (OperationCancelled, CancelledError)):
+                update_shot_progress(user_id, operation_id, _shot_id(s), "pipeline", "Cancelled")
+            elif exc is not None:
+                logger.error(f"Shot {_shot_id(s)}: 流水线执行异常: {exc}")
+                update_shot_progress(user_id, operation_id, _shot_id(s), "pipeline", "Failed", detail=str(exc))
+            elif future.result():
+                success_count += 1
+        logger.info(
+            f"视频生成完成: 成功 {success_count} 个（其中复用 {len(reused_shots)} 个），"
+            f"失败 {len(shots_list) - success_count} 个"
+        )
+
+        for s in shots_list:
+            seq = int(s.get('sequence', 0))
+            video_file = i2v_dir / f"shot_{seq:02d}.mp4"
+            if video_file.exists():
+                # 只保存本地路径，不上传到 OSS
+                s['video_url'] = f"/static/{user_id}/{story_id}/I2V/{video_file.name}"
+            else:
+                logger.warning(f"Shot {seq}: 视频文件不存在，跳过: {video_file}")
+            upsert_shot(user_id, story_id, _shot_id(s), s)
+        save_story_shots(user_id, story_id, shots_list)
+
+    if token.cancelled:
+        # 已完成的分镜视频保留，下次渲染可直接复用；不合并成片
+        update_operation(user_id, operation_id, "Cancelled", detail="用户取消", story_id=story_id)
+        journal.finish_operation(operation_id, "Cancelled")
+        logger.info(f"RenderVideo 已取消 op={operation_id}")
+        return ""
+
+    valid_clips = sorted([p for p in i2v_dir.glob("shot_*.mp4") if p.name != "final.mp4"])
+    if valid_clips:
+        logger.info(f"找到 {len(valid_clips)} 个分镜视频，开始合并..")
+        list_file = i2v_dir / "concat_list.txt"
+        with list_file.open("w", encoding="utf-8") as f:
+            for p in valid_clips:
+                f.write(f"file '{p.resolve()}'\n")
+        concat_clips(list_file, final_out)
+        logger.info(f"视频合并完成: {final_out}")
+    else:
+        logger.warning("没有找到任何分镜视频用于合并")
+
+    # 只上传最终合并的视频到OSS
+    if final_out.exists():
+        logger.info(f"开始上传最终视频到 OSS: {final_out}")
+        mv_obj = f"users/{user_id}/stories/{story_id}/movie/final.mp4"
+        mv_url = upload_to_oss(mv_obj, final_out)
+        if mv_url:
+            logger.info(f"最终视频上传成功，OSS URL: {mv_url}")
+        else:
+            logger.warning(f"最终视频上传到OSS失败，使用本地路径: {final_out}")
+        update_story_video_url(user_id, story_id, mv_url or str(final_out.resolve()))
+        video_url = mv_url or f"/static/{user_id}/{story_id}/I2V/{final_out.name}"
+        update_operation(user_id, operation_id, "Success", story_id=story_id, video_url=video_url)
+        journal.finish_operation(operation_id, "Success")
+        logger.info("RenderVideo 完成，Operation 标记为Success")
+        return video_url
+
+    logger.error(f"最终视频文件不存在: {final_out}")
+    update_operation(user_id, operation_id, "Failed", detail="视频合并失败", story_id=story_id)
+    journal.finish_operation(operation_id, "Failed")
+    return f"/static/{user_id}/{story_id}/I2V/{final_out.name}"
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+进程级阶段调度器 - 所有请求的 T2I / prompt 优化 / TTS / I2V 任务共用一套并发上限
+
+每个阶段和每个服务商各有并发上限；同一阶段内按请求（tenant）轮询出队，避免大请求独占槽位。
+任务分交互（interactive）与批量（batch）两个优先级通道：交互任务先出队，连续出队若干次后让排队的批量任务先行一个。
+任务函数若返回 Future（异步提交的远端任务），槽位会保持到该 Future 完成，而执行线程立即释放。
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from app_api.core.config import STAGE_CONCURRENCY, PROVIDER_CONCURRENCY, PRIORITY_INTERACTIVE_BURST
+from app_api.core.logging import logger
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+# 默认出队顺序：先交互、后批量
+_LANES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+
+class _Task:
+    __slots__ = ("stage", "tenant", "provider", "priority", "fn", "args", "kwargs", "future", "queued_at")
+
+    def __init__(self, stage: str, tenant: str, provider: Optional[str], priority: str,
+                 fn: Callable, args: tuple, kwargs: dict):
+        self.stage = stage
+        self.tenant = tenant
+        self.provider = provider
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.queued_at = time.time()
+
+
+class StageExecutor:
+    """绑定阶段、请求、服务商与优先级的 Executor 视图，可直接用于 run_pipeline"""
+
+    def __init__(self, scheduler: "StageScheduler", stage: str, tenant: str, provider: Optional[str] = None,
+                 priority: str = PRIORITY_BATCH):
+        self._scheduler = scheduler
+        self._stage = stage
+        self._tenant = tenant
+        self._provider = provider
+        self._priority = priority
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        return self._scheduler.submit(self._stage, fn, *args, tenant=self._tenant, provider=self._provider,
+                                      priority=self._priority, **kwargs)
+
+
+class StageScheduler:
+    def __init__(self, stage_limits: Dict[str, int], provider_limits: Dict[str, int]):
+        self._stage_limits = dict(stage_limits)
+        self._provider_limits = dict(provider_limits)
+        self._lock = threading.Lock()
+        # stage -> 优先级通道 -> tenant -> 排队任务；OrderedDict 的顺序即轮询顺序
+        self._queues: Dict[str, Dict[str, "OrderedDict[str, Deque[_Task]]"]] = defaultdict(
+            lambda: {lane: OrderedDict() for lane in _LANES}
+        )
+        # 各阶段交互任务连续出队的次数，用于批量通道的饥饿保护
+        self._interactive_streak: Dict[str, int] = defaultdict(int)
+        self._running_stage: Dict[str, int] = defaultdict(int)
+        self._running_provider: Dict[str, int] = defaultdict(int)
+        # 线程数等于各阶段上限之和，真正的并发约束由槽位计数决定
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, sum(self._stage_limits.values())),
+            thread_name_prefix="stage"
+        )
+
+    def stage_limit(self, stage: str) -> int:
+        return max(1, self._stage_limits.get(stage, 1))
+
+    def provider_limit(self, provider: Optional[str]) -> Optional[int]:
+        if provider is None or provider not in self._provider_limits:
+            return None
+        return max(1, self._provider_limits[provider])
+
+    def submit(self, stage: str, fn: Callable, *args, tenant: str = "default", provider: Optional[str] = None,
+               priority: str = PRIORITY_BATCH, **kwargs) -> Future:
+        """提交任务到指定阶段排队，返回的 Future 在任务（及其返回的异步 Future）完成后结束"""
+        if priority not in _LANES:
+            raise ValueError(f"未知的优先级: {priority}")
+        task = _Task(stage, tenant, provider, priority, fn, args, kwargs)
+        with self._lock:
+            self._queues[stage][priority].setdefault(tenant, deque()).append(task)
+        self._dispatch()
+        return task.future
+
+    def cancel_tenant(self, tenant: str) -> int:
+        """取消某个请求在所有阶段中尚未开始的任务，返回取消数量；运行中的任务不受影响"""
+        cancelled: List[_Task] = []
+        with self._lock:
+            for lanes in self._queues.values():
+                for tenants in lanes.values():
+                    queue = tenants.pop(tenant, None)
+                    if queue:
+                        cancelled.extend(queue)
+        for task in cancelled:
+            task.future.cancel()
+        if cancelled:
+            logger.info(f"调度: tenant={tenant} 已取消 {len(cancelled)} 个排队任务")
+        return len(cancelled)
+
+    def executor(self, stage: str, tenant: str = "default", provider: Optional[str] = None,
+                 priority: str = PRIORITY_BATCH) -> StageExecutor:
+        return StageExecutor(self, stage, tenant, provider, priority)
+
+    def stats(self) -> Dict[str, Any]:
+        """各阶段的排队深度/运行数，以及各服务商的运行数"""
+        with self._lock:
+            stages = {}
+            for stage in set(self._stage_limits) | set(self._queues):
+                lanes = self._queues.get(stage) or {}
+                queued = {lane: sum(len(q) for q in tenants.values()) for lane, tenants in lanes.items()}
+                stages[stage] = {
+                    "limit": self.stage_limit(stage),
+                    "running": self._running_stage.get(stage, 0),
+                    "queued": sum(queued.values()),
+                    "queued_by_priority": queued,
+                    "tenants": len({t for tenants in lanes.values() for t in tenants}),
+                }
+            providers = {
+                name: {"limit": self.provider_limit(name), "running": self._running_provider.get(name, 0)}
+                for name in set(self._provider_limits) | set(self._running_provider)
+            }
+        return {"stages": stages, "providers": providers}
+
+    def _pick(self, stage: str) -> Optional[_Task]:
+        lanes = self._queues.get(stage)
+        if not lanes:
+            return None
+        order = _LANES
+        if self._interactive_streak[stage] >= PRIORITY_INTERACTIVE_BURST and lanes[PRIORITY_BATCH]:
+            # 饥饿保护：交互任务已连续出队多次，先让一个批量任务出队
+            order = tuple(reversed(_LANES))
+        for lane in order:
+            task = self._pick_from(lanes[lane])
+            if task is not None:
+                self._interactive_streak[stage] = (
+                    self._interactive_streak[stage] + 1 if lane == PRIORITY_INTERACTIVE else 0
+                )
+                return task
+        return None
+
+    def _pick_from(self, tenants: "OrderedDict[str, Deque[_Task]]") -> Optional[_Task]:
+        for tenant in list(tenants):
+            queue = tenants[tenant]
+            task = queue[0]
+            limit = self.provider_limit(task.provider)
+            if limit is not None and self._running_provider[task.provider] >= limit:
+                continue
+            queue.popleft()
+            if queue:
+                tenants.move_to_end(tenant)
+            else:
+                del tenants[tenant]
+            return task
+        return None
+
+    def _dispatch(self) -> None:
+        ready: List[_Task] = []
+        with self._lock:
+            for stage in list(self._queues):
+                while self._running_stage[stage] < self.stage_limit(stage):
+                    task = self._pick(stage)
+                    if task is None:
+                        break
+                    self._running_stage[stage] += 1
+                    if task.provider is not None:
+                        self._running_provider[task.provider] += 1
+                    ready.append(task)
+        for task in ready:
+            self._executor.submit(self._run, task)
+
+    def _release(self, task: _Task) -> None:
+        with self._lock:
+            self._running_stage[task.stage] -= 1
+            if task.provider is not None:
+                self._running_provider[task.provider] -= 1
+        self._dispatch()
+
+    def _run(self, task: _Task) -> None:
+        if not task.future.set_running_or_notify_cancel():
+            self._release(task)
+            return
+        wait_sec = time.time() - task.queued_at
+        if wait_sec > 1:
+            logger.info(f"调度: stage={task.stage}, tenant={task.tenant} 排队 {wait_sec:.1f} 秒后开始执行")
+        try:
+            result = task.fn(*task.args, **task.kwargs)
+        except BaseException as e:
+            self._release(task)
+            task.future.set_exception(e)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(lambda f: self._finish_async(task, f))
+            return
+        self._release(task)
+        task.future.set_result(result)
+
+    def _finish_async(self, task: _Task, inner: Future) -> None:
+        self._release(task)
+        if inner.cancelled():
+            task.future.set_exception(CancelledError())
+            return
+        exc = inner.exception()
+        if exc is not None:
+            task.future.set_exception(exc)
+        else:
+            task.future.set_result(inner.result())
+
+
+scheduler = StageScheduler(STAGE_CONCURRENCY, PROVIDER_CONCURRENCY)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+I2V 长尾对冲 - 同一批渲染中耗时明显超过其他分镜的任务再提交一个副本，先成功者胜出
+
+阈值取本批已成功分镜耗时的分位数 × 放大系数；本批完成数不足时参考 task_poller 中同类任务的历史耗时分布，
+两者都没有时不对冲。每批对冲数量有上限，失败的一方被取消（远端仍在排队时可退款），额外花费计入指标。
+"""
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Dict, List, Optional
+
+from app_api.core.config import (
+    I2V_HEDGE_PERCENTILE, I2V_HEDGE_FACTOR, I2V_HEDGE_MIN_COMPLETED,
+    I2V_HEDGE_MAX_RATIO, I2V_HEDGE_CHECK_INTERVAL
+)
+from app_api.core.logging import logger
+from app_api.services.metrics import incr
+from app_api.services.task_poller import task_poller
+
+# 启动对冲副本，返回 Future[bool]；True 表示副本已成功写出视频
+LaunchFn = Callable[[], Future]
+
+
+class _Watched:
+    __slots__ = ("key", "primary", "launch", "on_hedge_win", "started", "hedge", "result")
+
+    def __init__(self, key: str, primary: Future, launch: LaunchFn, on_hedge_win: Optional[Callable[[], None]]):
+        self.key = key
+        self.primary = primary
+        self.launch = launch
+        self.on_hedge_win = on_hedge_win
+        self.started = time.time()
+        self.hedge: Optional[Future] = None
+        self.result: Future = Future()
+
+
+def _set(future: Future, value: bool) -> bool:
+    try:
+        future.set_result(value)
+        return True
+    except InvalidStateError:
+        return False
+
+
+class StragglerMonitor:
+    def __init__(self, batch_size: int, profile: Optional[str] = None):
+        self._profile = profile
+        self._max_hedges = max(1, int(batch_size * I2V_HEDGE_MAX_RATIO))
+        self._hedges = 0
+        self._durations: List[float] = []
+        self._watched: Dict[str, _Watched] = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, key: str, primary: Future, launch: LaunchFn,
+              on_hedge_win: Optional[Callable[[], None]] = None, hedge: Optional[Future] = None) -> Future:
+        """
+        登记一个在途分镜，返回最终结果 Future[bool]
+
+        Args:
+            key: 分镜标识
+            primary: 主任务的 Future[bool]（需支持 cancel 以停止轮询并取消远端任务）
+            launch: 启动对冲副本的函数
+            on_hedge_win: 副本胜出时在完成结果前调用（如把副本视频移动到正式路径）
+            hedge: 已在运行的对冲副本（如重启后恢复轮询的副本），计入本批对冲数量，不再另行对冲
+        """
+        watched = _Watched(key, primary, launch, on_hedge_win)
+        watched.hedge = hedge
+        with self._lock:
+            self._watched[key] = watched
+            if hedge is not None:
+                self._hedges += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="i2v-straggler", daemon=True)
+                self._thread.start()
+        primary.add_done_callback(lambda f: self._on_done(watched, f, is_hedge=False))
+        if hedge is not None:
+            hedge.add_done_callback(lambda f: self._on_done(watched, f, is_hedge=True))
+        return watched.result
+
+    def close(self) -> None:
+        self._closed.set()
+
+    def cancel(self) -> None:
+        """停止对冲并取消所有在途的主任务与副本，对应结果以 False 结束"""
+        self._closed.set()
+        with self._lock:
+            running = [f for w in self._watched.values() for f in (w.primary, w.hedge) if f is not None]
+        for future in running:
+            future.cancel()
+
+    def _threshold(self) -> Optional[float]:
+        """对冲阈值（秒），调用方持有锁"""
+        if len(self._durations) >= I2V_HEDGE_MIN_COMPLETED:
+            ordered = sorted(self._durations)
+            base = ordered[min(len(ordered) - 1, int(I2V_HEDGE_PERCENTILE * len(ordered)))]
+        elif self._profile:
+            base = task_poller.expected_duration(self._profile, I2V_HEDGE_PERCENTILE)
+        else:
+            base = None
+        return base * I2V_HEDGE_FACTOR if base is not None else None
+
+    def _loop(self) -> None:
+        while not self._closed.wait(I2V_HEDGE_CHECK_INTERVAL):
+            now = time.time()
+            with self._lock:
+                threshold = self._threshold()
+                if threshold is None or self._hedges >= self._max_hedges:
+                    continue
+                stragglers = sorted(
+                    (w for w in self._watched.values()
+                     if w.hedge is None and not w.result.done() and now - w.started > threshold),
+                    key=lambda w: w.started,
+                )[:self._max_hedges - self._hedges]
+                self._hedges += len(stragglers)
+            for watched in stragglers:
+                self._launch_hedge(watched, now - watched.started, threshold)
+
+    def _launch_hedge(self, watched: _Watched, elapsed: float, threshold: float) -> None:
+        logger.warning(f"Shot {watched.key}: 已耗时 {elapsed:.0f}s，超过对冲阈值 {threshold:.0f}s，提交对冲任务")
+        incr("i2v.hedge.issued")
+        try:
+            hedge = watched.launch()
+        except Exception as e:
+            logger.error(f"Shot {watched.key}: 对冲任务提交失败: {e}")
+            incr("i2v.hedge.launch_failed")
+            return
+        with self._lock:
+            watched.hedge = hedge
+        if watched.result.done():
+            # 提交期间主任务已经结束
+            hedge.cancel()
+            incr("i2v.hedge.loser_cancelled")
+            return
+        hedge.add_done_callback(lambda f: self._on_done(watched, f, is_hedge=True))
+
+    def _on_done(self, watched: _Watched, future: Future, is_hedge: bool) -> None:
+        ok = not future.cancelled() and future.exception() is None and bool(future.result())
+        with self._lock:
+            hedge = watched.hedge
+            other = watched.primary if is_hedge else hedge
+            # 失败的一方等待另一方：另一方仍在运行时不结束
+            if not ok and other is not None and not other.done():
+                return
+            self._watched.pop(watched.key, None)
+            if ok and not is_hedge:
+                self._durations.append(time.time() - watched.started)
+        if watched.result.done():
+            return
+        if ok and is_hedge and watched.on_hedge_win:
+            try:
+                watched.on_hedge_win()
+            except Exception as e:
+                logger.error(f"Shot {watched.key}: 对冲结果处理失败: {e}")
+                ok = False
+        if not _set(watched.result, ok) or not ok:
+            return
+        if hedge is None:
+            return
+        if is_hedge:
+            incr("i2v.hedge.won")
+            logger.info(f"Shot {watched.key}: 对冲任务先完成，取消主任务")
+        else:
+            incr("i2v.hedge.primary_won")
+            logger.info(f"Shot {watched.key}: 主任务先完成，取消对冲任务")
+        if other is not None and not other.done():
+            other.cancel()
+            incr("i2v.hedge.loser_cancelled")
+        else:
+            # 另一方已先失败结束，其花费同样计入对冲成本
+            incr("i2v.hedge.loser_completed")
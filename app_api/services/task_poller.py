@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+远端任务集中轮询 - 所有在途的异步任务（wan2.5 I2V 等）由一个后台线程按统一节拍查询状态
+
+提交任务的线程登记 task_id 后立即返回 Future，不再各自 sleep 轮询；
+任务到达终态（SUCCEEDED / FAILED）或超时后完成对应的 Future。
+
+轮询间隔按 profile（服务商 + 分辨率）的历史完成耗时自适应：预计完成前（p10 之前）稀疏查询，
+p10 之后按基础间隔查询，长尾任务不放宽，避免延后发现完成；样本不足时使用固定间隔。
+重启后恢复轮询的任务不知道实际提交时间，始终按基础间隔查询，其耗时也不计入分布。
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from app_api.core.config import (
+    TASK_POLL_INTERVAL, TASK_POLL_TIMEOUT, TASK_POLL_WORKERS, TASK_POLL_MAX_INTERVAL, TASK_POLL_MIN_SAMPLES
+)
+from app_api.core.logging import logger
+from app_api.services.metrics import incr
+
+# fetch() 返回 (状态, 数据)：SUCCEEDED 时数据作为 Future 结果，FAILED 时数据作为错误信息，其余状态继续轮询
+FetchFn = Callable[[], Tuple[str, Any]]
+
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+
+
+class RemoteTaskError(RuntimeError):
+    """远端任务以失败状态结束"""
+
+
+class DurationHistogram:
+    """最近若干个成功任务的完成耗时（秒），用于估计完成时间的分位数"""
+
+    def __init__(self, max_samples: int = 200):
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float) -> float:
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _Tracked:
+    __slots__ = ("task_id", "fetch", "profile", "resumed", "future", "started", "deadline", "next_at", "polls",
+                 "errors", "in_flight")
+
+    def __init__(self, task_id: str, fetch: FetchFn, timeout: float, profile: Optional[str], resumed: bool = False):
+        self.task_id = task_id
+        self.fetch = fetch
+        self.profile = profile
+        self.resumed = resumed
+        self.future: Future = Future()
+        self.started = time.time()
+        self.deadline = self.started + timeout
+        self.next_at = self.started
+        self.polls = 0
+        self.errors = 0
+        self.in_flight = False
+
+
+class TaskPoller:
+    def __init__(self, interval: float, workers: int, max_interval: float = TASK_POLL_MAX_INTERVAL,
+                 min_samples: int = TASK_POLL_MIN_SAMPLES):
+        self._interval = interval
+        self._max_interval = max(interval, max_interval)
+        self._min_samples = max(1, min_samples)
+        self._tasks: Dict[str, _Tracked] = {}
+        self._histograms: Dict[str, DurationHistogram] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # 单次查询可能较慢，用小线程池并发执行同一节拍内到期的查询
+        self._fetch_executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="task-poll")
+        self._thread: Optional[threading.Thread] = None
+
+    def track(self, task_id: str, fetch: FetchFn, timeout: float = TASK_POLL_TIMEOUT, profile: Optional[str] = None,
+              resumed: bool = False) -> Future:
+        """
+        登记一个远端任务，返回在任务结束时完成的 Future；超时抛出 TimeoutError，失败抛出 RemoteTaskError
+
+        profile 标识耗时分布相近的一类任务（如 "wan2.5:480P"），同一 profile 共享完成耗时直方图；
+        resumed 表示进程重启前已提交的任务，登记时间晚于实际提交时间
+        """
+        tracked = _Tracked(task_id, fetch, timeout, profile, resumed)
+        with self._lock:
+            tracked.next_at = tracked.started + self._next_delay(tracked, 0.0)
+            self._tasks[task_id] = tracked
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="task-poller", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return tracked.future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tracked": len(self._tasks),
+                "in_flight": sum(1 for t in self._tasks.values() if t.in_flight),
+                "durations": {
+                    profile: {
+                        "samples": len(hist),
+                        "p10": round(hist.quantile(0.1), 1),
+                        "p50": round(hist.quantile(0.5), 1),
+                        "p90": round(hist.quantile(0.9), 1),
+                    }
+                    for profile, hist in self._histograms.items() if len(hist)
+                },
+            }
+
+    def expected_duration(self, profile: str, q: float = 0.5) -> Optional[float]:
+        """某类任务完成耗时的分位数估计；样本不足时返回 None"""
+        with self._lock:
+            hist = self._histograms.get(profile)
+            if hist is None or len(hist) < self._min_samples:
+                return None
+            return hist.quantile(q)
+
+    def _next_delay(self, tracked: _Tracked, elapsed: float) -> float:
+        """根据已耗时与该 profile 的耗时分布计算下次查询的延迟（调用方持有锁）"""
+        hist = self._histograms.get(tracked.profile) if tracked.profile and not tracked.resumed else None
+        if hist is None or len(hist) < self._min_samples:
+            return self._interval
+        p10 = hist.quantile(0.1)
+        if elapsed < p10:
+            # 预计完成前稀疏查询，但不越过 p10，避免错过进入密集区间
+            return min(self._max_interval, max(self._interval, p10 - elapsed))
+        # p10 之后（含超过 p90 的长尾）按基础间隔查询，完成检测不晚于固定间隔轮询
+        return self._interval
+
+    def _record_duration(self, tracked: _Tracked) -> None:
+        if not tracked.profile or tracked.resumed:
+            # 恢复的任务只统计到重启后的耗时，会偏短
+            return
+        with self._lock:
+            hist = self._histograms.setdefault(tracked.profile, DurationHistogram())
+            hist.add(time.time() - tracked.started)
+
+    def _loop(self) -> None:
+        while True:
+            now = time.time()
+            due: List[_Tracked] = []
+            next_at = now + self._interval
+            with self._lock:
+                for tracked in self._tasks.values():
+                    if tracked.in_flight:
+                        continue
+                    if tracked.next_at <= now:
+                        tracked.in_flight = True
+                        due.append(tracked)
+                    else:
+                        next_at = min(next_at, tracked.next_at)
+            for tracked in due:
+                self._fetch_executor.submit(self._poll, tracked)
+            self._wakeup.wait(timeout=max(0.05, next_at - time.time()))
+            self._wakeup.clear()
+
+    def _finish(self, tracked: _Tracked) -> None:
+        with self._lock:
+            if self._tasks.get(tracked.task_id) is tracked:
+                del self._tasks[tracked.task_id]
+
+    def _poll(self, tracked: _Tracked) -> None:
+        if tracked.future.done():
+            # 调用方已取消，不再轮询
+            self._finish(tracked)
+            return
+        if time.time() > tracked.deadline:
+            self._finish(tracked)
+            tracked.future.set_exception(TimeoutError(f"任务 {tracked.task_id} 超时未完成，已轮询 {tracked.polls} 次"))
+            return
+
+        state, data = None, None
+        incr("poller.fetch")
+        if tracked.profile:
+            incr(f"poller.fetch.{tracked.profile}")
+        try:
+            state, data = tracked.fetch()
+        except Exception as e:
+            tracked.errors += 1
+            logger.warning(f"任务 {tracked.task_id} 状态查询异常 (第 {tracked.polls + 1} 次): {e}")
+        tracked.polls += 1
+
+        if state in (SUCCEEDED, FAILED):
+            self._finish(tracked)
+            try:
+                if state == SUCCEEDED:
+                    self._record_duration(tracked)
+                    tracked.future.set_result(data)
+                else:
+                    tracked.future.set_exception(RemoteTaskError(str(data or "Unknown error")))
+            except InvalidStateError:
+                pass  # 查询期间调用方取消了 Future
+            return
+        now = time.time()
+        with self._lock:
+            tracked.next_at = now + self._next_delay(tracked, now - tracked.started)
+        tracked.in_flight = False
+        self._wakeup.set()
+
+
+task_poller = TaskPoller(TASK_POLL_INTERVAL, TASK_POLL_WORKERS)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+远端任务追踪日志 - 每个故事一个追加写入的 JSONL（可选 gzip）文件，只记录任务的状态变化
+
+轮询得到的原始响应只保存在内存中有字节上限的环形缓冲里，任务以非成功状态结束时才整体写入，
+避免每次轮询都生成一个小文件。开启压缩时一个任务的记录先缓存在内存中，任务结束时作为一个 gzip member 写入，
+单条记录各自压缩反而比明文更大；进程在任务结束前退出时，该任务未写入的记录会丢失。
+"""
+import gzip
+import json
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, List, Optional
+
+from app_api.core.config import TRACE_COMPRESS, TRACE_RING_BYTES
+from app_api.core.logging import logger
+
+SUCCEEDED = "SUCCEEDED"
+
+# 同一故事的多个分镜并发追加同一个文件
+_write_lock = threading.Lock()
+
+
+def _append(path: Path, records: List[dict]) -> None:
+    data = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records).encode("utf-8")
+    try:
+        with _write_lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # gzip 追加模式每次写入一个新的 member，gzip.open 读取时自动拼接
+            with (gzip.open(path, "ab") if path.suffix == ".gz" else open(path, "ab")) as f:
+                f.write(data)
+    except Exception as e:
+        logger.warning(f"写入追踪日志失败: {path}, err={e}")
+
+
+class TaskTrace:
+    def __init__(self, directory: Path, provider: str, trace_id: str):
+        self.path = directory / ("trace.jsonl.gz" if TRACE_COMPRESS else "trace.jsonl")
+        self.provider = provider
+        self.trace_id = trace_id
+        self.task_id: Optional[str] = None
+        self._state: Optional[str] = None
+        self._polls = 0
+        self._ring: Deque[str] = deque()
+        self._ring_bytes = 0
+        # 压缩模式下待写入的记录，任务结束时一次写入
+        self._pending: Optional[List[dict]] = [] if TRACE_COMPRESS else None
+        self._lock = threading.Lock()
+
+    def _write(self, event: str, **fields: Any) -> None:
+        record = {
+            "ts": round(time.time(), 3),
+            "trace_id": self.trace_id,
+            "provider": self.provider,
+            "task_id": self.task_id,
+            "event": event,
+        }
+        record.update(fields)
+        if self._pending is None:
+            _append(self.path, [record])
+            return
+        with self._lock:
+            self._pending.append(record)
+
+    def record(self, event: str, response: Any, state: Optional[str] = None) -> None:
+        """记录一次接口响应：原始内容进入环形缓冲，只有非轮询事件或状态变化时才写入文件"""
+        raw = json.dumps(response, ensure_ascii=False, default=str)
+        with self._lock:
+            self._ring.append(raw)
+            self._ring_bytes += len(raw)
+            while self._ring_bytes > TRACE_RING_BYTES and len(self._ring) > 1:
+                self._ring_bytes -= len(self._ring.popleft())
+            if event == "poll":
+                self._polls += 1
+            changed = event != "poll" or state != self._state
+            if state is not None:
+                self._state = state
+            polls = self._polls
+        if changed:
+            self._write(event, state=state, polls=polls, response=response)
+
+    def close(self, state: str, detail: Optional[str] = None) -> None:
+        """任务结束：写入终态；非成功时附带环形缓冲中的原始响应便于排查"""
+        with self._lock:
+            responses = list(self._ring) if state != SUCCEEDED else []
+            self._ring.clear()
+            self._ring_bytes = 0
+            polls = self._polls
+        self._write("final", state=state, polls=polls, detail=detail)
+        if responses:
+            self._write("raw_responses", responses=responses)
+        if self._pending is not None:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if records:
+                _append(self.path, records)
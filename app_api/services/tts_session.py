@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+CosyVoice 合成会话池 - 复用预先建立的 WebSocket 连接，音频分片到达即写入磁盘
+
+连接池使用 DashScope SDK 的 SpeechSynthesizerObjectPool（进程级单例，借出时按模型/音色重新设置参数）；
+每个 (模型, 音色) 的并发会话数单独限制。SDK 版本过旧没有连接池时，每次合成新建 SpeechSynthesizer。
+"""
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+import dashscope
+from dashscope.audio.tts_v2 import ResultCallback, SpeechSynthesizer
+
+from app_api.core.config import DASHSCOPE_API_KEY, TTS_POOL_SIZE, TTS_TIMEOUT
+from app_api.core.logging import logger
+from app_api.services.metrics import incr
+
+
+class _FileSink(ResultCallback):
+    """把合成音频分片顺序写入文件，完成或出错时置位事件"""
+
+    def __init__(self, path: Path, on_chunk: Optional[Callable[[bytes], None]],
+                 on_event: Optional[Callable[[str], None]]):
+        self._file = path.open("wb")
+        self._on_chunk = on_chunk
+        self._on_event = on_event
+        self._started = time.time()
+        self.first_chunk_ms: Optional[int] = None
+        self.size = 0
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+        # 超时由调用线程结束，与 SDK 回调线程上的写入互斥
+        self._lock = threading.Lock()
+
+    def on_data(self, data: bytes) -> None:
+        with self._lock:
+            if self.done.is_set():
+                return
+            if self.first_chunk_ms is None:
+                self.first_chunk_ms = int((time.time() - self._started) * 1000)
+            self._file.write(data)
+            self.size += len(data)
+        if self._on_chunk:
+            self._on_chunk(data)
+
+    def on_event(self, message: str) -> None:
+        if self._on_event and not self.done.is_set():
+            self._on_event(message)
+
+    def on_complete(self) -> None:
+        self._finish(None)
+
+    def on_error(self, message) -> None:
+        self._finish(str(message))
+
+    def on_close(self) -> None:
+        # 正常结束时 on_complete 先于 on_close；只收到关闭说明连接中途断开
+        self._finish("连接已关闭")
+
+    def _finish(self, error: Optional[str]) -> None:
+        with self._lock:
+            if self.done.is_set():
+                return
+            self.error = error
+            self._file.close()
+            self.done.set()
+
+
+class SynthesizerSessions:
+    def __init__(self, size: int, timeout: float):
+        self._size = size
+        self._timeout = timeout
+        self._pool = None
+        self._pool_disabled = False
+        self._slots: Dict[Tuple[str, str], threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _object_pool(self):
+        """首次使用时创建 SDK 连接池（会同步建立 size 个连接）；不可用时返回 None"""
+        with self._lock:
+            if self._pool is None and not self._pool_disabled:
+                try:
+                    from dashscope.audio.tts_v2 import SpeechSynthesizerObjectPool
+                    dashscope.api_key = DASHSCOPE_API_KEY
+                    self._pool = SpeechSynthesizerObjectPool(max_size=self._size)
+                    logger.info(f"CosyVoice 会话池已就绪: {self._size} 个预连接")
+                except Exception as e:
+                    self._pool_disabled = True
+                    logger.warning(f"CosyVoice 会话池不可用，每次合成新建连接: {e}")
+            return self._pool
+
+    def _slot(self, model: str, voice: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            slot = self._slots.get((model, voice))
+            if slot is None:
+                slot = self._slots[(model, voice)] = threading.BoundedSemaphore(self._size)
+            return slot
+
+    @staticmethod
+    def _discard(pool, synthesizer, model: str, voice: str) -> None:
+        """
+        丢弃出错的会话：关闭连接，并向连接池归还一个未连接的新会话占住其名额，
+        由连接池的后台线程重新建立连接，避免池容量随失败次数逐渐缩小
+        """
+        try:
+            synthesizer.close()
+        except Exception as e:
+            logger.warning(f"关闭 CosyVoice 会话失败: {e}")
+        if pool is None:
+            return
+        try:
+            pool.return_synthesizer(SpeechSynthesizer(model=model, voice=voice))
+        except Exception as e:
+            logger.warning(f"CosyVoice 会话池补充连接失败: {e}")
+
+    def stream_to_file(self, text: str, model: str, voice: str, target: Path,
+                       on_chunk: Optional[Callable[[bytes], None]] = None,
+                       on_event: Optional[Callable[[str], None]] = None,
+                       additional_params: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        合成 text 并把音频分片边接收边写入 target
+
+        Args:
+            on_chunk: 每个分片写入后回调，可用于边合成边转发
+            on_event: 服务端 JSON 事件回调（如开启 word_timestamp_enabled 后的字级时间戳）
+            additional_params: 透传给 CosyVoice 的额外参数
+
+        Returns:
+            bool: 合成完整结束时返回 True；失败或超时时 target 中可能残留部分数据
+        """
+        dashscope.api_key = DASHSCOPE_API_KEY
+        with self._slot(model, voice):
+            sink = _FileSink(target, on_chunk, on_event)
+            pool = self._object_pool()
+            synthesizer = None
+            try:
+                if pool is not None:
+                    synthesizer = pool.borrow_synthesizer(
+                        model=model, voice=voice, callback=sink, additional_params=additional_params
+                    )
+                else:
+                    synthesizer = SpeechSynthesizer(
+                        model=model, voice=voice, callback=sink, additional_params=additional_params
+                    )
+                # 设置回调后 call 只负责发送文本，音频通过 on_data 到达
+                synthesizer.call(text)
+            except Exception as e:
+                sink.on_error(e)
+                logger.error(f"CosyVoice 调用异常: {e}")
+                incr("tts.session.failed")
+                if synthesizer is not None:
+                    self._discard(pool, synthesizer, model, voice)
+                return False
+
+            timed_out = not sink.done.wait(self._timeout)
+            if timed_out:
+                # 先通知服务端停止合成，再关闭文件；取消过程中到达的完成事件不算成功
+                try:
+                    synthesizer.streaming_cancel()
+                except Exception as e:
+                    logger.warning(f"CosyVoice 取消超时任务失败: {e}")
+                sink.on_error("超时")
+            if timed_out or sink.error is not None:
+                logger.error(f"CosyVoice 合成失败: {'超时' if timed_out else sink.error}, 已接收 {sink.size} bytes")
+                incr("tts.session.failed")
+                self._discard(pool, synthesizer, model, voice)
+                return False
+
+            try:
+                request_id = synthesizer.get_last_request_id()
+            except Exception:
+                request_id = None
+            logger.info(
+                f"CosyVoice 合成完成: {sink.size} bytes, 首包 {sink.first_chunk_ms}ms, requestId={request_id}"
+            )
+            incr("tts.session.completed")
+            if pool is not None:
+                pool.return_synthesizer(synthesizer)
+            return True
+
+
+tts_sessions = SynthesizerSessions(TTS_POOL_SIZE, TTS_TIMEOUT)
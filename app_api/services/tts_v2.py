@@ -1,9 +1,95 @@
 # -*- coding: utf-8 -*-
 from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import json
 import os
+import re
 from app_api.core.logging import logger
-from app_api.core.config import DASHSCOPE_API_KEY, OUTPUT_DIR
-from app_api.services.oss import upload_to_oss
+from app_api.core.config import (
+    DASHSCOPE_API_KEY, OUTPUT_DIR, TTS_CACHE_ENABLED, TTS_CACHE_DIR, TTS_CACHE_MAX_MB, TTS_CACHE_TTL,
+    TTS_BATCH_MAX_CHARS
+)
+from app_api.services.cache import DiskCache
+from app_api.services.clip_cache import ClipCache
+from app_api.services.metrics import incr
+from app_api.services.mp3_utils import pad_to_duration, split_at
+from app_api.services.oss import upload_to_oss, sign_oss_url
+from app_api.services.tts_session import tts_sessions
+
+# 模型与音色参与分镜内容哈希
+TTS_MODEL = 'cosyvoice-v3-flash'
+TTS_VOICE = 'longanyang'  # 标准女声
+# wan2.5-preview 要求音频至少 4 秒，不足时末尾补静音
+TTS_MIN_DURATION_SEC = 4.0
+
+# 音频缓存：补齐后的 MP3 与其 OSS 对象 key 分目录存放，key 相同（文本、模型、音色、补齐策略）时跳过合成与上传；
+# 对象 key 记录很小，只占容量上限的 1/16，两者合计不超过 TTS_CACHE_MAX_MB
+_TTS_CACHE_BYTES = TTS_CACHE_MAX_MB * 1024 * 1024
+_tts_audio_cache = ClipCache(TTS_CACHE_DIR / "audio", _TTS_CACHE_BYTES - _TTS_CACHE_BYTES // 16, suffix=".mp3")
+_tts_object_cache = DiskCache(TTS_CACHE_DIR / "objects", _TTS_CACHE_BYTES // 16, TTS_CACHE_TTL)
+
+# 批量合成时用于对齐字级时间戳的有效字符（忽略标点与空白）
+_SIGNIFICANT = re.compile(r"\w")
+_SENTENCE_END = ("。", "！", "？", "!", "?", ".", "…")
+
+
+def _tts_cache_key(text: str) -> str:
+    return DiskCache.make_key("tts", text, TTS_MODEL, TTS_VOICE, TTS_MIN_DURATION_SEC)
+
+
+def _local_path(user_id: str, story_id: str, shot_id: str) -> Path:
+    # 生成本地文件路径
+    tts_dir = OUTPUT_DIR / user_id / story_id / "tts"
+    tts_dir.mkdir(parents=True, exist_ok=True)
+    # 文件命名格式: user_id-story_id-shot_id.mp3
+    return tts_dir / f"{user_id}-{story_id}-{shot_id}.mp3"
+
+
+def _cached_audio(cache_key: str, local_path: Path) -> Tuple[str, bool]:
+    """
+    查询音频缓存
+
+    Returns:
+        (重新签名后的 URL, 本地文件是否已从缓存取回)；URL 非空时无需合成与上传
+    """
+    if not TTS_CACHE_ENABLED:
+        return "", False
+    entry = _tts_object_cache.get(cache_key)
+    if entry and entry.get("object_key"):
+        # 已上传过的音频只需重新签名，不再合成与上传
+        audio_url = sign_oss_url(entry["object_key"])
+        if audio_url:
+            _tts_audio_cache.restore(cache_key, local_path)
+            logger.info(f"TTS 音频缓存命中: {local_path.name} -> {entry['object_key']}")
+            return audio_url, True
+    restored = _tts_audio_cache.restore(cache_key, local_path)
+    if restored:
+        logger.info(f"TTS 音频缓存命中本地文件，跳过合成: {local_path.name}")
+    return "", restored
+
+
+def _upload_audio(cache_key: str, local_path: Path, user_id: str, story_id: str) -> str:
+    filename = local_path.name
+    try:
+        # 上传到 OSS：启用缓存时按内容寻址，旁白改变后旧缓存条目指向的对象不会被新音频覆盖
+        if TTS_CACHE_ENABLED:
+            object_key = f"tts/{cache_key}.mp3"
+        else:
+            object_key = f"users/{user_id}/stories/{story_id}/tts/{filename}"
+        audio_url = upload_to_oss(object_key, local_path)
+
+        if audio_url:
+            logger.info(f"TTS 音频上传成功: {audio_url}")
+            if TTS_CACHE_ENABLED:
+                _tts_object_cache.set(cache_key, {"object_key": object_key})
+            return audio_url
+        else:
+            logger.warning(f"TTS 音频上传失败，返回本地路径")
+            return f"/static/{user_id}/{story_id}/tts/{filename}"
+
+    except Exception as e:
+        logger.error(f"TTS 音频上传失败: {e}")
+        return ""
 
 
 def generate_tts_audio(text: str, user_id: str, story_id: str, shot_id: str) -> str:
@@ -14,114 +100,240 @@ def generate_tts_audio(text: str, user_id: str, story_id: str, shot_id: str) ->
         user_id: 用户ID
         story_id: 故事ID
         shot_id: 分镜ID
-    
+
     Returns:
         str: OSS 上的音频文件 URL，失败返回空字符串
     """
     if not text or not text.strip():
         logger.warning(f"TTS 文本为空，跳过生成 {user_id}/{story_id}/{shot_id}")
         return ""
-    
+
+    local_path = _local_path(user_id, story_id, shot_id)
+    cache_key = _tts_cache_key(text)
+    audio_url, restored = _cached_audio(cache_key, local_path)
+    if audio_url:
+        return audio_url
+
+    if not restored:
+        if not DASHSCOPE_API_KEY:
+            logger.error("DASHSCOPE_API_KEY 未配置，无法生成 TTS")
+            return ""
+        if not _synthesize(text, local_path):
+            return ""
+        if TTS_CACHE_ENABLED:
+            _tts_audio_cache.store(cache_key, local_path)
+
+    return _upload_audio(cache_key, local_path, user_id, story_id)
+
+
+def _is_cached(cache_key: str) -> bool:
+    """音频缓存中已有该旁白（只查记录是否存在，不签名、不取回）"""
+    if not TTS_CACHE_ENABLED:
+        return False
+    return _tts_object_cache.get(cache_key) is not None or _tts_audio_cache.has(cache_key)
+
+
+def plan_tts_batch(items: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """
+    把需要合成的旁白按 TTS_BATCH_MAX_CHARS 分组，每组对应一次批量请求
+
+    空旁白与已缓存的旁白不参与；只有一条旁白的组没有合并收益，不返回，由逐个合成处理
+    """
+    groups: List[List[Tuple[str, str]]] = [[]]
+    for shot_id, text in items:
+        if not text or not text.strip() or _is_cached(_tts_cache_key(text)):
+            continue
+        if groups[-1] and sum(len(t) for _, t in groups[-1]) + len(text) > TTS_BATCH_MAX_CHARS:
+            groups.append([])
+        groups[-1].append((shot_id, text))
+    return [group for group in groups if len(group) >= 2]
+
+
+def generate_tts_audio_batch(items: List[Tuple[str, str]], user_id: str, story_id: str,
+                             should_stop: Optional[Callable[[], bool]] = None) -> Dict[str, str]:
+    """
+    旁白合并为尽量少的 CosyVoice 请求，按字级时间戳切分为分镜音频，补齐、缓存与上传规则同 generate_tts_audio
+
+    Args:
+        items: [(shot_id, 旁白文本)]，按 plan_tts_batch 分组后逐组请求
+        should_stop: 每组请求前调用，返回 True 时不再合成剩余分组（如作业已取消）
+
+    Returns:
+        Dict[str, str]: shot_id -> 音频 URL；未包含的分镜（已缓存、批量合成或切分失败）由调用方逐个合成
+    """
+    results: Dict[str, str] = {}
     if not DASHSCOPE_API_KEY:
-        logger.error("DASHSCOPE_API_KEY 未配置，无法生成 TTS")
-        return ""
-    
+        return results
+    for group in plan_tts_batch(items):
+        if should_stop is not None and should_stop():
+            logger.info(f"批量 TTS 已停止，剩余分组不再合成 {user_id}/{story_id}")
+            break
+        paths = [_local_path(user_id, story_id, shot_id) for shot_id, _ in group]
+        part_path = paths[0].with_name(f".batch-{group[0][0]}.part")
+        for index, data in _synthesize_batch([text for _, text in group], part_path).items():
+            shot_id, text = group[index]
+            local_path = paths[index]
+            cache_key = _tts_cache_key(text)
+            # 先写临时文件再替换，上次的文件可能与音频缓存共享硬链接
+            tmp_path = local_path.with_name(f".{local_path.name}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, local_path)
+            if TTS_CACHE_ENABLED:
+                _tts_audio_cache.store(cache_key, local_path)
+            audio_url = _upload_audio(cache_key, local_path, user_id, story_id)
+            if audio_url:
+                results[shot_id] = audio_url
+                incr("tts.batch.shots")
+    return results
+
+
+def _synthesize_batch(texts: List[str], part_path: Path) -> Dict[int, bytes]:
+    """
+    一次请求合成多段旁白，返回 段下标 -> 补齐后的音频；请求、对齐或切分失败时返回空字典
+
+    各段以句末标点连接，使段落边界落在句间停顿处；在边界前一个字的结束时间与后一个字的开始时间的中点切分。
+    """
+    joined = "".join(t.strip() if t.strip().endswith(_SENTENCE_END) else t.strip() + "。" for t in texts)
+    sentences: Dict[int, list] = {}
+
+    def on_event(message: str) -> None:
+        try:
+            sentence = json.loads(message)["payload"]["output"]["sentence"]
+        except (ValueError, KeyError, TypeError):
+            return
+        if sentence.get("words"):
+            # 同一句会随合成进度多次下发，保留最新的字列表
+            sentences[sentence.get("index", 0)] = sentence["words"]
+
+    try:
+        logger.info(f"开始批量生成 TTS 音频: {len(texts)} 段旁白，共 {len(joined)} 字")
+        # SDK 会在参数字典中写入 enable_ssml，每次传入新的字典
+        if not tts_sessions.stream_to_file(joined, TTS_MODEL, TTS_VOICE, part_path, on_event=on_event,
+                                           additional_params={"word_timestamp_enabled": True}):
+            incr("tts.batch.failed")
+            return {}
+        boundaries = _segment_boundaries(texts, [w for i in sorted(sentences) for w in sentences[i]])
+        if boundaries is None:
+            logger.warning("批量 TTS 字级时间戳与旁白无法对齐，改为逐个合成")
+            incr("tts.batch.misaligned")
+            return {}
+        segments = split_at(part_path.read_bytes(), boundaries)
+        if segments is None:
+            logger.warning("批量 TTS 音频帧结构不常见，无法按帧切分，改为逐个合成")
+            incr("tts.batch.unsplittable")
+            return {}
+    except Exception as e:
+        logger.error(f"批量 TTS 生成失败: {e}")
+        incr("tts.batch.failed")
+        return {}
+    finally:
+        part_path.unlink(missing_ok=True)
+
+    results: Dict[int, bytes] = {}
+    for index, segment in enumerate(segments):
+        padded = pad_to_duration(segment, TTS_MIN_DURATION_SEC) if segment else None
+        if padded is not None:
+            results[index] = padded[0]
+    logger.info(f"批量 TTS 切分完成: {len(results)}/{len(texts)} 段")
+    return results
+
+
+def _segment_boundaries(texts: List[str], words: List[dict]) -> Optional[List[float]]:
+    """根据字级时间戳计算各段之间的切分时间点（秒）；有效字符数对不上时返回 None"""
+    counts = [len(_SIGNIFICANT.findall(t)) for t in texts]
+    # 每个有效字符对应的 (开始, 结束) 毫秒
+    spans = []
+    for word in words:
+        n = len(_SIGNIFICANT.findall(word.get("text", "")))
+        spans.extend([(word.get("begin_time", 0), word.get("end_time", 0))] * n)
+    if len(spans) != sum(counts) or any(c == 0 for c in counts):
+        return None
+    boundaries = []
+    offset = 0
+    for count in counts[:-1]:
+        offset += count
+        boundaries.append((spans[offset - 1][1] + spans[offset][0]) / 2 / 1000)
+    return boundaries
+
+
+def _pad_audio(audio: bytes) -> Optional[bytes]:
+    """时长不足最短要求时补静音：优先按帧头计算并追加静音帧，不解码不重编码；不常见的流退回 pydub"""
+    padded = pad_to_duration(audio, TTS_MIN_DURATION_SEC)
+    if padded is None:
+        logger.info("TTS 音频帧结构不常见，改用 pydub 解码补齐")
+        return _pad_with_pydub(audio)
+    data, duration_sec, padded_sec = padded
+    logger.info(f"TTS 原始音频时长: {duration_sec:.2f} 秒")
+    if padded_sec > duration_sec:
+        logger.info(f"音频时长不足 4 秒，追加 {padded_sec - duration_sec:.2f} 秒静音帧，新时长: {padded_sec:.2f} 秒")
+    return data
+
+
+def _synthesize(text: str, local_path: Path) -> bool:
+    """通过会话池调用 CosyVoice 合成语音（分片边到达边写入临时文件），不足最短时长时补静音，写入 local_path"""
+    filename = local_path.name
+    part_path = local_path.with_name(f".{filename}.part")
     try:
-        import dashscope
-        from dashscope.audio.tts_v2 import SpeechSynthesizer
-        
-        # 设置 API Key
-        dashscope.api_key = DASHSCOPE_API_KEY
-        
-        # 生成本地文件路径
-        tts_dir = OUTPUT_DIR / user_id / story_id / "tts"
-        tts_dir.mkdir(parents=True, exist_ok=True)
-        
-        # 文件命名格式: user_id-story_id-shot_id.mp3
-        filename = f"{user_id}-{story_id}-{shot_id}.mp3"
-        local_path = tts_dir / filename
-        
         logger.info(f"开始生成 TTS 音频: text='{text[:30]}...', file={filename}")
-        
-        # 初始化语音合成器并调用
-        try:
-            speech_synthesizer = SpeechSynthesizer(
-                model='cosyvoice-v3-flash',  # 使用 v1 模型
-                voice='longanyang'  # 标准女声
-            )
-            
-            # 调用合成
-            logger.info("调用 CosyVoice API...")
-            audio = speech_synthesizer.call(text)
-            
-        except Exception as api_error:
-            logger.error(f"CosyVoice API 调用异常: {api_error}")
+        if not tts_sessions.stream_to_file(text, TTS_MODEL, TTS_VOICE, part_path):
             logger.error(f"请检查：1) API Key 是否有效 2) 是否有 CosyVoice 权限 3) 是否超出配额")
-            return ""
-        
+            return False
+        audio = part_path.read_bytes()
+
         # 验证返回的音频数据
         if not audio:
             logger.error(f"TTS API 返回空数据: text='{text[:30]}...'")
             logger.error("可能原因: 1) API调用失败 2) 文本无法合成 3) 服务暂时不可用")
-            return ""
-        
-        if not isinstance(audio, bytes):
-            logger.error(f"TTS API 返回数据类型错误: {type(audio)}, text='{text[:30]}...'")
-            return ""
-        
+            return False
+
         if len(audio) < 100:  # 有效的 MP3 文件应该至少有几百字节
             logger.error(f"TTS API 返回数据过小 ({len(audio)} bytes): text='{text[:30]}...'")
-            return ""
-        
+            return False
+
         logger.info(f"TTS API 返回音频数据: {len(audio)} bytes")
-        
+
         # 检查音频时长，如果小于4秒则添加静音补齐
-        from io import BytesIO
-        from pydub import AudioSegment
-        
-        try:
-            audio_segment = AudioSegment.from_file(BytesIO(audio), format="mp3")
-        except Exception as e:
-            logger.error(f"解析 TTS 音频数据失败: {e}")
-            logger.error(f"音频数据前 100 字节 (hex): {audio[:100].hex()}")
-            return ""
-        
-        duration_ms = len(audio_segment)
-        duration_sec = duration_ms / 1000.0
-        logger.info(f"TTS 原始音频时长: {duration_sec:.2f} 秒")
-        # wan2.5-preview 要求至少 4 秒
-        MIN_DURATION_SEC = 4.0
-        if duration_sec < MIN_DURATION_SEC:
-            # 添加静音到末尾
-            silence_duration_ms = int((MIN_DURATION_SEC - duration_sec) * 1000)
-            silence = AudioSegment.silent(duration=silence_duration_ms)
-            audio_segment = audio_segment + silence
-            logger.info(f"音频时长不足 4 秒，添加 {silence_duration_ms/1000:.2f} 秒静音，新时长: {MIN_DURATION_SEC} 秒")
-        
-        # 保存到本地
-        audio_segment.export(local_path, format="mp3")
-        
-        try:
-            request_id = speech_synthesizer.get_last_request_id()
-            delay = speech_synthesizer.get_first_package_delay()
-            logger.info(f"TTS 音频生成成功: {filename}, requestId={request_id}, delay={delay}ms")
-        except Exception:
-            logger.info(f"TTS 音频生成成功: {filename}")
-        
-        # 上传到 OSS
-        object_key = f"users/{user_id}/stories/{story_id}/tts/{filename}"
-        audio_url = upload_to_oss(object_key, local_path)
-        
-        if audio_url:
-            logger.info(f"TTS 音频上传成功: {audio_url}")
-            return audio_url
-        else:
-            logger.warning(f"TTS 音频上传失败，返回本地路径")
-            return f"/static/{user_id}/{story_id}/tts/{filename}"
-            
+        data = _pad_audio(audio)
+        if data is None:
+            return False
+
+        # 保存到本地：先写临时文件再替换，上次的文件可能与音频缓存共享硬链接，不能原地覆盖；无需补齐时直接使用流式写入的文件
+        if data is not audio:
+            part_path.write_bytes(data)
+        os.replace(part_path, local_path)
+        logger.info(f"TTS 音频生成成功: {filename}")
+        return True
+
     except Exception as e:
         logger.error(f"TTS 音频生成失败: {e}")
         import traceback
         logger.error(f"详细错误: {traceback.format_exc()}")
-        return ""
+        return False
+    finally:
+        part_path.unlink(missing_ok=True)
+
+
+def _pad_with_pydub(audio: bytes) -> Optional[bytes]:
+    """解码后追加静音并重新编码（需要 ffmpeg），仅用于帧级处理不支持的流"""
+    from io import BytesIO
+    from pydub import AudioSegment
+
+    try:
+        audio_segment = AudioSegment.from_file(BytesIO(audio), format="mp3")
+    except Exception as e:
+        logger.error(f"解析 TTS 音频数据失败: {e}")
+        logger.error(f"音频数据前 100 字节 (hex): {audio[:100].hex()}")
+        return None
 
+    duration_ms = len(audio_segment)
+    duration_sec = duration_ms / 1000.0
+    logger.info(f"TTS 原始音频时长: {duration_sec:.2f} 秒")
+    if duration_sec < TTS_MIN_DURATION_SEC:
+        # 添加静音到末尾
+        silence_duration_ms = int((TTS_MIN_DURATION_SEC - duration_sec) * 1000)
+        silence = AudioSegment.silent(duration=silence_duration_ms)
+        audio_segment = audio_segment + silence
+        logger.info(f"音频时长不足 4 秒，添加 {silence_duration_ms/1000:.2f} 秒静音，新时长: {TTS_MIN_DURATION_SEC} 秒")
+    out = BytesIO()
+    audio_segment.export(out, format="mp3")
+    return out.getvalue()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+渲染作业日志 - SQLite（WAL 模式）持久化每个 Operation 及其分镜各阶段的状态、远端任务 ID 与产物路径
+
+进程重启后据此恢复：仍在运行的远端任务重新挂到轮询器上，不再重复提交；产物已存在的阶段直接跳过。
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app_api.core.config import JOURNAL_PATH
+from app_api.core.logging import logger
+
+# 阶段状态：已提交远端任务但尚未结束
+SUBMITTED = "Submitted"
+SUCCESS = "Success"
+RUNNING = "Running"
+# 以这些状态结束的 Operation 再次渲染时从头开始
+_TERMINAL = {"Success", "Failed", "Cancelled"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    operation_id TEXT PRIMARY KEY,
+    user_id      TEXT NOT NULL,
+    story_id     TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shot_stages (
+    operation_id TEXT NOT NULL,
+    shot_id      TEXT NOT NULL,
+    stage        TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    provider     TEXT,
+    task_id      TEXT,
+    artifact     TEXT,
+    updated_at   REAL NOT NULL,
+    PRIMARY KEY (operation_id, shot_id, stage)
+);
+"""
+
+
+class Journal:
+    def __init__(self, path: Path):
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """调用方持有锁"""
+        if self._conn is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self._path), check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        try:
+            with self._lock:
+                return self._connect().execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"作业日志读写失败: {e}")
+            return []
+
+    def start_operation(self, operation_id: str, user_id: str, story_id: str) -> bool:
+        """
+        登记 Operation 开始执行
+
+        Returns:
+            bool: 上次执行被中断（日志中仍为 Running）时返回 True，保留分镜记录用于恢复；否则清空旧记录
+        """
+        rows = self._execute("SELECT status FROM operations WHERE operation_id = ?", (operation_id,))
+        interrupted = bool(rows) and rows[0]["status"] not in _TERMINAL
+        if rows and not interrupted:
+            self._execute("DELETE FROM shot_stages WHERE operation_id = ?", (operation_id,))
+        self._execute(
+            "INSERT OR REPLACE INTO operations (operation_id, user_id, story_id, status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (operation_id, user_id, story_id, RUNNING, time.time()),
+        )
+        return interrupted
+
+    def finish_operation(self, operation_id: str, status: str) -> None:
+        self._execute(
+            "UPDATE operations SET status = ?, updated_at = ? WHERE operation_id = ?",
+            (status, time.time(), operation_id),
+        )
+
+    def interrupted_operations(self) -> List[Dict[str, Any]]:
+        """上次进程退出时仍在执行的 Operation"""
+        rows = self._execute(
+            "SELECT operation_id, user_id, story_id FROM operations WHERE status = ? ORDER BY updated_at",
+            (RUNNING,),
+        )
+        return [dict(r) for r in rows]
+
+    def record_stage(self, operation_id: str, shot_id: str, stage: str, status: str,
+                     provider: Optional[str] = None, task_id: Optional[str] = None,
+                     artifact: Optional[str] = None) -> None:
+        """写入分镜某阶段的状态；未提供的 provider / task_id / artifact 保留原值"""
+        self._execute(
+            "INSERT INTO shot_stages (operation_id, shot_id, stage, status, provider, task_id, artifact, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (operation_id, shot_id, stage) DO UPDATE SET "
+            "status = excluded.status, "
+            "provider = COALESCE(excluded.provider, provider), "
+            "task_id = COALESCE(excluded.task_id, task_id), "
+            "artifact = COALESCE(excluded.artifact, artifact), "
+            "updated_at = excluded.updated_at",
+            (operation_id, shot_id, stage, status, provider, task_id, artifact, time.time()),
+        )
+
+    def submitted_stages(self) -> List[Dict[str, Any]]:
+        """中断的 Operation 中已提交远端任务但尚未结束的分镜阶段"""
+        rows = self._execute(
+            "SELECT s.operation_id, o.user_id, o.story_id, s.shot_id, s.stage, s.provider, s.task_id, s.artifact "
+            "FROM shot_stages s JOIN operations o ON o.operation_id = s.operation_id "
+            "WHERE o.status = ? AND s.status = ? AND s.task_id IS NOT NULL",
+            (RUNNING, SUBMITTED),
+        )
+        return [dict(r) for r in rows]
+
+    def get_stage(self, operation_id: str, shot_id: str, stage: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute(
+            "SELECT status, provider, task_id, artifact FROM shot_stages "
+            "WHERE operation_id = ? AND shot_id = ? AND stage = ?",
+            (operation_id, shot_id, stage),
+        )
+        return dict(rows[0]) if rows else None
+
+
+journal = Journal(JOURNAL_PATH)
@@ -1,10 +1,14 @@
 import json
+import threading
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 from app_api.core.config import OUTPUT_DIR
 from app_api.core.logging import logger
 
+# Operation 文件会被渲染任务的多个线程同时更新（分镜进度），读-改-写需串行化
+_operation_lock = threading.RLock()
+
 
 def _atomic_write(path: Path, data: Dict[str, Any]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
@@ -13,15 +17,60 @@ def _atomic_write(path: Path, data: Dict[str, Any]) -> None:
     tmp.replace(path)
 
 
-def update_operation(user_id: str, operation_id: str, status: str, detail: Optional[str] = None) -> None:
-    path = OUTPUT_DIR / user_id / operation_id / "json" / f"{operation_id}.json"
-    payload = {"operation_id": operation_id, "status": status}
-    if detail:
-        payload["detail"] = detail
-    _atomic_write(path, payload)
+def _read_json(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _operation_path(user_id: str, operation_id: str) -> Path:
+    return OUTPUT_DIR / user_id / operation_id / "json" / f"{operation_id}.json"
+
+
+def update_operation(user_id: str, operation_id: str, status: str, detail: Optional[str] = None, **fields: Any) -> None:
+    """更新 Operation 状态；保留已有的分镜进度等字段，fields 中的额外字段（如 story_id、video_url）一并写入"""
+    path = _operation_path(user_id, operation_id)
+    with _operation_lock:
+        payload = _read_json(path)
+        payload.update({"operation_id": operation_id, "user_id": user_id, "status": status})
+        if detail:
+            payload["detail"] = detail
+        else:
+            payload.pop("detail", None)
+        payload.update({k: v for k, v in fields.items() if v is not None})
+        _atomic_write(path, payload)
     logger.info(f"Operation 更新: {user_id}/{operation_id} -> {status}")
 
 
+def update_shot_progress(user_id: str, operation_id: str, shot_id: str, stage: str, status: str, detail: Optional[str] = None) -> None:
+    """记录单个分镜在渲染流程中的阶段（tts/i2v 等）与状态"""
+    path = _operation_path(user_id, operation_id)
+    with _operation_lock:
+        payload = _read_json(path)
+        payload.setdefault("operation_id", operation_id)
+        shots = payload.setdefault("shots", {})
+        entry = {"stage": stage, "status": status}
+        if detail:
+            entry["detail"] = detail
+        shots[shot_id] = entry
+        _atomic_write(path, payload)
+    logger.info(f"Shot 进度: {user_id}/{operation_id}/{shot_id} -> {stage}:{status}")
+
+
+def get_operation(operation_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """读取 Operation 状态；未提供 user_id 时在所有用户目录下查找"""
+    if user_id:
+        path = _operation_path(user_id, operation_id)
+        return _read_json(path) if path.exists() else None
+    for path in OUTPUT_DIR.glob(f"*/{operation_id}/json/{operation_id}.json"):
+        return _read_json(path)
+    return None
+
+
 def upsert_story(user_id: str, story_id: str, display_name: str, style: str, script_content: str) -> None:
     path = OUTPUT_DIR / user_id / story_id / "json" / f"{story_id}.json"
     data = {
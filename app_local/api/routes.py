@@ -1,11 +1,14 @@
-from typing import List
+from typing import List, Optional
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
 
 from fastapi import APIRouter, BackgroundTasks
 
 from app_local.core.logging import logger
-from app_local.core.config import OUTPUT_DIR, TEST_FAST_RETURN, LOCAL_INFERENCE, COMFY_HOSTS_LIST, PIXVERSE_MAX_CONCURRENCY
+from app_local.core.config import (
+    OUTPUT_DIR, TEST_FAST_RETURN, CLIP_CACHE_ENABLED, I2V_PROVIDERS, KEYFRAME_PREP_ENABLED
+)
 from app_local.models.schemas import (
     CreateStoryboardRequest, CreateStoryboardResponse,
     RegenerateShotRequest, RegenerateShotResponse,
@@ -13,10 +16,14 @@ from app_local.models.schemas import (
     OperationStatus, Shot
 )
 from app_local.services.llm import generate_storyboard_shots, optimize_i2v_response
-from app_local.services.comfy import run_t2i, run_i2v
+from app_local.services.clip_cache import clip_cache, shot_content_hash
+from app_local.services.comfy import (
+    run_t2i, run_i2v_async, resume_pixverse_i2v, i2v_router, PRIORITY_INTERACTIVE, PIXVERSE_MODEL, PIXVERSE_QUALITY
+)
 from app_local.services.ffmpeg_merge import concat_clips
 import shutil
 from app_local.services.oss import upload_to_oss
+from app_local.storage.journal import journal, SUBMITTED, SUCCESS
 from app_local.storage.repository import (
     update_operation, upsert_story, save_story_shots,
     upsert_shot, update_story_video_url, get_story_shots
@@ -67,7 +74,7 @@ def create_storyboard(req: CreateStoryboardRequest, background_tasks: Background
     logger.info(f"CreateStoryboard 开始 op={req.operation_id}, story={req.story_id}")
     upsert_story(req.user_id, req.story_id, req.display_name, req.style, req.script_content)
     try:
-        shots_raw = generate_storyboard_shots("style:" + req.style + ":" + req.script_content)
+        shots_raw = generate_storyboard_shots("style:" + req.style + ":" + req.script_content, use_cache=req.use_cache)
     except Exception as e:
         update_operation(req.user_id, req.operation_id, "Failed", detail=str(e))
         from fastapi import HTTPException
@@ -157,7 +164,8 @@ def regenerate_shot(req: RegenerateShotRequest, background_tasks: BackgroundTask
     if not text_prompt and existed:
         text_prompt = f"参考上一帧风格，保持镜头语义一致：{existed.get('subject','')}。{existed.get('narration','')}"
 
-    run_t2i(text_prompt, keyframe, COMFY_WORKFLOW_T2I)
+    # 用户在等待单张关键帧，优先于批量生成获得 ComfyUI 实例
+    run_t2i(text_prompt, keyframe, COMFY_WORKFLOW_T2I, priority=PRIORITY_INTERACTIVE)
     k_obj = f"users/{req.user_id}/stories/{req.story_id}/t2i/{req.shot_id}/keyframe.png"
     k_url = upload_to_oss(k_obj, keyframe)
 
@@ -208,7 +216,23 @@ def render_video(req: RenderVideoRequest, background_tasks: BackgroundTasks):
         d.mkdir(parents=True, exist_ok=True)
     final_out = i2v_dir / "final.mp4"
 
+    # 参与分镜内容哈希的服务商参数：启用的后端、Pixverse 模型档位与 ComfyUI 工作流
+    clip_params = {
+        "providers": sorted(I2V_PROVIDERS), "pixverse": [PIXVERSE_MODEL, PIXVERSE_QUALITY],
+        "workflow": COMFY_WORKFLOW_I2V, "keyframe_prep": KEYFRAME_PREP_ENABLED,
+    }
+
+    def record_i2v(s: dict, shot_id: str, video_raw: Path, content_hash: Optional[str], future: Future) -> None:
+        ok = future.exception() is None and bool(future.result())
+        journal.record_stage(req.operation_id, shot_id, "i2v", SUCCESS if ok else "Failed")
+        if ok and content_hash and video_raw.exists():
+            s['content_hash'] = content_hash
+            clip_cache.store(content_hash, video_raw)
+
     def worker_concat():
+        # 作业日志：同一 Operation 上次中断时，已生成的分镜跳过，已提交的 Pixverse 任务恢复轮询
+        if journal.start_operation(req.operation_id, req.user_id, req.story_id):
+            logger.info(f"RenderVideo 从中断处恢复 op={req.operation_id}")
         shots_list = get_story_shots(req.user_id, req.story_id)
         if shots_list:
             # 优化图生视频响应
@@ -221,24 +245,66 @@ def render_video(req: RenderVideoRequest, background_tasks: BackgroundTasks):
                 logger.error(f"图生视频响应优化失败: {e}")
                 # 优化失败时使用原始数据继续处理
                 logger.info("使用原始数据继续处理")
-            max_workers = (PIXVERSE_MAX_CONCURRENCY if not LOCAL_INFERENCE else len(COMFY_HOSTS_LIST)) or 1
-            with ThreadPoolExecutor(max_workers=max_workers or 1) as ex:
-                futures = []
-                for s in shots_list:
-                    seq = int(s.get('sequence', 0))
-                    keyframe = t2i_dir / f"shot_{seq:02d}_keyframe.png"
-                    video_raw = i2v_dir / f"shot_{seq:02d}_raw.mp4"
-                    text_prompt = s.get('detail') or ""
-                    tone = s.get('tone') or ''
-                    narr = s.get('narration') or ''
-                    lip_sync_tts_content = narr if not isinstance(narr, dict) else (narr.get(tone) or narr.get('default') or next(iter(narr.values()), ''))
-                    futures.append(ex.submit(run_i2v, keyframe, text_prompt, video_raw, COMFY_WORKFLOW_I2V, req.user_id, req.story_id, lip_sync_tts_content))
-                for _ in as_completed(futures):
-                    pass
+            max_workers = i2v_router.capacity() or 1
+            # 在途任务数由信号量限制；任务提交后由集中轮询器等待结果，不再每个分镜占用一个线程
+            slots = threading.BoundedSemaphore(max_workers)
+            futures = []
+            reused = set()
+            for s in shots_list:
+                seq = int(s.get('sequence', 0))
+                keyframe = t2i_dir / f"shot_{seq:02d}_keyframe.png"
+                video_raw = i2v_dir / f"shot_{seq:02d}_raw.mp4"
+                text_prompt = s.get('detail') or ""
+                tone = s.get('tone') or ''
+                narr = s.get('narration') or ''
+                lip_sync_tts_content = narr if not isinstance(narr, dict) else (narr.get(tone) or narr.get('default') or next(iter(narr.values()), ''))
+                shot_id = s.get('id', f'shot_{seq:02d}')
+                # 增量渲染：内容哈希未变化的分镜直接复用上次的视频或分镜视频缓存中的片段
+                content_hash = None
+                if CLIP_CACHE_ENABLED and keyframe.exists():
+                    content_hash = shot_content_hash(keyframe, text_prompt, lip_sync_tts_content, clip_params)
+                    if s.get('content_hash') == content_hash and video_raw.exists():
+                        logger.info(f"Shot {shot_id}: 内容未变化，复用上次生成的视频")
+                        reused.add(shot_id)
+                        continue
+                    if clip_cache.restore(content_hash, video_raw):
+                        logger.info(f"Shot {shot_id}: 命中分镜视频缓存")
+                        s['content_hash'] = content_hash
+                        continue
+                    s.pop('content_hash', None)
+                    clip_cache.detach(video_raw)
+                entry = journal.get_stage(req.operation_id, shot_id, "i2v")
+                if entry and entry['status'] == SUCCESS and video_raw.exists():
+                    logger.info(f"Shot {shot_id}: 中断前视频已生成，跳过 I2V")
+                    continue
+                slots.acquire()
+                try:
+                    if entry and entry['status'] == SUBMITTED and entry['provider'] == "pixverse":
+                        future = resume_pixverse_i2v(entry['task_id'], video_raw, req.user_id, req.story_id)
+                    else:
+                        future = run_i2v_async(
+                            keyframe, text_prompt, video_raw, COMFY_WORKFLOW_I2V, req.user_id, req.story_id, lip_sync_tts_content,
+                            on_submitted=lambda provider, task_id, shot_id=shot_id, video_raw=video_raw: journal.record_stage(
+                                req.operation_id, shot_id, "i2v", SUBMITTED, provider=provider, task_id=task_id, artifact=str(video_raw)
+                            ),
+                        )
+                except Exception:
+                    slots.release()
+                    raise
+                future.add_done_callback(lambda _: slots.release())
+                future.add_done_callback(
+                    lambda f, s=s, shot_id=shot_id, video_raw=video_raw, content_hash=content_hash:
+                        record_i2v(s, shot_id, video_raw, content_hash, f)
+                )
+                futures.append(future)
+            wait(futures)
             for s in shots_list:
                 seq = int(s.get('sequence', 0))
                 video_raw = i2v_dir / f"shot_{seq:02d}_raw.mp4"
                 video_final = i2v_dir / f"shot_{seq:02d}_final.mp4"
+                if s.get('id', f'shot_{seq:02d}') in reused and video_final.exists() and s.get('video_url'):
+                    # 未变化的分镜沿用已上传的成片
+                    continue
                 # 取消 TTS，保留 Pixverse 自带音频
                 shutil.copyfile(video_raw, video_final)
                 obj = f"users/{req.user_id}/stories/{req.story_id}/i2v/shot_{seq:02d}/final.mp4"
@@ -253,10 +319,13 @@ def render_video(req: RenderVideoRequest, background_tasks: BackgroundTasks):
                 for p in valid_clips:
                     f.write(f"file '{p.resolve()}'\n")
             concat_clips(list_file, final_out)
+        if not final_out.exists():
+            raise RuntimeError(f"视频合并失败，最终视频文件不存在: {final_out}")
         mv_obj = f"users/{req.user_id}/stories/{req.story_id}/movie/final.mp4"
         mv_url = upload_to_oss(mv_obj, final_out)
         update_story_video_url(req.user_id, req.story_id, mv_url or str(final_out.resolve()))
         update_operation(req.user_id, req.operation_id, "Success")
+        journal.finish_operation(req.operation_id, "Success")
         logger.info("RenderVideo 完成，Operation 标记为 Success")
         return mv_url or f"/static/{req.user_id}/{req.story_id}/I2V/{final_out.name}"
 
@@ -265,5 +334,35 @@ def render_video(req: RenderVideoRequest, background_tasks: BackgroundTasks):
     #     logger.info(f"TEST_FAST_RETURN 模式，直接返回占位视频")
     #     placeholder = next(i2v_dir.glob("final.mp4"), final_out)
     #     return RenderVideoResponse(operation=OperationStatus(operation_id=req.operation_id, status="Running"), video_url=f"/static/{req.user_id}/{req.story_id}/I2V/{placeholder.name}")
-    video_url = worker_concat()
+    try:
+        video_url = worker_concat()
+    except Exception as e:
+        # 记录终态，避免重启时把失败的作业当作中断作业恢复
+        logger.exception(f"RenderVideo 失败 op={req.operation_id}: {e}")
+        update_operation(req.user_id, req.operation_id, "Failed", detail=str(e))
+        journal.finish_operation(req.operation_id, "Failed")
+        raise
     return RenderVideoResponse(operation=OperationStatus(operation_id=req.operation_id, status="Success"), video_url=video_url)
+
+
+@router.get("/i2v/providers")
+def i2v_providers():
+    """各图生视频服务商的在途任务数、并发上限、近期成功率、p50 耗时与熔断状态"""
+    return i2v_router.stats()
+
+
+def reattach_interrupted_i2v() -> int:
+    """进程启动时重新挂接上次退出前已提交、尚未结束的 Pixverse 任务，视频下载完成后再次渲染即可直接复用"""
+    entries = [e for e in journal.submitted_stages() if e['stage'] == "i2v" and e['provider'] == "pixverse"]
+    for e in entries:
+        future = resume_pixverse_i2v(e['task_id'], Path(e['artifact']), e['user_id'], e['story_id'])
+
+        def record(f: Future, e=e) -> None:
+            if f.cancelled():
+                journal.record_stage(e['operation_id'], e['shot_id'], "i2v", "Cancelled")
+                return
+            ok = f.exception() is None and bool(f.result())
+            journal.record_stage(e['operation_id'], e['shot_id'], "i2v", SUCCESS if ok else "Failed")
+
+        future.add_done_callback(record)
+    return len(entries)
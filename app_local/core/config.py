@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import List
+from typing import Dict, List
 
 # 配置中心：集中读取环境变量并设定默认值，便于生产环境注入和本地开发调试
 PROJECT_ROOT = Path(os.path.expanduser("~/workspace/story2video"))
@@ -56,7 +56,65 @@ PIXVERSE_UPLOAD_URL: str = os.getenv("PIXVERSE_UPLOAD_URL", "https://app-api.pix
 PIXVERSE_GENERATE_URL: str = os.getenv("PIXVERSE_GENERATE_URL", "https://app-api.pixverseai.cn/openapi/v2/video/img/generate")
 PIXVERSE_RESULT_URL: str = os.getenv("PIXVERSE_RESULT_URL", "https://app-api.pixverseai.cn/openapi/v2/video/result")
 
+# ComfyUI 实例池优先级：交互请求（单个分镜重新生成）先于等待中的批量请求获得实例；
+# 交互请求连续获得该次数且有批量请求等待时，让批量请求先获得一个，避免批量请求饿死
+PRIORITY_INTERACTIVE_BURST: int = int(os.getenv("PRIORITY_INTERACTIVE_BURST", "3"))
+
+# 图生视频路由：启用的服务商（comfy / pixverse，逗号分隔，默认按 LOCAL_INFERENCE 二选一）、
+# 各服务商单位成本与成本权重、连续失败多少次后熔断及熔断秒数
+I2V_PROVIDERS: List[str] = [
+    p.strip() for p in os.getenv("I2V_PROVIDERS", "comfy" if LOCAL_INFERENCE else "pixverse").split(",") if p.strip()
+]
+I2V_PROVIDER_COST: Dict[str, float] = {
+    "comfy": float(os.getenv("I2V_COST_COMFY", "0")),
+    "pixverse": float(os.getenv("I2V_COST_PIXVERSE", "1")),
+}
+I2V_ROUTER_COST_WEIGHT: float = float(os.getenv("I2V_ROUTER_COST_WEIGHT", "0.2"))
+I2V_ROUTER_FAILURE_THRESHOLD: int = int(os.getenv("I2V_ROUTER_FAILURE_THRESHOLD", "3"))
+I2V_ROUTER_COOLDOWN: int = int(os.getenv("I2V_ROUTER_COOLDOWN", "60"))
+
+# 渲染作业日志：SQLite（WAL）记录各分镜阶段状态与远端任务 ID，进程重启后重新挂接未完成的 Pixverse 任务
+JOURNAL_PATH: Path = Path(os.getenv("JOURNAL_PATH", str(OUTPUT_DIR / "journal.db")))
+JOURNAL_RESUME_ON_STARTUP: bool = os.getenv("JOURNAL_RESUME_ON_STARTUP", "true").lower() in {"1", "true", "yes"}
+
+# 远端异步任务集中轮询：轮询间隔、单任务超时与并发查询线程数
+TASK_POLL_INTERVAL: float = float(os.getenv("TASK_POLL_INTERVAL", "2"))
+TASK_POLL_TIMEOUT: int = int(os.getenv("TASK_POLL_TIMEOUT", "1200"))
+TASK_POLL_WORKERS: int = int(os.getenv("TASK_POLL_WORKERS", "8"))
+# 自适应轮询：按历史完成耗时分布调整间隔的上限秒数，以及启用自适应所需的最少样本数
+TASK_POLL_MAX_INTERVAL: float = float(os.getenv("TASK_POLL_MAX_INTERVAL", "15"))
+TASK_POLL_MIN_SAMPLES: int = int(os.getenv("TASK_POLL_MIN_SAMPLES", "5"))
+
+# 远端任务追踪日志：每个故事一个 JSONL 文件，只记录状态变化；可选 gzip 压缩，原始响应环形缓冲的字节上限
+TRACE_COMPRESS: bool = os.getenv("TRACE_COMPRESS", "false").lower() in {"1", "true", "yes"}
+TRACE_RING_BYTES: int = int(os.getenv("TRACE_RING_BYTES", str(64 * 1024)))
+
+# 流式下载：分块大小（字节）与断点续传的最大尝试次数
+DOWNLOAD_CHUNK_SIZE: int = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(256 * 1024)))
+DOWNLOAD_MAX_RETRIES: int = int(os.getenv("DOWNLOAD_MAX_RETRIES", "3"))
+
+# 关键帧预处理：I2V 提交前缩放到目标分辨率并重新编码（需要 Pillow，未安装时使用原图）
+KEYFRAME_PREP_ENABLED: bool = os.getenv("KEYFRAME_PREP_ENABLED", "true").lower() in {"1", "true", "yes"}
+KEYFRAME_PREP_FORMAT: str = os.getenv("KEYFRAME_PREP_FORMAT", "jpeg")
+KEYFRAME_PREP_QUALITY: int = int(os.getenv("KEYFRAME_PREP_QUALITY", "90"))
+KEYFRAME_PREP_WORKERS: int = int(os.getenv("KEYFRAME_PREP_WORKERS", "2"))
+
 
 # DashScope API 配置
 DASHSCOPE_API_KEY: str = os.getenv("DASHSCOPE_API_KEY", "")
 DASHSCOPE_API_URL: str = os.getenv("DASHSCOPE_API_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions")
+
+# LLM 输出缓存：相同模型 + 提示词 + 输入直接命中磁盘缓存，不再消耗配额
+LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+LLM_CACHE_DIR: Path = Path(os.getenv("LLM_CACHE_DIR", str(OUTPUT_DIR / "cache" / "llm")))
+LLM_CACHE_MAX_MB: int = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+LLM_CACHE_TTL: int = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+# 跨部署共享的缓存根目录（app_api 与 app_local 默认指向同一位置），分镜 I2V prompt 缓存位于其下
+SHARED_CACHE_DIR: Path = Path(os.getenv("SHARED_CACHE_DIR", os.path.expanduser("~/.cache/story2video")))
+PROMPT_CACHE_DIR: Path = Path(os.getenv("PROMPT_CACHE_DIR", str(SHARED_CACHE_DIR / "i2v_prompt")))
+
+# 分镜视频缓存：内容哈希（关键帧、prompt、旁白、服务商参数）相同的分镜直接复用已生成的片段，跨故事共享
+CLIP_CACHE_ENABLED: bool = os.getenv("CLIP_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+CLIP_CACHE_DIR: Path = Path(os.getenv("CLIP_CACHE_DIR", str(SHARED_CACHE_DIR / "clips")))
+CLIP_CACHE_MAX_MB: int = int(os.getenv("CLIP_CACHE_MAX_MB", "4096"))
@@ -5,12 +5,21 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.exceptions import RequestValidationError
 
 from app_local.core.logging import logger
-from app_local.api.routes import router as api_router
+from app_local.api.routes import router as api_router, reattach_interrupted_i2v
 
 
 app = FastAPI(title="Story2Video Model Service", version="1.0.0")
 
 
+@app.on_event("startup")
+async def resume_jobs():
+    from app_local.core.config import JOURNAL_RESUME_ON_STARTUP
+    if JOURNAL_RESUME_ON_STARTUP:
+        count = reattach_interrupted_i2v()
+        if count:
+            logger.info(f"已重新挂接 {count} 个中断前提交的 Pixverse 任务")
+
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     logger.info(f"HTTP {request.method} {request.url}")
@@ -30,6 +30,7 @@ class CreateStoryboardRequest(BaseModel):
     display_name: str
     script_content: str
     style: str
+    use_cache: bool = Field(True, description="是否读取分镜缓存；重试时如需重新生成可置为 false")
 
 class CreateStoryboardResponse(BaseModel):
     operation: OperationStatus
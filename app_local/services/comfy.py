@@ -2,36 +2,106 @@ import copy
 import os
 import random
 import shutil
+import threading
 import time
 import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from queue import Queue
-from typing import Dict, Tuple
+from typing import Any, Callable, Dict, Tuple
 
 import requests
-import json
 
 from app_local.core.config import (
     TEST_FAST_RETURN, COMFY_HOSTS_LIST, COMFY_INPUT_DIR, COMFY_OUTPUT_DIR,
-    LOCAL_INFERENCE, PIXVERSE_API_KEY, PIXVERSE_UPLOAD_URL,
-    PIXVERSE_GENERATE_URL, PIXVERSE_RESULT_URL
+    PIXVERSE_API_KEY, PIXVERSE_UPLOAD_URL,
+    PIXVERSE_GENERATE_URL, PIXVERSE_RESULT_URL, KEYFRAME_PREP_ENABLED,
+    PIXVERSE_MAX_CONCURRENCY, I2V_PROVIDERS, I2V_PROVIDER_COST, PRIORITY_INTERACTIVE_BURST
 )
+from app_local.services.download import download_file
+from app_local.services.i2v_router import I2VRouter
+from app_local.services.image_prep import prepare_keyframe
 from app_local.services.oss import upload_to_oss
+from app_local.services.task_poller import task_poller, SUCCEEDED, FAILED
+from app_local.services.trace import TaskTrace
 from app_local.core.logging import logger
 
 
+# Pixverse 模型与输出清晰度，关键帧预处理按同一档位缩放
+PIXVERSE_MODEL = 'v5.5'
+PIXVERSE_QUALITY = '540p'
+
+# 正在恢复的 Pixverse 任务（video_id -> Future），避免同一任务被重复挂接
+_resumed: Dict[str, Future] = {}
+_resumed_lock = threading.Lock()
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+
+
+class _HostPool:
+    """ComfyUI 实例池：空闲实例优先分给交互请求，交互请求连续获得若干次后让等待中的批量请求先行一个"""
+
+    def __init__(self, hosts: list[str]):
+        self._free = deque(hosts)
+        self._cond = threading.Condition()
+        self._waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._interactive_streak = 0
+
+    def _may_take(self, priority: str) -> bool:
+        batch_turn = self._waiting[PRIORITY_BATCH] > 0 and self._interactive_streak >= PRIORITY_INTERACTIVE_BURST
+        if priority == PRIORITY_INTERACTIVE:
+            return not batch_turn
+        return batch_turn or self._waiting[PRIORITY_INTERACTIVE] == 0
+
+    def acquire(self, priority: str) -> str:
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while not (self._free and self._may_take(priority)):
+                    self._cond.wait()
+                self._interactive_streak = self._interactive_streak + 1 if priority == PRIORITY_INTERACTIVE else 0
+                return self._free.popleft()
+            finally:
+                self._waiting[priority] -= 1
+                # 等待者变化可能改变其他请求能否获得实例
+                self._cond.notify_all()
+
+    def release(self, host: str) -> None:
+        with self._cond:
+            self._free.append(host)
+            self._cond.notify_all()
+
+
 # 资源池：多个 ComfyUI 实例轮询分发
-_comfy_host_queue: Queue[str] = Queue()
-for url in COMFY_HOSTS_LIST:
-    _comfy_host_queue.put(url)
+_comfy_hosts = _HostPool(COMFY_HOSTS_LIST)
 
 
-def acquire_comfy_host() -> str:
-    return _comfy_host_queue.get()
+def acquire_comfy_host(priority: str = PRIORITY_BATCH) -> str:
+    return _comfy_hosts.acquire(priority)
 
 
 def release_comfy_host(host: str) -> None:
-    _comfy_host_queue.put(host)
+    _comfy_hosts.release(host)
+
+
+# 本地 I2V 每个 ComfyUI 实例同时只跑一个任务；Pixverse 成功后的视频下载使用独立线程池
+_comfy_executor = ThreadPoolExecutor(max_workers=max(1, len(COMFY_HOSTS_LIST)), thread_name_prefix="comfy-i2v")
+_download_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pixverse-download")
+
+
+def _completed(value: Any) -> Future:
+    future: Future = Future()
+    future.set_result(value)
+    return future
+
+
+def _download_video(url: str, target_path: Path) -> bool:
+    if download_file(url, target_path):
+        logger.info(f"Pixverse 视频下载成功: {url} -> {target_path}")
+        return True
+    logger.error(f"Pixverse 视频下载失败: {url}")
+    return False
 
 
 def execute_workflow(host: str, workflow: Dict, output_node_id: str, output_type: str) -> Tuple[str | None, str | None]:
@@ -65,8 +135,8 @@ def execute_workflow(host: str, workflow: Dict, output_node_id: str, output_type
         return None, None
 
 
-def run_t2i(prompt: str, target_path: Path, workflow_t2i: Dict) -> bool:
-    host = acquire_comfy_host()
+def run_t2i(prompt: str, target_path: Path, workflow_t2i: Dict, priority: str = PRIORITY_BATCH) -> bool:
+    host = acquire_comfy_host(priority)
     try:
         if TEST_FAST_RETURN:
             logger.info(f"TEST_FAST_RETURN 模式，prompt: {prompt}")
@@ -97,198 +167,283 @@ def run_i2v(
     story_id: str | None = None, 
     lip_sync_tts_content: str | None = None
 ) -> bool:
-    if LOCAL_INFERENCE:
-        host = acquire_comfy_host()
-        try:
-            if TEST_FAST_RETURN:
-                logger.info(f"TEST_FAST_RETURN 模式，prompt: {text_prompt}")
-            logger.info(f"I2V 开始，Host: {host}")
-            
-            temp_name = f"temp_i2v_{random.randint(10000, 99999)}.png"
-            target_input = Path(COMFY_INPUT_DIR) / temp_name
-            shutil.copy(start_image, target_input)
+    return run_i2v_async(start_image, text_prompt, target_path, workflow_i2v, user_id, story_id, lip_sync_tts_content).result()
 
-            wf = copy.deepcopy(workflow_i2v)
-            wf['44']['inputs']['text'] = text_prompt
-            wf['80']['inputs']['image'] = temp_name
-            wf['127']['inputs']['noise_seed'] = random.randint(1, 10**14)
-            wf['102']['inputs']['filename_prefix'] = target_path.stem
 
-            filename, subfolder = execute_workflow(host, wf, '102', 'video')
-            
-            try:
-                os.remove(target_input)
-            except Exception:
-                pass
+def run_i2v_async(
+    start_image: Path,
+    text_prompt: str,
+    target_path: Path,
+    workflow_i2v: Dict,
+    user_id: str | None = None,
+    story_id: str | None = None,
+    lip_sync_tts_content: str | None = None,
+    on_submitted: Callable[[str, str], None] | None = None
+) -> Future:
+    """
+    提交图生视频任务并立即返回 Future[bool]：由 i2v_router 在已启用的服务商中选择后端，
+    本地推理在 ComfyUI 线程池中执行，Pixverse 任务创建后交给 task_poller 集中轮询；
+    所有服务商都满载时阻塞到有空闲槽位。远端任务创建成功后以 (服务商, 任务 ID) 调用 on_submitted
+    """
+    return i2v_router.submit(start_image, text_prompt, target_path, workflow_i2v, user_id, story_id, lip_sync_tts_content,
+                             on_submitted=on_submitted)
+
+
+def _submit_comfy(start_image: Path, text_prompt: str, target_path: Path, workflow_i2v: Dict,
+                  user_id: str | None, story_id: str | None, lip_sync_tts_content: str | None,
+                  on_submitted: Callable[[str, str], None] | None = None) -> Future:
+    # 本地任务随进程结束，没有可恢复的远端任务 ID
+    return _comfy_executor.submit(_run_comfy_i2v, start_image, text_prompt, target_path, workflow_i2v)
+
 
-            if filename:
-                src = Path(COMFY_OUTPUT_DIR) / subfolder / filename
-                shutil.move(src, target_path)
-                return True
-            return False
+def _submit_pixverse(start_image: Path, text_prompt: str, target_path: Path, workflow_i2v: Dict,
+                     user_id: str | None, story_id: str | None, lip_sync_tts_content: str | None,
+                     on_submitted: Callable[[str, str], None] | None = None) -> Future:
+    return _run_pixverse_i2v_async(start_image, text_prompt, target_path, user_id, story_id, lip_sync_tts_content,
+                                   on_submitted)
+
+
+def _run_comfy_i2v(start_image: Path, text_prompt: str, target_path: Path, workflow_i2v: Dict) -> bool:
+    host = acquire_comfy_host()
+    try:
+        if TEST_FAST_RETURN:
+            logger.info(f"TEST_FAST_RETURN 模式，prompt: {text_prompt}")
+        logger.info(f"I2V 开始，Host: {host}")
+        
+        temp_name = f"temp_i2v_{random.randint(10000, 99999)}.png"
+        target_input = Path(COMFY_INPUT_DIR) / temp_name
+        shutil.copy(start_image, target_input)
+
+        wf = copy.deepcopy(workflow_i2v)
+        wf['44']['inputs']['text'] = text_prompt
+        wf['80']['inputs']['image'] = temp_name
+        wf['127']['inputs']['noise_seed'] = random.randint(1, 10**14)
+        wf['102']['inputs']['filename_prefix'] = target_path.stem
+
+        filename, subfolder = execute_workflow(host, wf, '102', 'video')
         
-        finally:
-            release_comfy_host(host)
-    
-    else:
         try:
-            if not PIXVERSE_API_KEY:
-                logger.error("Pixverse API Key 未配置")
-                return False
-            
-            # 上传起始图到 OSS，得到可访问的 image_url
-            image_url = upload_to_oss(f"users/temp/i2v_inputs/{target_path.stem}.png", start_image)
-            if not image_url:
-                logger.error("上传起始图到 OSS 失败，无法提供 image_url 给 Pixverse")
-                return False
-            
-            # 生成 trace id
-            trace_id = str(uuid.uuid4())
-            
-            # 第一步：上传图片 URL
-            up_headers = {
-                'API-KEY': PIXVERSE_API_KEY,
-                'Ai-trace-id': trace_id
-            }
-            
-            # 记录上传回调
-            cb_dir = (
-                Path(COMFY_OUTPUT_DIR).parent / 'result' / 
-                (user_id or 'unknown') / (story_id or 'unknown') / 'api_callback'
-            )
-            cb_dir.mkdir(parents=True, exist_ok=True)
-            
-            up_resp = requests.post(
-                PIXVERSE_UPLOAD_URL,
-                headers=up_headers,
-                data={'image_url': image_url},
-                timeout=60
-            )
-            up_resp.raise_for_status()
-            up_data = up_resp.json() or {}
-            
-            try:
-                (cb_dir / f'pixverse_upload_{trace_id}.json').write_text(
-                    json.dumps(up_data, ensure_ascii=False, indent=2),
-                    encoding='utf-8'
-                )
-            except Exception:
-                pass
-            
-            if up_data.get('ErrCode') != 0:
-                logger.error(f"Pixverse 上传失败: {up_resp.text}")
-                return False
-            
-            img_id = (up_data.get('Resp') or {}).get('img_id')
-            if img_id is None:
-                logger.error("Pixverse 未返回 img_id")
-                return False
-            
-            # 第二步：创建图生视频任务
-            gen_headers = {
-                'API-KEY': PIXVERSE_API_KEY,
-                'Ai-trace-id': trace_id,
-                'Content-Type': 'application/json'
-            }
-            
-            gen_payload = {
-                'duration': 5,
-                'img_id': img_id,
-                'model': 'v5.5',
-                'motion_mode': 'normal',
-                'prompt': text_prompt,
-                'quality': '540p',
-                'seed': 0,
-                'style': 'realistic',
-                'lip_sync_tts_switch': False,
-                'lip_sync_tts_content': lip_sync_tts_content or '',
-                'generate_audio_switch': True,
-                'generate_multi_clip_switch': False,
-                'thinking_type': 'enabled'
-            }
-            
-            gen_resp = requests.post(
-                PIXVERSE_GENERATE_URL,
-                headers=gen_headers,
-                json=gen_payload,
-                timeout=60
-            )
-            gen_resp.raise_for_status()
-            gen_data = gen_resp.json() or {}
-            
+            os.remove(target_input)
+        except Exception:
+            pass
+
+        if filename:
+            src = Path(COMFY_OUTPUT_DIR) / subfolder / filename
+            shutil.move(src, target_path)
+            return True
+        return False
+    
+    finally:
+        release_comfy_host(host)
+
+
+def _run_pixverse_i2v_async(
+    start_image: Path,
+    text_prompt: str,
+    target_path: Path,
+    user_id: str | None = None,
+    story_id: str | None = None,
+    lip_sync_tts_content: str | None = None,
+    on_submitted: Callable[[str, str], None] | None = None
+) -> Future:
+    trace = None
+    try:
+        if not PIXVERSE_API_KEY:
+            logger.error("Pixverse API Key 未配置")
+            return _completed(False)
+        
+        # 上传起始图到 OSS，得到可访问的 image_url；开启预处理时上传缩放到 540p 的派生图
+        upload_image = prepare_keyframe(start_image, PIXVERSE_QUALITY) if KEYFRAME_PREP_ENABLED else start_image
+        image_url = upload_to_oss(f"users/temp/i2v_inputs/{target_path.stem}{upload_image.suffix}", upload_image)
+        if not image_url:
+            logger.error("上传起始图到 OSS 失败，无法提供 image_url 给 Pixverse")
+            return _completed(False)
+        
+        # 生成 trace id
+        trace_id = str(uuid.uuid4())
+        
+        # 第一步：上传图片 URL
+        up_headers = {
+            'API-KEY': PIXVERSE_API_KEY,
+            'Ai-trace-id': trace_id
+        }
+        
+        # 回调记录：每个故事一个追踪日志，只记录状态变化
+        trace = TaskTrace(_trace_dir(user_id, story_id), "pixverse", trace_id)
+        
+        up_resp = requests.post(
+            PIXVERSE_UPLOAD_URL,
+            headers=up_headers,
+            data={'image_url': image_url},
+            timeout=60
+        )
+        up_resp.raise_for_status()
+        up_data = up_resp.json() or {}
+        
+        trace.record("upload", up_data, state=f"ErrCode={up_data.get('ErrCode')}")
+        
+        if up_data.get('ErrCode') != 0:
+            logger.error(f"Pixverse 上传失败: {up_resp.text}")
+            trace.close("UPLOAD_FAILED", detail=up_resp.text)
+            return _completed(False)
+        
+        img_id = (up_data.get('Resp') or {}).get('img_id')
+        if img_id is None:
+            logger.error("Pixverse 未返回 img_id")
+            trace.close("UPLOAD_FAILED", detail="missing img_id")
+            return _completed(False)
+        
+        # 第二步：创建图生视频任务
+        gen_headers = {
+            'API-KEY': PIXVERSE_API_KEY,
+            'Ai-trace-id': trace_id,
+            'Content-Type': 'application/json'
+        }
+        
+        gen_payload = {
+            'duration': 5,
+            'img_id': img_id,
+            'model': PIXVERSE_MODEL,
+            'motion_mode': 'normal',
+            'prompt': text_prompt,
+            'quality': PIXVERSE_QUALITY,
+            'seed': 0,
+            'style': 'realistic',
+            'lip_sync_tts_switch': False,
+            'lip_sync_tts_content': lip_sync_tts_content or '',
+            'generate_audio_switch': True,
+            'generate_multi_clip_switch': False,
+            'thinking_type': 'enabled'
+        }
+        
+        gen_resp = requests.post(
+            PIXVERSE_GENERATE_URL,
+            headers=gen_headers,
+            json=gen_payload,
+            timeout=60
+        )
+        gen_resp.raise_for_status()
+        gen_data = gen_resp.json() or {}
+        
+        trace.record("generate", gen_data, state=f"ErrCode={gen_data.get('ErrCode')}")
+        
+        if gen_data.get('ErrCode') != 0:
+            logger.error(f"Pixverse 生成任务创建失败: {gen_resp.text}")
+            trace.close("CREATE_FAILED", detail=gen_resp.text)
+            return _completed(False)
+        
+        video_id = (gen_data.get('Resp') or {}).get('video_id')
+        trace.task_id = video_id
+        logger.info(f"Pixverse 生成任务创建成功，video_id: {video_id}, trace_id: {trace_id}")
+        
+        if video_id is None:
+            logger.error("Pixverse 未返回 video_id")
+            trace.close("CREATE_FAILED", detail="missing video_id")
+            return _completed(False)
+
+        if on_submitted is not None:
             try:
-                (cb_dir / f'pixverse_generate_{trace_id}.json').write_text(
-                    json.dumps(gen_data, ensure_ascii=False, indent=2),
-                    encoding='utf-8'
-                )
-            except Exception:
-                pass
-            
-            if gen_data.get('ErrCode') != 0:
-                logger.error(f"Pixverse 生成任务创建失败: {gen_resp.text}")
-                return False
-            
-            video_id = (gen_data.get('Resp') or {}).get('video_id')
-            logger.info(f"Pixverse 生成任务创建成功，video_id: {video_id}, trace_id: {trace_id}")
-            
-            if video_id is None:
-                logger.error("Pixverse 未返回 video_id")
-                return False
-            
-            # 第三步：轮询任务结果（根据 trace-id）
-            res_headers = {
-                'API-KEY': PIXVERSE_API_KEY,
-                'Ai-trace-id': trace_id
-            }
-            
-            tries = 0
-            while tries < 600:
-                res_resp = requests.get(
-                    f"{PIXVERSE_RESULT_URL}/{video_id}",
-                    headers=res_headers,
-                    timeout=30
-                )
-                res_resp.raise_for_status()
-                rj = res_resp.json() or {}
-                
-                try:
-                    (cb_dir / f'pixverse_result_{trace_id}_{tries}.json').write_text(
-                        json.dumps(rj, ensure_ascii=False, indent=2),
-                        encoding='utf-8'
-                    )
-                except Exception:
-                    pass
-                
-                if rj.get('ErrCode') != 0:
-                    time.sleep(2)
-                    tries += 1
-                    continue
-                
-                resp_obj = rj.get('Resp') or {}
-                status = int(resp_obj.get('status', 0))
-                
-                # 平台说明：Status 5 -> 1 之后，才可打开 URL
-                if status == 1:
-                    url = resp_obj.get('url')
-                    if not url:
-                        time.sleep(2)
-                        tries += 1
-                        continue
-                    
-                    v = requests.get(url, timeout=300)
-                    v.raise_for_status()
-                    with open(target_path, 'wb') as f:
-                        f.write(v.content)
-                    
-                    logger.info(f"Pixverse 视频下载成功: {url} -> {target_path}")
-                    return True
-                
-                time.sleep(2)
-                tries += 1
-            
-            logger.error("Pixverse 任务超时未完成")
-            return False
+                on_submitted("pixverse", str(video_id))
+            except Exception as e:
+                logger.warning(f"记录 Pixverse 任务 ID 失败: {video_id}, err={e}")
+
+    except Exception as e:
+        logger.error(f"Pixverse I2V 调用失败: {e}")
+        if trace is not None:
+            # 压缩模式下记录缓存在内存中，不关闭则该任务的追踪会丢失
+            trace.close("CREATE_FAILED", detail=str(e))
+        return _completed(False)
+
+    # 第三步：轮询任务结果（根据 trace-id）
+    return _track_pixverse(str(video_id), trace, target_path)
+
+
+def _trace_dir(user_id: str | None, story_id: str | None) -> Path:
+    return Path(COMFY_OUTPUT_DIR).parent / 'result' / (user_id or 'unknown') / (story_id or 'unknown') / 'api_callback'
+
+
+def resume_pixverse_i2v(video_id: str, target_path: Path, user_id: str | None = None,
+                        story_id: str | None = None) -> Future:
+    """
+    重新挂接进程重启前已提交的 Pixverse 任务，不再重新提交（也不再重复计费）；
+    同一任务已在恢复中时返回同一个 Future
+    """
+    with _resumed_lock:
+        existing = _resumed.get(video_id)
+        if existing is not None and not existing.done():
+            return existing
+        logger.info(f"恢复 Pixverse 任务，不再重新提交: {video_id}")
+        trace = TaskTrace(_trace_dir(user_id, story_id), "pixverse", str(uuid.uuid4()))
+        trace.task_id = video_id
+        trace.record("resume", {"video_id": video_id})
+        future = _resumed[video_id] = _track_pixverse(video_id, trace, target_path, resumed=True)
+    future.add_done_callback(lambda _: _resumed.pop(video_id, None))
+    return future
+
+
+def _track_pixverse(video_id: str, trace: TaskTrace, target_path: Path, resumed: bool = False) -> Future:
+    """把 Pixverse 任务交给 task_poller 轮询，成功后下载视频，返回 Future[bool]"""
+    res_headers = {
+        'API-KEY': PIXVERSE_API_KEY,
+        'Ai-trace-id': trace.trace_id
+    }
+
+    def fetch_status() -> Tuple[str, Any]:
+        res_resp = requests.get(
+            f"{PIXVERSE_RESULT_URL}/{video_id}",
+            headers=res_headers,
+            timeout=30
+        )
+        res_resp.raise_for_status()
+        rj = res_resp.json() or {}
         
-        except Exception as e:
-            logger.error(f"Pixverse I2V 调用失败: {e}")
-            return False
\ No newline at end of file
+        resp_obj = rj.get('Resp') or {}
+        status = int(resp_obj.get('status', 0))
+        # 状态未变化时只进入内存环形缓冲
+        trace.record("poll", rj, state=f"status={status}" if rj.get('ErrCode') == 0 else f"ErrCode={rj.get('ErrCode')}")
+        
+        if rj.get('ErrCode') != 0:
+            return "UNKNOWN", None
+        
+        # 平台说明：Status 5 -> 1 之后，才可打开 URL；7（审核未通过）/ 8（生成失败）为终态
+        if status == 1 and resp_obj.get('url'):
+            return SUCCEEDED, resp_obj.get('url')
+        if status in (7, 8):
+            return FAILED, f"Pixverse status={status}"
+        return str(status), None
+
+    result: Future = Future()
+
+    def on_polled(polled: Future) -> None:
+        exc = polled.exception()
+        if exc is not None:
+            logger.error(f"Pixverse 任务未完成: {exc}")
+            trace.close("TIMEOUT" if isinstance(exc, TimeoutError) else FAILED, detail=str(exc))
+            result.set_result(False)
+            return
+
+        def on_downloaded(d: Future) -> None:
+            ok = d.exception() is None and d.result()
+            trace.close(SUCCEEDED if ok else "DOWNLOAD_FAILED")
+            result.set_result(ok)
+
+        _download_executor.submit(_download_video, polled.result(), target_path).add_done_callback(on_downloaded)
+
+    # 按模型 + 清晰度区分耗时分布，轮询间隔随之自适应
+    profile = f"pixverse-{PIXVERSE_MODEL}:{PIXVERSE_QUALITY}"
+    task_poller.track(video_id, fetch_status, profile=profile, resumed=resumed).add_done_callback(on_polled)
+    return result
+
+
+# 图生视频服务商路由：只注册 I2V_PROVIDERS 中启用的后端
+i2v_router = I2VRouter()
+_PROVIDERS = {
+    "comfy": (_submit_comfy, len(COMFY_HOSTS_LIST)),
+    "pixverse": (_submit_pixverse, PIXVERSE_MAX_CONCURRENCY),
+}
+for _name in I2V_PROVIDERS:
+    if _name not in _PROVIDERS:
+        logger.warning(f"未知的 I2V 服务商，已忽略: {_name}")
+        continue
+    _submit, _cap = _PROVIDERS[_name]
+    i2v_router.register(_name, _submit, _cap, I2V_PROVIDER_COST.get(_name, 0.0))
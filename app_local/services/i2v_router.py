@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+图生视频多服务商路由 - 按实时排队数、近期成功率、p50 耗时、并发上限与成本为每个分镜选择后端
+
+某个服务商连续失败时暂时熔断，失败的分镜自动切换到其他可用服务商重试。
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from app_local.core.config import (
+    I2V_ROUTER_FAILURE_THRESHOLD, I2V_ROUTER_COOLDOWN, I2V_ROUTER_COST_WEIGHT
+)
+from app_local.core.logging import logger
+from app_local.services.metrics import incr
+
+# 提交函数接收统一的 I2V 参数，返回 Future[bool]
+SubmitFn = Callable[..., Future]
+
+# 没有耗时样本时假定的 p50（秒）
+_DEFAULT_LATENCY = 120.0
+_EWMA_ALPHA = 0.2
+
+
+def _resolve(future: Future, value: bool) -> None:
+    """完成路由结果；调用方已取消时忽略"""
+    if future.done():
+        return
+    try:
+        future.set_result(value)
+    except InvalidStateError:
+        pass
+
+
+class _Provider:
+    def __init__(self, name: str, submit: SubmitFn, cap: int, cost: float):
+        self.name = name
+        self.submit = submit
+        self.cap = max(1, cap)
+        self.cost = cost
+        self.running = 0
+        self.success_rate = 1.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.latencies: Deque[float] = deque(maxlen=50)
+
+    def p50(self) -> float:
+        if not self.latencies:
+            return _DEFAULT_LATENCY
+        ordered = sorted(self.latencies)
+        return ordered[len(ordered) // 2]
+
+    def score(self) -> float:
+        """预计完成时间（p50 按排队深度放大）除以成功率，再按成本加权，越小越好"""
+        expected = self.p50() * (1 + self.running / self.cap)
+        return expected / max(self.success_rate, 0.05) * (1 + I2V_ROUTER_COST_WEIGHT * self.cost)
+
+
+class I2VRouter:
+    def __init__(self):
+        self._providers: Dict[str, _Provider] = {}
+        self._cond = threading.Condition()
+
+    def register(self, name: str, submit: SubmitFn, cap: int, cost: float = 0.0) -> None:
+        with self._cond:
+            self._providers[name] = _Provider(name, submit, cap, cost)
+        logger.info(f"I2V 路由注册服务商: {name}, 并发上限={cap}, 成本={cost}")
+
+    def capacity(self) -> int:
+        with self._cond:
+            return sum(p.cap for p in self._providers.values())
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._cond:
+            return {
+                p.name: {
+                    "running": p.running,
+                    "cap": p.cap,
+                    "success_rate": round(p.success_rate, 3),
+                    "p50": round(p.p50(), 1),
+                    "cooling_down": p.cooldown_until > now,
+                }
+                for p in self._providers.values()
+            }
+
+    def submit(self, *args: Any, **kwargs: Any) -> Future:
+        """选择服务商提交任务，返回 Future[bool]；失败时依次切换到尚未尝试过的服务商"""
+        result: Future = Future()
+        current: Dict[str, Future] = {}
+
+        def on_cancelled(f: Future) -> None:
+            # 取消路由结果时一并取消当前服务商上的任务（停止轮询并尝试取消远端任务）
+            if f.cancelled() and 'future' in current:
+                current['future'].cancel()
+
+        result.add_done_callback(on_cancelled)
+        self._attempt(result, [], args, kwargs, current)
+        return result
+
+    def _pick(self, tried: List[str]) -> Optional[_Provider]:
+        """选出得分最低的可用服务商；全部满载时等待槽位，全部熔断或已尝试过时返回 None"""
+        with self._cond:
+            while True:
+                now = time.time()
+                candidates = [p for p in self._providers.values() if p.name not in tried]
+                healthy = [p for p in candidates if p.cooldown_until <= now]
+                # 所有未尝试的服务商都在熔断中时仍选其一，避免分镜直接失败
+                pool = healthy or candidates
+                if not pool:
+                    return None
+                available = [p for p in pool if p.running < p.cap]
+                if available:
+                    chosen = min(available, key=lambda p: p.score())
+                    chosen.running += 1
+                    return chosen
+                self._cond.wait(timeout=1.0)
+
+    def _attempt(self, result: Future, tried: List[str], args: tuple, kwargs: dict,
+                 current: Dict[str, Future]) -> None:
+        if result.done():
+            return
+        provider = self._pick(tried)
+        if provider is None:
+            _resolve(result, False)
+            return
+        if result.done():
+            # 等待槽位期间调用方已取消
+            self._release(provider)
+            return
+        tried.append(provider.name)
+        if len(tried) > 1:
+            incr("i2v_router.failover")
+            logger.warning(f"I2V 切换到服务商 {provider.name}（已尝试: {', '.join(tried[:-1])}）")
+        incr(f"i2v_router.dispatch.{provider.name}")
+        started = time.time()
+        try:
+            future = provider.submit(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"I2V 服务商 {provider.name} 提交异常: {e}")
+            self._on_done(provider, started, False)
+            self._attempt(result, tried, args, kwargs, current)
+            return
+        current['future'] = future
+        if result.cancelled():
+            future.cancel()
+
+        def on_done(f: Future) -> None:
+            if f.cancelled():
+                # 被取消不代表服务商不可用：只释放槽位，不计入成功率，也不切换服务商
+                self._release(provider)
+                _resolve(result, False)
+                return
+            ok = f.exception() is None and bool(f.result())
+            self._on_done(provider, started, ok)
+            if ok:
+                _resolve(result, True)
+                return
+            if result.done():
+                return
+            # 回调运行在轮询/下载线程上，切换服务商可能需要等待槽位，放到独立线程执行
+            threading.Thread(
+                target=self._attempt, args=(result, tried, args, kwargs, current), name="i2v-failover", daemon=True
+            ).start()
+
+        future.add_done_callback(on_done)
+
+    def _release(self, provider: _Provider) -> None:
+        with self._cond:
+            provider.running -= 1
+            self._cond.notify_all()
+
+    def _on_done(self, provider: _Provider, started: float, ok: bool) -> None:
+        with self._cond:
+            provider.running -= 1
+            provider.success_rate = (1 - _EWMA_ALPHA) * provider.success_rate + _EWMA_ALPHA * (1.0 if ok else 0.0)
+            if ok:
+                provider.latencies.append(time.time() - started)
+                provider.consecutive_failures = 0
+            else:
+                provider.consecutive_failures += 1
+                if provider.consecutive_failures >= I2V_ROUTER_FAILURE_THRESHOLD:
+                    provider.cooldown_until = time.time() + I2V_ROUTER_COOLDOWN
+                    provider.consecutive_failures = 0
+                    incr(f"i2v_router.cooldown.{provider.name}")
+                    logger.warning(f"I2V 服务商 {provider.name} 连续失败，熔断 {I2V_ROUTER_COOLDOWN} 秒")
+            self._cond.notify_all()
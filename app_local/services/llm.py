@@ -2,12 +2,33 @@ import json
 import requests
 from typing import List, Dict, Any
 from pathlib import Path
-from app_local.core.config import OLLAMA_URL, OUTPUT_DIR, DASHSCOPE_API_KEY, DASHSCOPE_API_URL
+from app_local.core.config import (
+    OLLAMA_URL, OUTPUT_DIR, DASHSCOPE_API_KEY, DASHSCOPE_API_URL,
+    LLM_CACHE_ENABLED, LLM_CACHE_DIR, LLM_CACHE_MAX_MB, LLM_CACHE_TTL, PROMPT_CACHE_DIR
+)
 from app_local.core.logging import logger
+from app_local.services.cache import DiskCache
 
 
-def generate_storyboard_shots(story: str) -> List[Dict]:
-    """调用本地 Ollama 生成分镜结构，返回 shots 列表"""
+# 分镜结果缓存：key 为 模型 + 系统提示词 + 用户消息 的哈希
+_storyboard_cache = DiskCache(LLM_CACHE_DIR / "storyboard", LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL)
+
+# I2V prompt 模板版本：修改 optimize_i2v_response 中的提示词时必须同步修改，使旧的缓存结果失效
+I2V_PROMPT_VERSION = "pixverse-translate-v1"
+
+# 分镜 I2V prompt 缓存：与 app_api 共用缓存目录，按模板版本区分
+_i2v_prompt_cache = DiskCache(PROMPT_CACHE_DIR, LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL)
+
+
+def _i2v_prompt_cache_key(shot: Dict[str, Any]) -> str:
+    # narration 优化的提示词包含整个分镜，subject 也会影响结果
+    fields = [(shot.get(k) or "").strip() if isinstance(shot.get(k), str) else shot.get(k)
+              for k in ("detail", "tone", "camera", "narration", "subject")]
+    return DiskCache.make_key("i2v_prompt", I2V_PROMPT_VERSION, *fields)
+
+
+def generate_storyboard_shots(story: str, use_cache: bool = True) -> List[Dict]:
+    """调用本地 Ollama 生成分镜结构，返回 shots 列表；use_cache=False 时跳过缓存读取"""
 
     system_prompt = (
         "角色设定：你是一位拥有无限想象力的AI视频导演和金牌编剧。你的首要任务是在任何情况下，都必须根据用户给出的任意概念或一句话，独立脑补并生成一个完整、结构化、严格格式化的 JSON 分镜脚本。\n\n"
@@ -75,6 +96,12 @@ def generate_storyboard_shots(story: str) -> List[Dict]:
         "prompt": user_message,
         "options": {"temperature": 0.8, "num_ctx": 8192},
     }
+    cache_key = DiskCache.make_key(payload["model"], system_prompt, user_message)
+    if use_cache and LLM_CACHE_ENABLED:
+        cached = _storyboard_cache.get(cache_key)
+        if cached:
+            logger.info(f"分镜缓存命中，共 {len(cached)} 个分镜，故事片段: {story[:30]}...")
+            return cached
     try:
         logger.info(f"发起 Ollama 请求 (全中文模式), 故事片段: {story[:30]}...")
         attempts = 0
@@ -121,6 +148,8 @@ def generate_storyboard_shots(story: str) -> List[Dict]:
                     attempts += 1
                     continue
                 logger.info(f"成功生成 {count} 个中文分镜")
+                if LLM_CACHE_ENABLED:
+                    _storyboard_cache.set(cache_key, valid_shots)
                 return valid_shots
             except Exception as e:
                 last_err = e
@@ -188,6 +217,15 @@ def optimize_i2v_response(i2v_json: Dict[str, Any]) -> Dict[str, Any]:
     """优化图生视频的 JSON 响应，返回优化后的 JSON"""
     optimized_json = json.loads(json.dumps(i2v_json))  # 深拷贝    
     for shot in optimized_json.get("shots", []):
+        cache_key = _i2v_prompt_cache_key(shot)
+        if LLM_CACHE_ENABLED:
+            cached = _i2v_prompt_cache.get(cache_key)
+            if cached:
+                shot.update(cached)
+                logger.info(f"Shot {shot.get('id', 'unknown')} prompt 缓存命中，跳过 LLM 优化")
+                continue
+        failed = False
+
         # 1. 将 detail 属性翻译为英文
         detail = shot.get("detail", "")
         if detail:
@@ -207,6 +245,7 @@ def optimize_i2v_response(i2v_json: Dict[str, Any]) -> Dict[str, Any]:
                 shot["detail"] = english_detail
                 logger.info(f"翻译结果: {english_detail[:50]}...")
             except Exception as e:
+                failed = True
                 logger.error(f"翻译 detail 失败: {e}")
         
         # 2. 优化 narration 属性为指定格式
@@ -234,6 +273,11 @@ def optimize_i2v_response(i2v_json: Dict[str, Any]) -> Dict[str, Any]:
                 shot["narration"] = optimized_narr
                 logger.info(f"优化结果: {optimized_narr}")
             except Exception as e:
+                failed = True
                 logger.error(f"优化 narration 失败: {e}")
+
+        # 只缓存完整成功的结果，降级结果下次仍会重新优化
+        if LLM_CACHE_ENABLED and not failed:
+            _i2v_prompt_cache.set(cache_key, {"detail": shot.get("detail"), "narration": shot.get("narration")})
     
     return optimized_json
\ No newline at end of file
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+进程内计数指标 - 记录解析/修复/重试等事件次数，通过 /metrics 接口查看
+"""
+import threading
+from collections import defaultdict
+from typing import Dict
+
+_counters: Dict[str, int] = defaultdict(int)
+_lock = threading.Lock()
+
+
+def incr(name: str, value: int = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def snapshot() -> Dict[str, int]:
+    with _lock:
+        return dict(sorted(_counters.items()))
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+pytest.importorskip("loguru")
+
+from app_api.storage.journal import Journal, RUNNING, SUBMITTED, SUCCESS
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return Journal(tmp_path / "journal.db")
+
+
+def test_first_start_is_not_interrupted(journal):
+    assert journal.start_operation("op1", "u1", "s1") is False
+    assert journal.interrupted_operations() == [{"operation_id": "op1", "user_id": "u1", "story_id": "s1"}]
+
+
+def test_restart_after_crash_keeps_stages(journal):
+    journal.start_operation("op1", "u1", "s1")
+    journal.record_stage("op1", "shot_01", "i2v", SUBMITTED, provider="wan2.5", task_id="t1", artifact="/a.mp4")
+    # 进程退出前未调用 finish_operation，再次启动视为中断恢复
+    assert journal.start_operation("op1", "u1", "s1") is True
+    assert journal.get_stage("op1", "shot_01", "i2v")["task_id"] == "t1"
+    assert journal.submitted_stages() == [{
+        "operation_id": "op1", "user_id": "u1", "story_id": "s1", "shot_id": "shot_01",
+        "stage": "i2v", "provider": "wan2.5", "task_id": "t1", "artifact": "/a.mp4",
+    }]
+
+
+@pytest.mark.parametrize("status", ["Success", "Failed", "Cancelled"])
+def test_restart_after_terminal_status_clears_stages(journal, status):
+    journal.start_operation("op1", "u1", "s1")
+    journal.record_stage("op1", "shot_01", "i2v", SUBMITTED, task_id="t1")
+    journal.finish_operation("op1", status)
+    assert journal.interrupted_operations() == []
+    assert journal.submitted_stages() == []
+    assert journal.start_operation("op1", "u1", "s1") is False
+    assert journal.get_stage("op1", "shot_01", "i2v") is None
+
+
+def test_record_stage_keeps_unspecified_fields(journal):
+    journal.start_operation("op1", "u1", "s1")
+    journal.record_stage("op1", "shot_01", "i2v", SUBMITTED, provider="pixverse", task_id="v1", artifact="/a.mp4")
+    journal.record_stage("op1", "shot_01", "i2v", SUCCESS)
+    assert journal.get_stage("op1", "shot_01", "i2v") == {
+        "status": SUCCESS, "provider": "pixverse", "task_id": "v1", "artifact": "/a.mp4",
+    }
+    # 已结束的阶段不再作为待恢复任务
+    assert journal.submitted_stages() == []
+
+
+def test_submitted_stage_without_task_id_is_not_resumed(journal):
+    journal.start_operation("op1", "u1", "s1")
+    journal.record_stage("op1", "shot_01", "tts", RUNNING)
+    journal.record_stage("op1", "shot_02", "i2v", SUBMITTED)
+    assert journal.submitted_stages() == []
+
+
+def test_journal_survives_reopen(tmp_path):
+    path = tmp_path / "journal.db"
+    Journal(path).start_operation("op1", "u1", "s1")
+    assert Journal(path).start_operation("op1", "u1", "s1") is True
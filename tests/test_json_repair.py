@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from app_api.services.json_repair import repair_json
+
+
+def test_valid_json_needs_no_fix():
+    assert repair_json('{"shots": [1, 2]}') == ({"shots": [1, 2]}, [])
+
+
+def test_code_fence_and_trailing_comma():
+    text = '```json\n{"shots": [{"id": "a"}, {"id": "b"},]}\n```'
+    obj, fixes = repair_json(text)
+    assert obj == {"shots": [{"id": "a"}, {"id": "b"}]}
+    assert fixes == ["code_fence", "trailing_comma"]
+
+
+def test_truncated_output_keeps_complete_elements():
+    text = '{"shots": [{"id": "a", "detail": "雨夜"}, {"id": "b", "detail": "街'
+    obj, fixes = repair_json(text)
+    assert obj == {"shots": [{"id": "a", "detail": "雨夜"}]}
+    assert "truncated" in fixes
+
+
+def test_truncated_without_complete_element_raises():
+    with pytest.raises(ValueError):
+        repair_json('{"shots": [{"id": "a", "det')
+
+
+def test_curly_quotes_and_fullwidth_punct():
+    obj, fixes = repair_json('{“id”：“a”， “tone”: "平静"}')
+    assert obj == {"id": "a", "tone": "平静"}
+    assert "curly_quote" in fixes
+    assert "fullwidth_punct" in fixes
+
+
+def test_curly_quotes_inside_string_are_kept():
+    obj, fixes = repair_json('{"narration": "他说“走吧”然后离开"}')
+    assert obj == {"narration": "他说“走吧”然后离开"}
+    assert fixes == []
+
+
+def test_unescaped_inner_quote_and_newline():
+    obj, fixes = repair_json('{"detail": "招牌写着"营业中"\n灯光昏暗"}')
+    assert obj == {"detail": '招牌写着"营业中"\n灯光昏暗'}
+    assert fixes == ["inner_quote", "raw_newline"]
+
+
+def test_no_json_raises():
+    with pytest.raises(ValueError):
+        repair_json("抱歉，我无法生成分镜")
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import struct
+
+import pytest
+
+from app_api.services.mp3_utils import mp3_duration, pad_to_duration, silent_frame, split_at
+
+# MPEG-2 Layer III、48 kbps、22050 Hz、单声道：帧长 72 * 48000 // 22050 = 156 字节，每帧 576 个采样
+_HEADER = (0x7FF << 21) | (2 << 19) | (1 << 17) | (1 << 16) | (6 << 12) | (0 << 10) | (3 << 6)
+_FRAME_DURATION = 576 / 22050
+
+
+def _stream(frames: int) -> bytes:
+    return silent_frame(_HEADER) * frames
+
+
+def test_silent_frame_length():
+    frame = silent_frame(_HEADER)
+    assert len(frame) == 156
+    assert struct.unpack(">I", frame[:4])[0] == _HEADER
+
+
+def test_silent_frame_rejects_invalid_header():
+    with pytest.raises(ValueError):
+        silent_frame(0)
+
+
+def test_duration():
+    assert mp3_duration(_stream(100)) == pytest.approx(100 * _FRAME_DURATION)
+
+
+def test_duration_skips_id3v2_tag():
+    tag = b"ID3" + bytes([4, 0, 0, 0, 0, 0, 10]) + bytes(10)
+    assert mp3_duration(tag + _stream(10)) == pytest.approx(10 * _FRAME_DURATION)
+
+
+def test_duration_of_unsupported_stream_is_none():
+    assert mp3_duration(b"not an mp3 stream") is None
+    # 最后一帧被截断
+    assert mp3_duration(_stream(3)[:-10]) is None
+
+
+def test_pad_to_duration():
+    data = _stream(10)
+    padded, before, after = pad_to_duration(data, 1.0)
+    assert before == pytest.approx(10 * _FRAME_DURATION)
+    assert after >= 1.0
+    assert after - 1.0 < _FRAME_DURATION
+    assert mp3_duration(padded) == pytest.approx(after)
+
+
+def test_pad_to_duration_keeps_long_enough_stream():
+    data = _stream(50)
+    assert pad_to_duration(data, 0.5) == (data, 50 * _FRAME_DURATION, 50 * _FRAME_DURATION)
+
+
+def test_split_at_frame_boundaries():
+    data = _stream(100)
+    segments = split_at(data, [0.5, 1.5])
+    # 切点取最近的帧边界：0.5 秒 -> 第 19 帧，1.5 秒 -> 第 57 帧
+    assert [len(s) // 156 for s in segments] == [19, 38, 43]
+    assert b"".join(segments) == data
+
+
+def test_split_clamps_boundaries_beyond_end():
+    data = _stream(10)
+    segments = split_at(data, [100.0])
+    assert segments == [data, b""]
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+
+import pytest
+
+pytest.importorskip("loguru")
+
+from app_api.services import scheduler as scheduler_module
+from app_api.services.scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, StageScheduler
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def blocked():
+    """占住单槽位阶段 s 的调度器：测试先排好队，再放行观察出队顺序"""
+    sched = StageScheduler({"s": 1}, {})
+    gate = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        started.set()
+        gate.wait(TIMEOUT)
+
+    sched.submit("s", hold, tenant="blocker")
+    assert started.wait(TIMEOUT)
+    return sched, gate
+
+
+def _run_in_order(sched, gate, jobs):
+    """jobs: [(名称, tenant, priority)]，返回实际执行顺序"""
+    order = []
+    futures = [
+        sched.submit("s", order.append, name, tenant=tenant, priority=priority)
+        for name, tenant, priority in jobs
+    ]
+    gate.set()
+    for f in futures:
+        f.result(TIMEOUT)
+    return order
+
+
+def test_tenants_are_round_robin(blocked):
+    sched, gate = blocked
+    jobs = [(f"a{i}", "A", PRIORITY_BATCH) for i in range(3)] + [(f"b{i}", "B", PRIORITY_BATCH) for i in range(2)]
+    assert _run_in_order(sched, gate, jobs) == ["a0", "b0", "a1", "b1", "a2"]
+
+
+def test_interactive_lane_goes_first(blocked):
+    sched, gate = blocked
+    jobs = [("batch", "A", PRIORITY_BATCH), ("ui", "B", PRIORITY_INTERACTIVE)]
+    assert _run_in_order(sched, gate, jobs) == ["ui", "batch"]
+
+
+def test_batch_lane_is_not_starved(blocked, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "PRIORITY_INTERACTIVE_BURST", 2)
+    sched, gate = blocked
+    jobs = [(f"b{i}", "A", PRIORITY_BATCH) for i in range(2)] + [(f"i{i}", "B", PRIORITY_INTERACTIVE) for i in range(5)]
+    assert _run_in_order(sched, gate, jobs) == ["i0", "i1", "b0", "i2", "i3", "b1", "i4"]
+
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError):
+        StageScheduler({"s": 1}, {}).submit("s", print, priority="urgent")
+
+
+def _max_concurrency(sched, jobs):
+    """jobs: [(stage, provider)]，每个任务运行一小段时间，返回同时运行数的峰值"""
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def work():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    futures = [sched.submit(stage, work, tenant=f"t{i}", provider=provider) for i, (stage, provider) in enumerate(jobs)]
+    for f in futures:
+        f.result(TIMEOUT)
+    return peak[0]
+
+
+def test_stage_limit():
+    sched = StageScheduler({"s": 2}, {})
+    assert _max_concurrency(sched, [("s", None)] * 6) == 2
+
+
+def test_provider_limit_across_stages():
+    sched = StageScheduler({"a": 3, "b": 3}, {"p": 2})
+    assert _max_concurrency(sched, [("a", "p"), ("b", "p")] * 3) == 2
+
+
+def test_provider_at_limit_does_not_block_other_tenants():
+    sched = StageScheduler({"s": 2}, {"p": 1})
+    gate = threading.Event()
+    sched.submit("s", gate.wait, TIMEOUT, tenant="A", provider="p")
+    queued = sched.submit("s", print, tenant="A", provider="p")
+    other = sched.submit("s", lambda: "done", tenant="B", provider="q")
+    assert other.result(TIMEOUT) == "done"
+    assert not queued.done()
+    gate.set()
+    queued.result(TIMEOUT)
+
+
+def test_async_result_holds_slot_until_done():
+    sched = StageScheduler({"s": 1}, {})
+    inner: Future = Future()
+    outer = sched.submit("s", lambda: inner)
+    second = sched.submit("s", lambda: "second")
+    time.sleep(0.1)
+    assert not outer.done()
+    assert not second.done()
+    assert sched.stats()["stages"]["s"]["running"] == 1
+    inner.set_result("remote")
+    assert outer.result(TIMEOUT) == "remote"
+    assert second.result(TIMEOUT) == "second"
+
+
+def test_async_cancel_and_exception_propagate():
+    sched = StageScheduler({"s": 1}, {})
+    cancelled: Future = Future()
+    failed: Future = Future()
+    f1 = sched.submit("s", lambda: cancelled)
+    f2 = sched.submit("s", lambda: failed)
+    cancelled.cancel()
+    with pytest.raises(CancelledError):
+        f1.result(TIMEOUT)
+    failed.set_exception(RuntimeError("remote failed"))
+    with pytest.raises(RuntimeError):
+        f2.result(TIMEOUT)
+
+
+def test_cancel_tenant_drops_only_queued_tasks(blocked):
+    sched, gate = blocked
+    dropped = [sched.submit("s", print, tenant="A") for _ in range(2)]
+    kept = sched.submit("s", lambda: "kept", tenant="B")
+    assert sched.cancel_tenant("A") == 2
+    assert all(f.cancelled() for f in dropped)
+    gate.set()
+    assert kept.result(TIMEOUT) == "kept"
+    assert sched.stats()["stages"]["s"] == {
+        "limit": 1, "running": 0, "queued": 0,
+        "queued_by_priority": {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}, "tenants": 0,
+    }